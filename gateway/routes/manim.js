@@ -16,7 +16,7 @@ router.post('/', async (req, res) => {
     }
 });
 
-// POST /api/manim/render - 渲染代码
+// POST /api/manim/render?mode=url|stream|json - 渲染代码 (默认 url，stream 直接返回视频字节)
 router.post('/render', async (req, res) => {
     try {
         const manimClient = await import('../../services/manim/manim-client.js');
@@ -27,6 +27,27 @@ router.post('/render', async (req, res) => {
     }
 });
 
+// POST /api/manim/frame - 单帧画面 (指定时刻 / 指定动画之后)
+router.post('/frame', async (req, res) => {
+    try {
+        const manimClient = await import('../../services/manim/manim-client.js');
+        return manimClient.renderFrame(req, res);
+    } catch (error) {
+        console.error('[Manim Route] Frame Error:', error);
+        res.status(500).json({ success: false, error: error.message });
+    }
+});
+
+// GET /api/manim/upgrade/:id - 高清补渲状态
+router.get('/upgrade/:id', async (req, res) => {
+    try {
+        const manimClient = await import('../../services/manim/manim-client.js');
+        return manimClient.getUpgrade(req, res);
+    } catch (error) {
+        res.status(500).json({ success: false, error: error.message });
+    }
+});
+
 // GET /api/manim/status - 服务状态
 router.get('/status', async (req, res) => {
     try {
@@ -151,7 +151,14 @@ if (isDev) {
 
 // Proxy static video files to Manim service (running on 8001)
 // This is needed because Manim service returns relative URLs like /static/video_xxx.mp4
-app.get('/static/*.mp4', async (req, res) => {
+// Range / 条件请求头原样转发，206 / 304 与 ETag、immutable 缓存头原样带回，拖动进度条与重播不再整段回源
+const MEDIA_REQUEST_HEADERS = ['range', 'if-range', 'if-none-match'];
+const MEDIA_RESPONSE_HEADERS = [
+    'content-type', 'content-length', 'content-range', 'accept-ranges',
+    'etag', 'last-modified', 'cache-control'
+];
+
+app.get(/^\/static\/.+\.(mp4|png|webp|m3u8|ts)$/, async (req, res) => {
     let manimServiceUrl = process.env.MANIM_SERVICE_URL || 'http://localhost:8001';
     
     // Ensure URL has protocol
@@ -167,22 +174,31 @@ app.get('/static/*.mp4', async (req, res) => {
     const targetUrl = `${manimServiceUrl}${req.originalUrl}`;
 
     try {
-        const response = await fetch(targetUrl);
+        const headers = {};
+        for (const name of MEDIA_REQUEST_HEADERS) {
+            if (req.headers[name]) headers[name] = req.headers[name];
+        }
+        const response = await fetch(targetUrl, { headers });
         
-        if (!response.ok) {
+        if (!response.ok && response.status !== 304) {
+            if (response.status === 416) {
+                const contentRange = response.headers.get('content-range');
+                if (contentRange) res.setHeader('Content-Range', contentRange);
+                return res.status(416).end();
+            }
             return res.status(response.status).send('Video not found');
         }
 
         // Forward headers
-        const contentType = response.headers.get('content-type');
-        const contentLength = response.headers.get('content-length');
-        
-        if (contentType) res.setHeader('Content-Type', contentType);
-        if (contentLength) res.setHeader('Content-Length', contentLength);
+        res.status(response.status);
+        for (const name of MEDIA_RESPONSE_HEADERS) {
+            const value = response.headers.get(name);
+            if (value) res.setHeader(name, value);
+        }
 
         // Pipe the response body to the client
         // fetch response.body is a readable stream
-        if (response.body) {
+        if (response.body && response.status !== 304) {
             response.body.pipe(res);
         } else {
             res.end();
@@ -0,0 +1,284 @@
+# artifact_store.py
+"""
+内容寻址的渲染产物仓库
+以前每次渲染都以 video_<id>.mp4 / preview_<id>.png 平铺在 static/ 下：相同的渲染结果存了很多份，
+启动清理要 os.listdir 整个目录，两者都随访问量线性增长。这里：
+  - 产物按内容 sha256 命名，分片存放：{root}/ab/cd/abcd...{ext}，相同内容只存一份
+  - SQLite 记录每个产物的大小 / 访问时间，以及谁在引用它 (渲染缓存条目、对话记录、Prompt 缓存)
+  - 清理只查询 "无人引用且长期未访问" 的产物，不扫描目录
+root 位于 static/ 之下，产物的 URL 即 {url_prefix}/ab/cd/abcd...{ext}，内容不变，可永久缓存。
+"""
+
+import os
+import re
+import time
+import shutil
+import sqlite3
+import threading
+from collections import namedtuple
+
+from media_files import file_digest
+
+Artifact = namedtuple("Artifact", ["digest", "path", "url", "size"])
+
+_ARTIFACT_NAME = re.compile(r"^([0-9a-f]{64})(\.[A-Za-z0-9]+)?$")
+
+
+def parse_artifact_name(path_or_url):
+    """从仓库内的路径 / URL 中取出 (digest, ext)；不是仓库产物时返回 None"""
+    if not path_or_url:
+        return None
+    match = _ARTIFACT_NAME.match(os.path.basename(str(path_or_url)))
+    if not match:
+        return None
+    return match.group(1), match.group(2) or ""
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    digest   TEXT NOT NULL,
+    ext      TEXT NOT NULL,
+    size     INTEGER NOT NULL,
+    created  REAL NOT NULL,
+    accessed REAL NOT NULL,
+    PRIMARY KEY (digest, ext)
+);
+CREATE TABLE IF NOT EXISTS refs (
+    owner  TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (owner, digest)
+);
+CREATE INDEX IF NOT EXISTS refs_digest ON refs (digest);
+CREATE INDEX IF NOT EXISTS artifacts_accessed ON artifacts (accessed);
+"""
+
+
+class ArtifactStore:
+    """分片存放的产物仓库 + 引用计数
+
+    owner 是引用方的标识，例如 "cache:<渲染缓存键>"、"conversation:<对话条目 id>"；
+    同一 owner 对同一产物只计一次引用。
+    """
+
+    def __init__(self, root, db_path, url_prefix):
+        self.root = os.path.realpath(root)
+        self.db_path = db_path
+        self.url_prefix = url_prefix.rstrip("/")
+        self.stats = {"stored": 0, "deduped": 0, "removed": 0}
+        self._lock = threading.Lock()  # 入库在线程池里执行，连接跨线程共享
+        self.listeners = []  # 产物被删除后调用 listener(digests)；清空仓库时 digests 为 None
+        os.makedirs(self.root, exist_ok=True)
+        self._db = self._connect()
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript(_SCHEMA)
+        return db
+
+    # ---------- 路径与 URL ----------
+    def relpath_for(self, digest, ext):
+        return os.path.join(digest[:2], digest[2:4], f"{digest}{ext}")
+
+    def path_for(self, digest, ext):
+        return os.path.join(self.root, self.relpath_for(digest, ext))
+
+    def url_for(self, digest, ext):
+        return f"{self.url_prefix}/{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+    def parse(self, path_or_url):
+        return parse_artifact_name(path_or_url)
+
+    def contains(self, path):
+        path = os.path.realpath(path)
+        return os.path.commonpath([path, self.root]) == self.root and self.parse(path) is not None
+
+    # ---------- 入库 ----------
+    def ingest(self, src, owner=None):
+        """把文件收进仓库，返回 Artifact
+
+        src 随后变成指向仓库那一份的硬链接 (已有相同内容时也一样)，不额外占用空间，
+        由调用方随临时目录一起删除；调用方不得再原地改写 src。跨文件系统无法硬链接时复制一份。
+        """
+        digest, size = file_digest(src)
+        ext = os.path.splitext(src)[1].lower()
+        dest = self.path_for(digest, ext)
+        now = time.time()
+        # 放置文件与登记在同一把锁内完成，避免与 collect 删除同一产物交错
+        with self._lock:
+            if os.path.isfile(dest):
+                # 重复内容：src 换成指向已有那一份的硬链接，丢掉重复的数据块
+                _link_or_keep(dest, src)
+                self.stats["deduped"] += 1
+            else:
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                tmp = f"{dest}.{os.getpid()}.tmp"
+                try:
+                    os.link(src, tmp)
+                except OSError:
+                    # 跨文件系统：先复制到临时名再原子替换
+                    shutil.copyfile(src, tmp)
+                os.replace(tmp, dest)
+                self.stats["stored"] += 1
+            self._db.execute(
+                "INSERT INTO artifacts (digest, ext, size, created, accessed) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(digest, ext) DO UPDATE SET accessed = excluded.accessed",
+                (digest, ext, size, now, now)
+            )
+            if owner:
+                self._db.execute("INSERT OR IGNORE INTO refs (owner, digest) VALUES (?, ?)", (owner, digest))
+        return Artifact(digest, dest, self.url_for(digest, ext), size)
+
+    # ---------- 引用计数 ----------
+    def add_ref(self, path_or_url, owner):
+        """登记 owner 对某个产物的引用；不是仓库产物 (例如旧的平铺文件) 时忽略"""
+        parsed = self.parse(path_or_url)
+        if parsed is None:
+            return False
+        with self._lock:
+            self._db.execute("INSERT OR IGNORE INTO refs (owner, digest) VALUES (?, ?)", (owner, parsed[0]))
+            self._db.execute("UPDATE artifacts SET accessed = ? WHERE digest = ?", (time.time(), parsed[0]))
+        return True
+
+    def release(self, owner):
+        """撤销 owner 的全部引用，返回撤销的条数 (文件由 collect 统一回收)"""
+        with self._lock:
+            return self._db.execute("DELETE FROM refs WHERE owner = ?", (owner,)).rowcount
+
+    def release_prefix(self, prefix):
+        """撤销某一类 owner 的全部引用 (例如随临时目录一起消失的 Prompt 缓存)"""
+        with self._lock:
+            return self._db.execute(
+                "DELETE FROM refs WHERE substr(owner, 1, ?) = ?", (len(prefix), prefix)
+            ).rowcount
+
+    def refcount(self, path_or_url):
+        parsed = self.parse(path_or_url)
+        if parsed is None:
+            return 0
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM refs WHERE digest = ?", (parsed[0],)).fetchone()[0]
+
+    def touch(self, path_or_url):
+        parsed = self.parse(path_or_url)
+        if parsed is not None:
+            with self._lock:
+                self._db.execute("UPDATE artifacts SET accessed = ? WHERE digest = ?", (time.time(), parsed[0]))
+
+    def touch_many(self, accessed):
+        """批量刷新访问时间 {digest: 时间戳} (例如 /static 的分发记录)，只会往后推"""
+        if not accessed:
+            return
+        with self._lock:
+            self._db.executemany(
+                "UPDATE artifacts SET accessed = MAX(accessed, ?) WHERE digest = ?",
+                [(when, digest) for digest, when in accessed.items()]
+            )
+
+    # ---------- 回收 ----------
+    def collect(self, max_idle_seconds):
+        """删除无人引用、且超过 max_idle_seconds 未被访问的产物，返回 (删除个数, 释放字节数)"""
+        cutoff = time.time() - max_idle_seconds
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT digest, ext, size FROM artifacts "
+                "WHERE accessed < ? AND NOT EXISTS (SELECT 1 FROM refs WHERE refs.digest = artifacts.digest)",
+                (cutoff,)
+            ).fetchall()
+        removed, freed = [], 0
+        for digest, ext, size in rows:
+            if self._remove_unreferenced(digest, ext, cutoff):
+                removed.append(digest)
+                freed += size
+        self._removed(removed)
+        return len(removed), freed
+
+    def evict_to_budget(self, max_bytes, min_idle_seconds=0):
+        """总大小超过 max_bytes 时，按最近访问时间从旧到新删除无人引用的产物
+
+        min_idle_seconds 内访问过 (包括刚入库、还没来得及登记引用) 的产物不动。
+        返回 (删除个数, 释放字节数, 剩余总字节数)；被引用的产物永远不会删除，
+        因此全部被引用时可能仍然超出预算。
+        """
+        cutoff = time.time() - min_idle_seconds
+        with self._lock:
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM artifacts").fetchone()[0]
+            if total <= max_bytes:
+                return 0, 0, total
+            rows = self._db.execute(
+                "SELECT digest, ext, size FROM artifacts "
+                "WHERE accessed < ? AND NOT EXISTS (SELECT 1 FROM refs WHERE refs.digest = artifacts.digest) "
+                "ORDER BY accessed",
+                (cutoff,)
+            ).fetchall()
+        removed, freed = [], 0
+        for digest, ext, size in rows:
+            if total - freed <= max_bytes:
+                break
+            if self._remove_unreferenced(digest, ext, cutoff):
+                removed.append(digest)
+                freed += size
+        self._removed(removed)
+        return len(removed), freed, total - freed
+
+    def _removed(self, digests):
+        self.stats["removed"] += len(digests) if digests else 0
+        if digests or digests is None:
+            for listener in self.listeners:
+                try:
+                    listener(digests)
+                except Exception as e:
+                    print(f"⚠️ 产物删除通知失败: {e}")
+
+    def _remove_unreferenced(self, digest, ext, cutoff):
+        with self._lock:
+            # 查询之后可能刚被引用 / 重新入库 / 被访问：删除前在锁内再确认一次
+            deleted = self._db.execute(
+                "DELETE FROM artifacts WHERE digest = ? AND ext = ? AND accessed < ? "
+                "AND NOT EXISTS (SELECT 1 FROM refs WHERE refs.digest = ?)",
+                (digest, ext, cutoff, digest)
+            ).rowcount
+            if not deleted:
+                return False
+            try:
+                os.remove(self.path_for(digest, ext))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"⚠️ 产物删除失败 {digest[:12]}: {e}")
+        return True
+
+    def summary(self):
+        with self._lock:
+            count, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM artifacts").fetchone()
+            referenced, pinned = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM artifacts "
+                "WHERE EXISTS (SELECT 1 FROM refs WHERE refs.digest = artifacts.digest)"
+            ).fetchone()
+        return {"artifacts": count, "bytes": total, "referenced": referenced, "referenced_bytes": pinned, **self.stats}
+
+    def clear(self):
+        with self._lock:
+            self._db.close()
+            shutil.rmtree(self.root, ignore_errors=True)
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    os.remove(self.db_path + suffix)
+                except OSError:
+                    pass
+            os.makedirs(self.root, exist_ok=True)
+            self._db = self._connect()
+        self._removed(None)
+
+
+def _link_or_keep(target, path):
+    """把 path 原子地换成 target 的硬链接；无法硬链接 (跨文件系统) 时保留 path 原样"""
+    tmp = f"{path}.{os.getpid()}.link"
+    try:
+        os.link(target, tmp)
+    except OSError:
+        return False
+    os.replace(tmp, path)
+    return True
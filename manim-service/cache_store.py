@@ -0,0 +1,281 @@
+# cache_store.py
+"""
+带索引的键值缓存 (Prompt 缓存等)
+以前 Prompt 缓存是 temp_gen/cache.json：每次查询都重新读取、解析整个文件，每次写入都整体重写，
+没有任何加锁，而且随启动清理一起被删掉。这里把存储抽象成后端接口：
+  - SQLiteBackend (默认)：WAL 模式，主键索引，单条 UPSERT 即原子写入，多进程共享同一个库也安全
+  - RedisBackend：多节点共用的网络后端 (需要安装 redis 包)
+两者都支持按条目的 TTL；CacheStore 负责命名空间、序列化与命中统计，
+可选地在前面加一层进程内 LRU (memory_cache.MemoryLRU)。
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key     TEXT PRIMARY KEY,
+    value   TEXT NOT NULL,
+    expires REAL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires);
+"""
+
+
+class CacheBackend:
+    """后端接口：值都是字符串，expires 为绝对时间戳 (None 表示永不过期)"""
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, expires=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def purge_expired(self, prefix, now):
+        """删除 prefix 下已过期的条目，返回被删除的键"""
+        raise NotImplementedError
+
+    def clear(self, prefix):
+        """删除 prefix 下的全部条目，返回被删除的键"""
+        raise NotImplementedError
+
+    def count(self, prefix):
+        raise NotImplementedError
+
+    def scan(self, prefix):
+        """遍历 prefix 下未过期的 (key, value)"""
+        raise NotImplementedError
+
+
+class SQLiteBackend(CacheBackend):
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()  # 连接跨线程共享
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT value, expires FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None
+        return row[0]
+
+    def set(self, key, value, expires=None):
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO entries (key, value, expires, updated) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires = excluded.expires, "
+                "updated = excluded.updated",
+                (key, value, expires, time.time())
+            )
+
+    def delete(self, key):
+        with self._lock:
+            return self._db.execute("DELETE FROM entries WHERE key = ?", (key,)).rowcount > 0
+
+    def _delete_where(self, condition, params):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                keys = [row[0] for row in self._db.execute(f"SELECT key FROM entries WHERE {condition}", params)]
+                self._db.execute(f"DELETE FROM entries WHERE {condition}", params)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return keys
+
+    def purge_expired(self, prefix, now):
+        return self._delete_where(
+            "substr(key, 1, ?) = ? AND expires IS NOT NULL AND expires <= ?", (len(prefix), prefix, now)
+        )
+
+    def clear(self, prefix):
+        return self._delete_where("substr(key, 1, ?) = ?", (len(prefix), prefix))
+
+    def count(self, prefix):
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM entries WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)
+            ).fetchone()[0]
+
+    def scan(self, prefix):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT key, value FROM entries WHERE substr(key, 1, ?) = ? AND (expires IS NULL OR expires > ?)",
+                (len(prefix), prefix, time.time())
+            ).fetchall()
+        return rows
+
+
+class RedisBackend(CacheBackend):
+    """多节点共用的 Redis 后端
+
+    过期由 Redis 自己执行 (EXPIREAT)；另外用一个有序集合记录每个键的过期时间，
+    purge_expired 才能告诉调用方哪些键过期了 (以便释放它们持有的产物引用)。
+    """
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("使用 Redis 缓存后端需要先安装 redis 包 (pip install redis)") from e
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+
+    @staticmethod
+    def _index(key):
+        return f"{key.split(':', 1)[0]}:__expires__"
+
+    def get(self, key):
+        return self._redis.get(key)
+
+    def set(self, key, value, expires=None):
+        pipe = self._redis.pipeline()
+        pipe.set(key, value)
+        if expires is not None:
+            pipe.expireat(key, int(expires) + 1)
+            pipe.zadd(self._index(key), {key: expires})
+        else:
+            pipe.zrem(self._index(key), key)
+        pipe.execute()
+
+    def delete(self, key):
+        pipe = self._redis.pipeline()
+        pipe.delete(key)
+        pipe.zrem(self._index(key), key)
+        return pipe.execute()[0] > 0
+
+    def purge_expired(self, prefix, now):
+        index = self._index(prefix)
+        keys = [key for key in self._redis.zrangebyscore(index, "-inf", now) if key.startswith(prefix)]
+        if keys:
+            pipe = self._redis.pipeline()
+            pipe.delete(*keys)
+            pipe.zrem(index, *keys)
+            pipe.execute()
+        return keys
+
+    def clear(self, prefix):
+        keys = [key for key in self._redis.scan_iter(match=f"{prefix}*") if not key.endswith(":__expires__")]
+        if keys:
+            self._redis.delete(*keys)
+        self._redis.delete(self._index(prefix))
+        return keys
+
+    def count(self, prefix):
+        return sum(1 for key in self._redis.scan_iter(match=f"{prefix}*") if not key.endswith(":__expires__"))
+
+    def scan(self, prefix):
+        for key in self._redis.scan_iter(match=f"{prefix}*"):
+            if key.endswith(":__expires__"):
+                continue
+            value = self._redis.get(key)
+            if value is not None:
+                yield key, value
+
+
+def open_backend(url, sqlite_path):
+    """按配置创建后端：redis:// / rediss:// 走 Redis，其余 (包括留空) 使用本地 SQLite"""
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(url)
+    return SQLiteBackend(url[len("sqlite:///"):] if url.startswith("sqlite:///") else sqlite_path)
+
+
+class CacheStore:
+    """一个命名空间内的 JSON 值缓存
+
+    ttl: 条目的默认存活秒数 (0 表示永不过期)
+    memory: 可选的进程内 LRU，只缓存通过校验的值
+    validate(value): 从持久层读出时的校验，返回 False 的条目视为失效并删除
+    on_invalidate(key): 条目因过期 / 失效被删除后调用 (例如撤销它持有的引用)
+    """
+
+    def __init__(self, backend, namespace, ttl=0, memory=None, validate=None, on_invalidate=None):
+        self.backend = backend
+        self.prefix = f"{namespace}:"
+        self.ttl = ttl
+        self.memory = memory
+        self.validate = validate
+        self.on_invalidate = on_invalidate
+        self.stats = {"hits": 0, "misses": 0, "sets": 0, "expired": 0, "stale": 0}
+
+    def get(self, key):
+        if self.memory is not None:
+            value = self.memory.get(key)
+            if value is not None:
+                self.stats["hits"] += 1
+                return value
+        raw = self.backend.get(self.prefix + key)
+        if raw is None:
+            self.stats["misses"] += 1
+            return None
+        value = json.loads(raw)
+        if self.validate is not None and not self.validate(value):
+            self.stats["stale"] += 1
+            self.stats["misses"] += 1
+            self.delete(key)
+            self._invalidated([key])
+            return None
+        self.stats["hits"] += 1
+        if self.memory is not None:
+            self.memory.put(key, value)
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.time() + ttl if ttl else None
+        self.backend.set(self.prefix + key, json.dumps(value, ensure_ascii=False), expires)
+        if self.memory is not None:
+            self.memory.invalidate(key)
+        self.stats["sets"] += 1
+
+    def delete(self, key):
+        if self.memory is not None:
+            self.memory.invalidate(key)
+        return self.backend.delete(self.prefix + key)
+
+    def purge_expired(self):
+        """删除已过期的条目，返回它们的键 (不含命名空间)"""
+        keys = [key[len(self.prefix):] for key in self.backend.purge_expired(self.prefix, time.time())]
+        self.stats["expired"] += len(keys)
+        if self.memory is not None:
+            for key in keys:
+                self.memory.invalidate(key)
+        self._invalidated(keys)
+        return keys
+
+    def items(self):
+        """遍历全部未过期的 (key, value) (不含命名空间，不经过内存层与校验)"""
+        for key, raw in self.backend.scan(self.prefix):
+            yield key[len(self.prefix):], json.loads(raw)
+
+    def clear(self):
+        if self.memory is not None:
+            self.memory.clear()
+        return [key[len(self.prefix):] for key in self.backend.clear(self.prefix)]
+
+    def _invalidated(self, keys):
+        if self.on_invalidate is None:
+            return
+        for key in keys:
+            try:
+                self.on_invalidate(key)
+            except Exception as e:
+                print(f"⚠️ 缓存失效回调出错: {e}")
+
+    def summary(self):
+        summary = {"backend": type(self.backend).__name__, "entries": self.backend.count(self.prefix), **self.stats}
+        if self.memory is not None:
+            summary["memory"] = self.memory.summary()
+        return summary
@@ -0,0 +1,105 @@
+# frame_scrub.py
+"""
+任意时刻的单帧渲染 (scrub)
+老师调整某一步的排版时只想看那一帧，不想等整段视频。这里在渲染进程内包装 Scene：
+配合 -s (save_last_frame)，目标之前的动画本来就只计算状态、不输出画面；
+累计场景时间 / 动画序号，到达目标时把当前动画插值到该时刻并提前结束场景，
+manim 随后按 -s 的正常流程把这一帧存成图片。
+"""
+
+import os
+import contextlib
+
+# 对外支持的图片格式 (webp 需要 Pillow，缺失时退回 png)
+FRAME_FORMATS = ("png", "webp")
+
+
+def parse_scrub(at_time=None, after_animation=None):
+    """校验参数并返回 scrub 描述 {"time": t} / {"animation": k}；两者都没给时返回 None"""
+    if at_time is not None and after_animation is not None:
+        raise ValueError("time 与 animation 只能指定一个")
+    if at_time is not None:
+        at_time = float(at_time)
+        if at_time < 0:
+            raise ValueError("time 不能为负数")
+        return {"time": at_time}
+    if after_animation is not None:
+        after_animation = int(after_animation)
+        if after_animation < 0:
+            raise ValueError("animation 不能为负数")
+        return {"animation": after_animation}
+    return None
+
+
+def scrub_label(scrub):
+    """用于缓存键 / 文件名的简短描述，如 t1.5 / a3"""
+    if "time" in scrub:
+        return f"t{scrub['time']:g}"
+    return f"a{scrub['animation']}"
+
+
+@contextlib.contextmanager
+def scrub_scene(at_time=None, after_animation=None):
+    """在当前 (渲染) 进程内临时挂钩 Scene，使场景停在目标时刻 / 第 k 个动画之后
+
+    after_animation=0 表示第一个动画开始前的画面。
+    """
+    from manim.scene.scene import Scene
+    from manim.utils.exceptions import EndSceneEarlyException
+
+    original_play = Scene.play
+    original_play_internal = Scene.play_internal
+
+    def play(self, *args, **kwargs):
+        elapsed = getattr(self, "_scrub_elapsed", 0.0)
+        played = getattr(self, "_scrub_played", 0)
+        # 目标落在两个动画之间：之前的 add / remove 已生效，直接出图
+        if at_time is not None and elapsed >= at_time:
+            raise EndSceneEarlyException()
+        if after_animation is not None and played >= after_animation:
+            raise EndSceneEarlyException()
+        result = original_play(self, *args, **kwargs)
+        # 静止的 wait 不经过 play_internal，时间在这里统一累计
+        duration = self.get_run_time(self.animations) if self.animations else 0.0
+        self._scrub_elapsed = elapsed + duration
+        self._scrub_played = played + 1
+        return result
+
+    def play_internal(self, skip_rendering=False):
+        elapsed = getattr(self, "_scrub_elapsed", 0.0)
+        if at_time is not None and elapsed + self.get_run_time(self.animations) > at_time:
+            # 目标落在本动画中间：插值到该时刻后结束，不调用 finish()
+            self.update_to_time(at_time - elapsed)
+            raise EndSceneEarlyException()
+        return original_play_internal(self, skip_rendering)
+
+    Scene.play = play
+    Scene.play_internal = play_internal
+    try:
+        yield
+    finally:
+        Scene.play = original_play
+        Scene.play_internal = original_play_internal
+
+
+def scrub_context(scrub):
+    """按 scrub 描述返回对应的上下文；scrub 为空时什么也不做"""
+    if not scrub:
+        return contextlib.nullcontext()
+    return scrub_scene(scrub.get("time"), scrub.get("animation"))
+
+
+def encode_frame(src, dest, fmt="png"):
+    """把 manim 输出的 png 转存为目标格式，返回实际写出的路径 (无法转换时原样保留 png)"""
+    if fmt == "webp":
+        try:
+            from PIL import Image
+            with Image.open(src) as image:
+                image.save(dest, "WEBP", quality=80, method=4)
+            os.remove(src)
+            return dest
+        except Exception as e:
+            print(f"⚠️ WebP 转换失败，改为返回 PNG: {e}")
+    png_dest = os.path.splitext(dest)[0] + ".png"
+    os.replace(src, png_dest)
+    return png_dest
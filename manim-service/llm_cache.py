@@ -0,0 +1,130 @@
+# llm_cache.py
+"""
+按阶段缓存的大模型调用
+一次对话要依次调用 意图分析 → 生成器 → 分析器 → 改进器 (失败时还有修复器)，每一轮都是数秒的往返；
+重复 / 换个说法的指令、渲染失败后的重试，都会把这些阶段从头再算一遍。这里包装
+client.chat.completions.create：
+  - 键 = (阶段, 模型, temperature, 其余请求参数, 规范化后的 messages) 的哈希；规范化只做 NFKC
+    与空白折叠，不改动代码之类的实质内容
+  - 每个阶段单独配置 TTL，未配置的阶段照常直接调用 (默认只缓存低温的意图分析 / 分析器)
+  - 按阶段统计调用次数、命中率与节省的耗时
+"""
+
+import json
+import time
+import hashlib
+import unicodedata
+
+from cache_store import CacheStore
+
+
+def _normalize_content(content):
+    if not isinstance(content, str):
+        return content
+    text = unicodedata.normalize("NFKC", content)
+    # 去掉行尾空白、合并连续空行；行首缩进不动 (代码的缩进有意义)
+    lines = [line.rstrip() for line in text.strip("\n").splitlines()]
+    folded = []
+    for line in lines:
+        if line or (folded and folded[-1]):
+            folded.append(line)
+    return "\n".join(folded)
+
+
+def request_key(stage, model, temperature, messages, options=None):
+    """options: 其余发给 API 的参数 (max_tokens、response_format 等)，不同的参数不共用回复"""
+    material = json.dumps(
+        {
+            "stage": stage,
+            "model": model,
+            "temperature": temperature,
+            "options": options or {},
+            "messages": [
+                {"role": message.get("role"), "content": _normalize_content(message.get("content"))}
+                for message in messages
+            ],
+        },
+        ensure_ascii=False, sort_keys=True, default=str
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class CachedLLM:
+    """带阶段缓存的 chat completions 调用
+
+    stage_ttls: {阶段: 存活秒数}，只缓存其中列出的阶段
+    """
+
+    def __init__(self, client, backend, stage_ttls, enabled=True):
+        self.client = client
+        self.store = CacheStore(backend, "llm")
+        self.stage_ttls = dict(stage_ttls)
+        self.enabled = enabled
+        self.stats = {}  # stage -> 计数
+
+    def _stage_stats(self, stage):
+        return self.stats.setdefault(stage, {
+            "calls": 0, "hits": 0, "misses": 0, "errors": 0, "api_seconds": 0.0, "saved_seconds": 0.0,
+        })
+
+    def caches(self, stage):
+        return self.enabled and stage in self.stage_ttls
+
+    async def complete(self, stage, *, model, messages, temperature=None, **kwargs):
+        """调用模型并返回回复文本 (message.content)；命中缓存时不发请求"""
+        stats = self._stage_stats(stage)
+        stats["calls"] += 1
+        key = None
+        if self.caches(stage):
+            key = request_key(stage, model, temperature, messages, kwargs)
+            try:
+                cached = self.store.get(key)
+            except Exception as e:
+                print(f"⚠️ LLM 缓存读取失败 ({stage}): {e}")
+                cached = None
+            if cached is not None:
+                stats["hits"] += 1
+                stats["saved_seconds"] += cached.get("seconds", 0.0)
+                return cached["content"]
+            stats["misses"] += 1
+
+        params = dict(kwargs, model=model, messages=messages, stream=False)
+        if temperature is not None:
+            params["temperature"] = temperature
+        started = time.time()
+        try:
+            response = await self.client.chat.completions.create(**params)
+        except Exception:
+            stats["errors"] += 1
+            raise
+        seconds = time.time() - started
+        stats["api_seconds"] += seconds
+        content = response.choices[0].message.content
+
+        # 空回复 / 被截断的回复不缓存，下次重新请求
+        finish_reason = getattr(response.choices[0], "finish_reason", None)
+        if key is not None and content and finish_reason in (None, "stop"):
+            try:
+                self.store.set(key, {"content": content, "seconds": round(seconds, 3)}, ttl=self.stage_ttls[stage])
+            except Exception as e:
+                print(f"⚠️ LLM 缓存写入失败 ({stage}): {e}")
+        return content
+
+    def purge_expired(self):
+        return self.store.purge_expired()
+
+    def clear(self):
+        self.store.clear()
+
+    def summary(self):
+        stages = {}
+        for stage, stats in self.stats.items():
+            lookups = stats["hits"] + stats["misses"]
+            stages[stage] = {
+                **stats,
+                "api_seconds": round(stats["api_seconds"], 2),
+                "saved_seconds": round(stats["saved_seconds"], 2),
+                "cached": self.caches(stage),
+                "hit_rate": round(stats["hits"] / lookups, 3) if lookups else None,
+            }
+        return {"enabled": self.enabled, "ttls": self.stage_ttls, "stages": stages}
@@ -6,19 +6,21 @@ import asyncio
 import uuid
 import json
 import logging
-import threading
 import re
 import ast
 import hashlib
 import time
+import threading
 
 import contextlib
+import contextvars
+from collections import OrderedDict
 from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse, JSONResponse, HTMLResponse
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
+from typing import Optional
 from openai import AsyncOpenAI 
 from dotenv import load_dotenv
 
@@ -46,6 +48,36 @@ MANIM_TIMEOUT = config.MANIM_TIMEOUT
 DEFAULT_SCENE_NAME = config.DEFAULT_SCENE_NAME
 DEFAULT_QUALITY = config.DEFAULT_QUALITY
 
+from render_pool import RenderWorkerPool
+from render_manager import RenderProcessManager, RenderJob, RenderResult, OBJECTS_DUMP_NAME
+from render_cache import RenderCache
+from partial_cache import PartialMovieCache
+from render_farm import RenderFarm, token_matches
+from render_limits import ResourceLimits, CgroupLanes, ERROR_RESOURCE_LIMIT
+from section_render import plan_sections
+from static_scene import encode_still_clip, is_static_scene
+from scratch_pool import ScratchPool
+from frame_scrub import FRAME_FORMATS, parse_scrub, scrub_label, encode_frame
+from media_files import MediaFiles
+from artifact_store import ArtifactStore, parse_artifact_name
+from progressive import ProgressiveStream
+from storage_gc import StorageGC
+from cache_store import CacheStore, open_backend
+from memory_cache import MemoryLRU
+from prompt_match import PromptIndex, normalize_prompt, context_hash
+from llm_cache import CachedLLM
+from pipeline_policy import PipelinePolicy, guess_intent, speculation_holds
+from render_scheduler import (
+    RenderScheduler,
+    QueueFullError,
+    JobSupersededError,
+    LANE_PREVIEW,
+    LANE_INTERACTIVE,
+    LANE_GATEWAY,
+    LANE_BATCH,
+    LANES
+)
+
 
 from prompts import (
     PROMPT_GENERATOR,
@@ -60,17 +92,55 @@ from prompts import (
 )
 
 # ================= 📝 缓存系统 (MD5指纹) =================
-CACHE_FILE = os.path.join(TEMP_DIR, "cache.json")
+def make_memory_tier(tag_of):
+    """渲染缓存 / Prompt 缓存前面的进程内 LRU，条目以产物内容哈希为标签"""
+    return MemoryLRU(
+        max_entries=config.MEMORY_CACHE_MAX_ENTRIES,
+        max_bytes=config.MEMORY_CACHE_MAX_KB * 1024,
+        ttl=config.MEMORY_CACHE_TTL,
+        tag_of=tag_of
+    )
+
+def prompt_entry_valid(entry):
+    """回填内存层之前确认视频还在本机 (旧版平铺文件可能已被清理、或由其它节点写入)"""
+    video_url = entry.get("video_url") or ""
+    return not video_url.startswith("/static/") or os.path.isfile(static_path(video_url))
+
+def forget_prompt_entry(key):
+    """Prompt 缓存条目被删除 (过期 / 视频失效)：撤销它对产物的引用，并移出近似匹配索引"""
+    artifact_store.release(f"prompt:{key}")
+    prompt_index.remove(key)
+
+# Prompt 缓存：默认本地 SQLite (WAL)，PROMPT_CACHE_URL 指向 redis:// 时多节点共用；热门指令直接从内存返回
+prompt_cache = CacheStore(
+    open_backend(config.PROMPT_CACHE_URL, config.PROMPT_CACHE_DB_PATH),
+    "prompt",
+    ttl=config.PROMPT_CACHE_TTL_HOURS * 3600,
+    memory=make_memory_tier(lambda entry: [(parse_artifact_name(entry.get("video_url")) or (None,))[0]]),
+    validate=prompt_entry_valid,
+    on_invalidate=forget_prompt_entry
+)
 
-def load_cache():
-    """加载缓存文件"""
-    if os.path.exists(CACHE_FILE):
-        try:
-            with open(CACHE_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except:
-            return {}
-    return {}
+# 近似匹配索引 (进程内)：同一代码上下文下，只差几个虚词的指令也算命中
+prompt_index = PromptIndex(threshold=config.PROMPT_MATCH_THRESHOLD)
+prompt_match_stats = {"exact": 0, "near": 0}
+
+def rebuild_prompt_index():
+    """启动时从持久化的 Prompt 缓存重建近似匹配索引"""
+    try:
+        for key, entry in prompt_cache.items():
+            if entry.get("prompt") is not None and entry.get("context"):
+                prompt_index.add(key, entry["prompt"], entry["context"])
+    except Exception as e:
+        print(f"⚠️ Prompt 近似匹配索引重建失败: {e}")
+
+rebuild_prompt_index()
+
+def prompt_cache_key(normalized_prompt, code_context):
+    # 核心修改：Key 包含了 prompt 和 current_code，确保上下文一致才命中
+    # prompt 先做归一化 (标点 / 全半角 / 停用词)，写法上的差别不影响命中
+    content = f"{normalized_prompt}_{code_context}"
+    return hashlib.md5(content.encode('utf-8')).hexdigest()
 
 def get_current_code_content():
     """安全获取当前场景代码的完整内容"""
@@ -83,25 +153,47 @@ def get_current_code_content():
     return ""
 
 def save_cache_entry(prompt, video_url, current_code=""):
-    """保存缓存条目，使用 Prompt + 当前代码内容的 MD5 作为键"""
-    cache = load_cache()
-    # 核心修改：Key 包含了 prompt 和 current_code，确保上下文一致才命中
-    content = f"{prompt.strip()}_{current_code.strip()}"
-    key = hashlib.md5(content.encode('utf-8')).hexdigest()
-    
-    cache[key] = video_url
+    """保存缓存条目，使用 归一化 Prompt + 当前代码内容 的 MD5 作为键"""
+    normalized, context = normalize_prompt(prompt), context_hash(current_code)
+    key = prompt_cache_key(normalized, context)
     try:
-        with open(CACHE_FILE, "w", encoding="utf-8") as f:
-            json.dump(cache, f, ensure_ascii=False, indent=2)
+        prompt_cache.set(key, {"video_url": video_url, "prompt": normalized, "context": context})
     except Exception as e:
         print(f"⚠️ 缓存保存失败: {e}")
+        return
+    prompt_index.add(key, normalized, context)
+    # Prompt 缓存也是产物的引用方 (同一个键覆盖时换成新视频)
+    artifact_store.release(f"prompt:{key}")
+    artifact_store.add_ref(video_url, f"prompt:{key}")
 
 def get_cached_video(prompt, current_code=""):
-    """尝试获取缓存的视频链接，必须匹配当前代码上下文"""
-    cache = load_cache()
-    content = f"{prompt.strip()}_{current_code.strip()}"
-    key = hashlib.md5(content.encode('utf-8')).hexdigest()
-    return cache.get(key)
+    """尝试获取缓存的视频链接，必须匹配当前代码上下文
+
+    先按归一化后的 Prompt 精确查找，未命中再在同一代码上下文里找足够相似的已缓存指令。
+    """
+    normalized, context = normalize_prompt(prompt), context_hash(current_code)
+    try:
+        # 失效的条目 (视频已不在本机) 由 prompt_cache 删除并撤销引用，这里当作未命中
+        entry = prompt_cache.get(prompt_cache_key(normalized, context))
+        if entry:
+            prompt_match_stats["exact"] += 1
+            return entry["video_url"]
+        if prompt_index.threshold >= 1:
+            return None
+        for key, similarity in prompt_index.query(normalized, context):
+            entry = prompt_cache.get(key)
+            if entry:
+                prompt_match_stats["near"] += 1
+                print(f"✨ 近似命中 (相似度 {similarity:.2f}): {entry.get('prompt')}")
+                return entry["video_url"]
+    except Exception as e:
+        print(f"⚠️ 缓存读取失败: {e}")
+    return None
+
+def expire_prompt_cache():
+    """删除过期的 Prompt 缓存条目 (撤销引用由 on_invalidate 完成，由存储回收定期调用)"""
+    prompt_cache.purge_expired()
+    llm.purge_expired()
 
 # ================= 🔍 代码分析器 (静态AST) =================
 def analyze_code_structure(code: str):
@@ -113,6 +205,8 @@ def analyze_code_structure(code: str):
             "methods": [],
             "variables": [],
             "animations": [],
+            "play_calls": 0,
+            "is_static": False,  # 没有任何 play / wait：只有一帧画面，可走静态快速通道
             "has_axes": False,
             "objects": []
         }
@@ -134,9 +228,14 @@ def analyze_code_structure(code: str):
                 if hasattr(node.func, 'attr'):
                     if node.func.attr in ['Create', 'Play', 'Transform', 'FadeIn', 'FadeOut', 'Rotate', 'Write']:
                         analysis["animations"].append(node.func.attr)
+                    # self.play / self.wait 各对应 manim 的一段动画 (用于估算渲染进度)
+                    if node.func.attr in ['play', 'wait']:
+                        analysis["play_calls"] += 1
                 if hasattr(node.func, 'id'):
                     if node.func.id in ['Axes', 'ThreeDAxes', 'NumberPlane']:
                         analysis["has_axes"] = True
+        # 没找到场景类时不敢下结论，走正常的视频渲染
+        analysis["is_static"] = analysis["scene_class"] is not None and is_static_scene(tree)
         return analysis
     except:
         return {"error": "代码解析失败"}
@@ -178,38 +277,25 @@ def cleanup_workspace_startup():
         except Exception as e: 
             print(f"   - 临时目录清理失败: {e}")
             
-    # 2. 静态资源区 (static) - 清理超过24小时的旧视频
-    if os.path.exists(STATIC_DIR):
-        now = time.time()
-        expiration_seconds = 24 * 3600 # 24小时
-        deleted_count = 0
-        
-        try:
-            for filename in os.listdir(STATIC_DIR):
-                file_path = os.path.join(STATIC_DIR, filename)
-                
-                # 只清理媒体文件，保留 .gitkeep
-                if not (filename.endswith(".mp4") or filename.endswith(".png")):
-                    continue
-                    
-                if os.path.isfile(file_path):
-                    # 检查最后修改时间
-                    if now - os.path.getmtime(file_path) > expiration_seconds:
-                        try:
-                            os.remove(file_path)
-                            deleted_count += 1
-                        except:
-                            pass
-        except Exception as e:
-            print(f"   - 静态扫描出错: {e}")
-        
-        if deleted_count > 0:
-            print(f"   - 已清除 {deleted_count} 个过期视频/图片")
+    # 对话记录在临时目录里，随之清空了，它持有的引用也一并撤销 (Prompt 缓存是持久化的，引用保留)
+    artifact_store.release_prefix("conversation:")
+    
+    # 渐进式播放列表只在渲染期间有用
+    shutil.rmtree(config.STREAM_DIR, ignore_errors=True)
+    
+    # 2. 产物仓库与旧版平铺文件 - 与后台回收同一套规则 (保留期 + 大小预算)，仓库部分只查索引
+    try:
+        result = storage_gc.collect()
+        if result["removed"] > 0:
+            print(f"   - 已回收 {result['removed']} 个过期产物 ({result['freed'] / 1024 / 1024:.1f} MB)")
         else:
-            print("   - 静态区无过期文件")
+            print("   - 产物仓库无过期文件")
+    except Exception as e:
+        print(f"   - 产物回收出错: {e}")
     
     # 3. 确保目录结构完整
     os.makedirs(STATIC_DIR, exist_ok=True)
+    os.makedirs(config.STREAM_DIR, exist_ok=True)
     os.makedirs(TEMP_DIR, exist_ok=True)
     os.makedirs(TEMPLATES_DIR, exist_ok=True)
     
@@ -234,32 +320,84 @@ def hard_reset_system():
                 except: 
                     pass
     
-    # 3. 清理记忆文件
+    # 3. 清理产物仓库与渲染缓存
+    artifact_store.clear()
+    shutil.rmtree(config.STREAM_DIR, ignore_errors=True)
+    render_cache.clear()
+    prompt_cache.clear()
+    prompt_index.clear()
+    llm.clear()
+    if partial_cache is not None:
+        partial_cache.clear()
+    shutil.rmtree(config.TEX_CACHE_DIR, ignore_errors=True)
+    
+    # 4. 清理记忆文件
     for f in [HISTORY_FILE, CONVERSATION_FILE, SCENE_FILE]:
         if os.path.exists(f):
             try: os.remove(f)
             except: pass
             
-    # 4. 重建目录
+    # 5. 重建目录
     os.makedirs(STATIC_DIR, exist_ok=True)
+    os.makedirs(config.STREAM_DIR, exist_ok=True)
     os.makedirs(TEMP_DIR, exist_ok=True)
 
 @contextlib.asynccontextmanager
 async def lifespan(app: FastAPI):
     # 启动时只执行轻量清理，保护视频
     cleanup_workspace_startup()
+    render_cgroups.setup(LANES)
+    # 运行期间持续回收 static/ 与 temp_gen/
+    storage_gc.start()
+    # 后台预热常驻渲染进程
+    if config.RENDER_POOL_ENABLED:
+        await render_pool.start()
+    if render_farm is not None:
+        await render_farm.start()
     yield
+    await storage_gc.close()
+    if render_farm is not None:
+        await render_farm.close()
+    await render_manager.shutdown()
+    await render_pool.close()
 
 app = FastAPI(lifespan=lifespan)
-app.mount("/static", StaticFiles(directory=config.STATIC_DIR), name="static")
 templates = Jinja2Templates(directory=config.TEMPLATES_DIR)
 
+# 📼 渲染产物分发：Range / 强 ETag / immutable 缓存，可交给前置代理传输
+media_files = MediaFiles(
+    STATIC_DIR,
+    accel_header=config.MEDIA_ACCEL_HEADER,
+    accel_prefix=config.MEDIA_ACCEL_PREFIX,
+    content_addressed=config.ARTIFACT_STORE_DIR
+)
+
+@app.api_route("/static/{name:path}", methods=["GET", "HEAD"], include_in_schema=False)
+async def serve_media(name: str, request: Request):
+    return await media_files.serve(name, request.headers)
+
 client = AsyncOpenAI(
     api_key=API_KEY, 
     base_url=BASE_URL, 
     timeout=REQUEST_TIMEOUT
 )
 
+# 所有大模型调用都经过这里：按阶段缓存回复 (与 Prompt 缓存共用存储后端)，并按阶段统计
+llm = CachedLLM(client, prompt_cache.backend, config.LLM_CACHE_TTLS, enabled=config.LLM_CACHE_ENABLED)
+
+# 按意图类型学习何时可以跳过分析器 + 改进器 (统计同样存在缓存后端里，重启后保留)
+pipeline_policy = PipelinePolicy(
+    CacheStore(prompt_cache.backend, "pipeline"),
+    mode=config.PIPELINE_MODE,
+    min_samples=config.PIPELINE_FAST_MIN_SAMPLES,
+    max_change_rate=config.PIPELINE_FAST_MAX_CHANGE_RATE,
+    max_fail_rate=config.PIPELINE_FAST_MAX_FAIL_RATE,
+    min_confidence=config.PIPELINE_FAST_MIN_CONFIDENCE,
+    explore=config.PIPELINE_FAST_EXPLORE
+)
+# 生成器推测执行的结果：hits 采用了推测的初稿，misses 因意图不符重新生成
+speculation_stats = {"hits": 0, "misses": 0, "errors": 0}
+
 # ================= 📝 智能上下文管理器 =================
 class SmartContextManager:
     """智能上下文管理器，深度理解代码结构"""
@@ -269,10 +407,12 @@ class SmartContextManager:
         self.history_path = HISTORY_FILE
         self.scene_path = SCENE_FILE
         self.max_history_entries = MAX_HISTORY_ENTRIES
+        self._save_lock = threading.Lock()  # 保存在线程里执行，并发请求的 读-改-写 要串行
         
     def save_conversation(self, user_prompt: str, response_data: dict, code_analysis: dict = None):
         """保存对话记录，包含代码分析"""
         entry = {
+            "id": uuid.uuid4().hex[:12],
             "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
             "user": user_prompt,
             "generator_draft": response_data.get("generator_draft", ""),
@@ -284,14 +424,24 @@ class SmartContextManager:
             "intent_analysis": response_data.get("intent_analysis", "")
         }
         
-        conversation = self.load_conversation()
-        conversation.append(entry)
-        
-        if len(conversation) > self.max_history_entries:
-            conversation = conversation[-self.max_history_entries:]
+        with self._save_lock:
+            conversation = self.load_conversation()
+            conversation.append(entry)
             
-        with open(self.conversation_path, "w", encoding="utf-8") as f:
-            json.dump(conversation, f, ensure_ascii=False, indent=2)
+            dropped = []
+            if len(conversation) > self.max_history_entries:
+                dropped = conversation[:-self.max_history_entries]
+                conversation = conversation[-self.max_history_entries:]
+                
+            with open(self.conversation_path, "w", encoding="utf-8") as f:
+                json.dump(conversation, f, ensure_ascii=False, indent=2)
+        
+        # 对话记录引用着它的视频：新条目加引用，被挤出历史的条目放下引用
+        if entry["video_url"]:
+            artifact_store.add_ref(entry["video_url"], f"conversation:{entry['id']}")
+        for old_entry in dropped:
+            if old_entry.get("id"):
+                artifact_store.release(f"conversation:{old_entry['id']}")
     
     def load_conversation(self):
         if not os.path.exists(self.conversation_path):
@@ -452,108 +602,447 @@ def extract_json_from_response(text):
     return None
 
 # ================= 🛡️ 并发风暴防御系统 =================
-# ================= 🛡️ 并发风暴防御系统 =================
-class RenderProcessManager:
-    """Manim 渲染进程管理器 (支持多用户隔离)"""
-    def __init__(self):
-        # 字典结构: { "client_123": <subprocess.Popen object>, ... }
-        self._active_processes = {} 
-        self._lock = threading.Lock()
-        
-    def kill_process_for_client(self, client_id):
-        """精准狙击：只杀掉指定用户的旧进程"""
-        with self._lock:
-            if client_id in self._active_processes:
-                proc = self._active_processes[client_id]
-                if proc.poll() is None: # 如果还在跑
-                    try:
-                        print(f"⚡ [多用户] 用户 {client_id} 发起新请求，终止其旧进程 PID: {proc.pid}")
-                        if sys.platform == "win32":
-                            subprocess.run(["taskkill", "/F", "/T", "/PID", str(proc.pid)], 
-                                         capture_output=True)
-                        else:
-                            proc.kill()
-                    except Exception as e:
-                        print(f"⚠️ 终止进程失败: {e}")
-                # 从花名册移除
-                del self._active_processes[client_id]
-
-    def run_command(self, cmd, timeout, client_id):
-        """运行命令，并绑定到指定用户"""
-        # 1. 先清理该用户自己的旧门户
-        self.kill_process_for_client(client_id)
-        
-        # 简单的并发控制 (防止服务器过载)
-        if len(self._active_processes) > 8:
-             return -1, "", "服务器繁忙(Too Many Requests)，请稍后再试"
+# 跨请求共享的分段视频缓存 (各渲染进程内挂钩使用，主进程负责淘汰)
+partial_cache = PartialMovieCache(
+    config.PARTIAL_CACHE_DIR,
+    max_bytes=config.PARTIAL_CACHE_MAX_MB * 1024 * 1024
+) if config.PARTIAL_CACHE_ENABLED else None
+
+# 单次渲染的资源限制 + 可选的按通道 cgroup (一个失控的场景不影响其他人)
+render_limits = ResourceLimits(
+    config.RENDER_LIMIT_AS_MB, config.RENDER_LIMIT_CPU_SECONDS, config.RENDER_LIMIT_FSIZE_MB
+)
+render_cgroups = CgroupLanes(
+    config.RENDER_CGROUP_ROOT, config.RENDER_CGROUP_CPU_WEIGHTS, config.RENDER_CGROUP_MEMORY_HIGH_MB
+)
 
-        proc = None
-        # 2. 启动新进程
-        with self._lock:
-            try:
-                # Windows下需要 creationflags 才能被 taskkill /T 杀干净
-                kwargs = {}
-                if sys.platform == "win32":
-                    kwargs['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
-                else:
-                    kwargs['preexec_fn'] = os.setsid
-                    
-                proc = subprocess.Popen(
-                    cmd, 
-                    stdout=subprocess.PIPE, 
-                    stderr=subprocess.PIPE, 
-                    text=True, 
-                    encoding='utf-8', 
-                    errors='ignore',
-                    **kwargs
-                )
-                
-                # 登记造册
-                self._active_processes[client_id] = proc
-                
-            except Exception as e:
-                return -1, "", str(e)
+# 常驻渲染进程池 (预先导入 manim)
+render_pool = RenderWorkerPool(
+    size=config.RENDER_WORKERS,
+    max_jobs=config.RENDER_WORKER_MAX_JOBS,
+    max_rss_mb=config.RENDER_WORKER_MAX_RSS_MB,
+    start_timeout=config.RENDER_WORKER_START_TIMEOUT,
+    cwd=config.BASE_DIR,
+    partial_cache_dir=partial_cache.root if partial_cache else None,
+    tex_cache_dir=config.TEX_CACHE_DIR,
+    limits=render_limits,
+    cgroups=render_cgroups
+)
 
-        # 3. 等待结果
+# 可选的渲染集群：按成本与负载把任务分发到多个渲染节点 (本机也是其中一个)
+render_farm = RenderFarm(
+    local_slots=config.RENDER_WORKERS,
+    node_urls=config.RENDER_NODES,
+    token=config.RENDER_FARM_TOKEN,
+    node_ttl=config.RENDER_FARM_NODE_TTL,
+    poll_interval=config.RENDER_FARM_HEARTBEAT_INTERVAL,
+    max_attempts=config.RENDER_FARM_MAX_ATTEMPTS,
+    local_nodes=config.RENDER_FARM_LOCAL_NODES,
+    local_node_slots=config.RENDER_FARM_LOCAL_NODE_SLOTS,
+    local_port_base=config.RENDER_FARM_NODE_PORT_BASE,
+    coordinator_url=config.RENDER_FARM_COORDINATOR_URL,
+    # 节点上下线时同步调整调度器的并发槽位
+    on_capacity=lambda capacity: render_scheduler.set_workers(capacity)
+) if config.RENDER_FARM_ENABLED else None
+
+# 渲染调度器 (优先级通道 + 用户轮询)
+render_scheduler = RenderScheduler(
+    workers=config.RENDER_WORKERS,
+    max_queue=config.RENDER_QUEUE_MAX
+)
+
+# 全局单例：asyncio 原生的渲染进程管理器
+render_manager = RenderProcessManager(
+    pool=render_pool if config.RENDER_POOL_ENABLED else None,
+    cwd=config.BASE_DIR,
+    progress_interval=config.RENDER_PROGRESS_INTERVAL,
+    partial_cache=partial_cache,
+    farm=render_farm,
+    tex_cache_dir=config.TEX_CACHE_DIR,
+    limits=render_limits,
+    cgroups=render_cgroups,
+    scheduler=render_scheduler  # 分段并行渲染的额外进程也占调度器的槽位
+)
+
+async def render_manim(job, client_id, timeout=MANIM_TIMEOUT, lane=LANE_INTERACTIVE,
+                       on_queue=None, on_progress=None, supersede=False, on_start=None):
+    """经调度器排队执行一次 Manim 渲染，返回 RenderResult
+
+    on_queue: 可选的 async 回调，排队位置变化时调用
+    on_progress: 可选的 async 回调 (animation, total, pct)，渲染过程中节流推送
+    supersede: 为 True 时取消同一 client_id 在该通道中的旧任务
+    on_start: 可选的同步回调，离开队列开始渲染时调用
+    """
+    job.lane = lane
+    try:
+        return await render_scheduler.submit(
+            lambda: render_manager.run(job, timeout, on_progress),
+            lane=lane,
+            client_id=client_id,
+            on_position=on_queue,
+            supersede=supersede,
+            on_start=on_start
+        )
+    except (QueueFullError, JobSupersededError) as e:
+        return RenderResult.failure(str(e))
+
+def connection_client_id(websocket):
+    """WebSocket 连接在调度器中的身份：同一连接的请求共用一份公平份额，高清补渲按连接互相取代
+
+    request_id 每条指令都不同，只用于取消、日志与临时目录。
+    """
+    return f"ws_{id(websocket)}" if websocket is not None else "anonymous"
+
+def plan_render_sections(code, scene_name):
+    """长场景的分段并行渲染计划 (未开启或不适合分段时为 None)"""
+    return plan_sections(
+        code, scene_name,
+        max_parts=config.RENDER_PARALLEL_SECTIONS,
+        min_animations=config.RENDER_SECTION_MIN_ANIMATIONS
+    )
+
+# 预览等短任务的临时目录池 (复用目录，免去每次创建 / 删除)
+scratch_pool = ScratchPool(os.path.join(TEMP_DIR, "scratch"))
+
+# 内容寻址的产物仓库：视频 / 预览 / 单帧按内容哈希存放在 static/media 下，相同内容只存一份
+artifact_store = ArtifactStore(
+    config.ARTIFACT_STORE_DIR,
+    config.ARTIFACT_DB_PATH,
+    url_prefix="/static/" + os.path.relpath(config.ARTIFACT_STORE_DIR, STATIC_DIR).replace(os.sep, "/")
+)
+
+async def publish_artifact(path):
+    """把渲染产物收进产物仓库 (原文件变成硬链接，随临时目录删除)，返回 Artifact (digest, path, url, size)"""
+    return await asyncio.to_thread(artifact_store.ingest, path)
+
+def static_path(url):
+    """/static/... URL 对应的本地文件"""
+    return os.path.join(STATIC_DIR, url[len("/static/"):])
+
+# 渲染结果缓存 (三个渲染入口共用)，条目以引用的方式指向产物仓库
+render_cache = RenderCache(
+    config.RENDER_CACHE_DIR,
+    enabled=config.RENDER_CACHE_ENABLED,
+    artifacts=artifact_store,
+    memory=make_memory_tier(lambda entry: [entry.get("sha256")])
+)
+
+# 产物被回收 / 仓库被清空时，内存层里指向它们的条目一并失效
+artifact_store.listeners += [render_cache.memory.invalidate_tags, prompt_cache.memory.invalidate_tags]
+
+def flush_cache_touches():
+    """渲染缓存的内存层命中不碰产物仓库：回收前把这些访问时间刷进去，LRU 淘汰才不会先删热门产物"""
+    artifact_store.touch_many(render_cache.drain_touched())
+
+# 🧹 static/ 与 temp_gen/ 的后台回收 (保留期 + 大小预算，被引用的产物不删)
+storage_gc = StorageGC(
+    artifact_store, media_files, STATIC_DIR, TEMP_DIR, config.STREAM_DIR,
+    static_max_bytes=config.STATIC_MAX_MB * 1024 * 1024,
+    temp_max_bytes=config.TEMP_MAX_MB * 1024 * 1024,
+    artifact_ttl=config.ARTIFACT_MAX_IDLE_HOURS * 3600,
+    orphan_ttl=config.TEMP_ORPHAN_MINUTES * 60,
+    interval=config.STORAGE_GC_INTERVAL,
+    hooks=[expire_prompt_cache, flush_cache_touches]
+)
+
+# 渲染缓存的查询 / 登记会校验产物、写产物仓库的引用与访问时间 (SQLite)，和 ingest 一样放到线程里执行
+async def lookup_render(cache_key):
+    return await asyncio.to_thread(render_cache.lookup, cache_key)
+
+async def store_render(cache_key, path, **meta):
+    return await asyncio.to_thread(render_cache.store, cache_key, path, **meta)
+
+async def get_cached_render(code, quality=DEFAULT_QUALITY):
+    """按代码指纹查找已渲染的视频，返回 (cache_key, video_url, entry)；未命中时后两者为 None"""
+    cache_key = render_cache.make_key(code, quality)
+    entry = await lookup_render(cache_key)
+    if not entry:
+        return cache_key, None, None
+    # 同一份产物始终对应同一个 URL (仓库内的内容哈希路径；旧条目发布为 cached_ 文件)
+    target_name = render_cache.publish(entry, STATIC_DIR, f"cached_{cache_key[:16]}")
+    return cache_key, f"/static/{target_name}", entry
+
+# ================= 🖼️ 静态场景快速通道 =================
+STATIC_SCENE_WARNING = "这是一个静态场景"
+
+async def publish_static_render(image_path, output_filename, code, cache_key):
+    """发布静态场景的单帧图片，并封装成单帧 mp4，返回 (video_url, image_url)
+
+    两者都登记进渲染缓存；没有 ffmpeg 等原因封装失败时 video_url 为 None，图片照常可用。
+    """
+    clip_path = os.path.join(os.path.dirname(image_path), f"{output_filename}.mp4")
+    image = await publish_artifact(image_path)
+    await store_render(render_cache.make_key(code, DEFAULT_QUALITY, still=True), image.path, kind="image")
+
+    ok, error = await encode_still_clip(image.path, clip_path)
+    if not ok:
+        print(f"⚠️ 静态场景封装视频失败，只返回图片: {error[-200:]}")
+        return None, image.url
+    video = await publish_artifact(clip_path)
+    await store_render(cache_key, video.path, warning=STATIC_SCENE_WARNING)
+    return video.url, image.url
+
+async def get_cached_still_image(code):
+    """静态场景缓存命中时，找回对应的单帧图片 URL"""
+    image_key = render_cache.make_key(code, DEFAULT_QUALITY, still=True)
+    entry = await lookup_render(image_key)
+    if not entry:
+        return None
+    return f"/static/{render_cache.publish(entry, STATIC_DIR, f'cached_{image_key[:16]}')}"
+
+# ================= 🪜 画质阶梯 (草稿先行，高清补渲) =================
+UPGRADE_QUALITY = config.UPGRADE_QUALITY
+render_upgrades = OrderedDict()  # { upgrade_id: {"status", "quality", "videoUrl"} }，供 /render 轮询
+_background_tasks = set()
+
+async def render_upgrade(code, scene_name, client_id):
+    """以 UPGRADE_QUALITY 重新渲染同一份代码 (批量通道，不与交互请求抢槽位)，返回视频 URL 或 None"""
+    cache_key, cached_url, _ = await get_cached_render(code, UPGRADE_QUALITY)
+    if cached_url:
+        return cached_url
+
+    upgrade_id = str(uuid.uuid4())[:8]
+    request_dir = os.path.join(TEMP_DIR, f"req_{upgrade_id}_hd")
+    os.makedirs(request_dir, exist_ok=True)
+    try:
+        local_scene_file = os.path.join(request_dir, "current_scene.py")
+        with open(local_scene_file, "w", encoding="utf-8") as f:
+            f.write(code)
+        job = RenderJob(
+            local_scene_file, scene_name, request_dir, f"video_{upgrade_id}_hd", quality=UPGRADE_QUALITY,
+            expected_animations=analyze_code_structure(code).get("play_calls", 0),
+            sections=plan_render_sections(code, scene_name)
+        )
+        # 同一用户有了更新的草稿时，旧的补渲就没有意义了 (匿名请求无法区分用户，不做顶替)
+        result = await render_manim(job, client_id, lane=LANE_BATCH, supersede=client_id != "anonymous")
+        if not result.ok or result.output_kind != "video":
+            print(f"[{upgrade_id}] ⚠️ 高清补渲失败: {result.stderr[-200:]}")
+            return None
+        video = await publish_artifact(result.output_path)
+        await store_render(cache_key, video.path)
+        print(f"[{upgrade_id}] 🪜 高清版本就绪 ({UPGRADE_QUALITY})")
+        return video.url
+    finally:
+        shutil.rmtree(request_dir, ignore_errors=True)
+
+def schedule_upgrade(code, scene_name, client_id, on_ready=None):
+    """草稿交付后在后台补渲高清版本，返回 upgrade_id；未开启时返回 None
+
+    on_ready: 可选的 async 回调 (video_url)，高清版本就绪时调用
+    """
+    if not UPGRADE_QUALITY or UPGRADE_QUALITY == DEFAULT_QUALITY:
+        return None
+    upgrade_id = uuid.uuid4().hex[:12]
+    render_upgrades[upgrade_id] = {"status": "pending", "quality": UPGRADE_QUALITY, "videoUrl": None}
+    while len(render_upgrades) > config.MAX_TRACKED_UPGRADES:
+        render_upgrades.popitem(last=False)
+
+    async def run():
+        state = render_upgrades.get(upgrade_id, {})
         try:
-            stdout, stderr = proc.communicate(timeout=timeout)
-            
-            # 运行完后，主动从名单里移除（防止字典无限膨胀）
-            with self._lock:
-                if client_id in self._active_processes and self._active_processes[client_id] == proc:
-                    del self._active_processes[client_id]
-                    
-            return proc.returncode, stdout, stderr
-            
-        except subprocess.TimeoutExpired:
-            self.kill_process_for_client(client_id) # 超时也得杀
-            return -1, "", "渲染超时 (Timeout)"
+            video_url = await render_upgrade(code, scene_name, client_id)
+        except asyncio.CancelledError:
+            state["status"] = "cancelled"
+            raise
         except Exception as e:
-            self.kill_process_for_client(client_id)
-            return -1, "", str(e)
-
-# 全局单例
-render_manager = RenderProcessManager()
-
-def run_manim_safe(cmd, client_id, timeout=MANIM_TIMEOUT):
-    """安全运行Manim命令 (支持多用户隔离)"""
-    return render_manager.run_command(cmd, timeout, client_id)
-
-async def find_video_file(search_dir, filename_prefix):
-    """查找视频文件"""
-    for root, dirs, files in os.walk(search_dir):
-        for file in files:
-            if file.endswith(".mp4") and filename_prefix in file:
-                return os.path.join(root, file)
-    return None
+            print(f"⚠️ 高清补渲异常: {e}")
+            video_url = None
+        state.update(status="ready" if video_url else "failed", videoUrl=video_url)
+        if video_url and on_ready:
+            try:
+                await on_ready(video_url)
+            except Exception as e:
+                # 客户端可能早已断开
+                print(f"⚠️ 高清版本推送失败: {e}")
+
+    task = asyncio.create_task(run())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    adopt_session_task(task)
+    return upgrade_id
+
+def make_upgrade_notifier(websocket):
+    """生成高清补渲完成回调：向 WebSocket 客户端推送 upgrade 事件"""
+    async def notify(video_url):
+        if websocket:
+            await websocket.send_json({
+                "type": "upgrade",
+                "video": video_url,
+                "quality": UPGRADE_QUALITY,
+                "message": "高清版本已就绪"
+            })
+    return notify
 
-async def find_image_file(search_dir, filename_prefix):
-    """查找图片文件"""
-    for root, dirs, files in os.walk(search_dir):
-        for file in files:
-            if file.endswith(".png") and filename_prefix in file:
-                return os.path.join(root, file)
-    return None
+def make_queue_notifier(websocket, request_id):
+    """生成排队位置回调：通过 WebSocket 推送排队进度"""
+    async def notify(position):
+        print(f"[{request_id}] ⏳ 渲染排队中，位置 {position}")
+        if websocket:
+            await websocket.send_json({
+                "type": "progress",
+                "step": "queue",
+                "position": position,
+                "message": f"渲染排队中，前面还有 {position - 1} 个任务..."
+            })
+    return notify
+
+def make_progress_notifier(websocket, request_id):
+    """生成渲染进度回调：把 manim 逐动画进度推送给 WebSocket 客户端"""
+    async def notify(animation, total, pct):
+        if websocket:
+            await websocket.send_json({
+                "type": "progress",
+                "step": "render",
+                "animation": animation,
+                "of": total,
+                "pct": pct,
+                "message": f"正在渲染第 {animation}/{total} 段动画 ({pct}%)..."
+            })
+    return notify
+
+# ================= 📺 渐进式输出 =================
+def make_stream_notifier(websocket, request_id):
+    """生成播放列表就绪回调：第一个动画分段发布后推送 HLS 地址，客户端边渲染边播放"""
+    async def notify(playlist_url):
+        print(f"[{request_id}] 📺 首段已就绪，推送播放列表 {playlist_url}")
+        if websocket:
+            await websocket.send_json({
+                "type": "stream",
+                "format": "hls",
+                "playlist": playlist_url,
+                "message": "第一段动画已就绪，边渲染边播放..."
+            })
+    return notify
+
+async def render_manim_progressive(job, client_id, websocket, request_id, **kwargs):
+    """render_manim + 渐进式 HLS 输出；返回 RenderResult
+
+    分段并行 / 单帧任务没有按顺序产出的分段，照常渲染。
+    必须在清理 job.media_dir 之前返回 (本函数返回时播放列表已封口)。
+    """
+    stream = None
+    if config.PROGRESSIVE_STREAM_ENABLED and websocket and not (job.still or job.scrub or job.sections):
+        stream = ProgressiveStream(
+            job.media_dir, config.STREAM_DIR, f"stream_{uuid.uuid4().hex[:12]}",
+            url_prefix="/static/streams",
+            on_ready=make_stream_notifier(websocket, request_id)
+        )
+        stream.start()
+    try:
+        result = await render_manim(job, client_id, **kwargs)
+    except BaseException:
+        if stream is not None:
+            stream.abort()
+        raise
+    if stream is not None:
+        await stream.close()
+    return result
+
+# ================= ⚡ 极速静态预览 =================
+async def render_flash_preview(code, scene_name, request_id, websocket, state):
+    """渲染最后一帧作为静态预览并推送；与正式视频渲染并发执行
+
+    state: {"started", "skip"}，视频先完成时由 cancel_flash_preview 置 skip
+    """
+    def on_start():
+        state["started"] = True
+
+    try:
+        with scratch_pool.lease() as preview_dir:
+            preview_file = os.path.join(preview_dir, "preview_scene.py")
+            with open(preview_file, "w", encoding="utf-8") as f:
+                f.write(code)
+
+            # 关键参数解释:
+            # still: -s save_last_frame (只渲染最后一帧，不做视频) + --format=png
+            # -ql: quality_low (480p，速度最快)
+            preview_job = RenderJob(preview_file, scene_name, preview_dir, "preview_image", quality="-ql", still=True)
+
+            # 设定 20秒 超时，避免预览卡太久喧宾夺主
+            preview_result = await render_manim(
+                preview_job, f"preview_{connection_client_id(websocket)}", timeout=20, lane=LANE_PREVIEW, on_start=on_start
+            )
+
+            if not preview_result.ok or state["skip"]:
+                return
+            # 收进产物仓库 (相同代码的预览只存一份)
+            preview = await publish_artifact(preview_result.output_path)
+
+        # ⚡ 立即推送图片给前端
+        if websocket and not state["skip"]:
+            await websocket.send_json({
+                "type": "preview",
+                "url": preview.url,
+                "message": "静态预览已就绪 (高清视频渲染中...)"
+            })
+            print(f"[{request_id}] 🖼️ 预览图已发送")
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        # 预览失败不要紧，不要打断主流程
+        print(f"[{request_id}] ⚠️ 预览生成跳过: {e}")
+
+def cancel_flash_preview(task, state):
+    """视频已经出来了，预览就没有意义了
+
+    还在排队的预览直接取消；已经在渲染的让它跑完但不再推送 (避免为了它杀掉一个预热好的工作进程)。
+    """
+    if task.done():
+        return
+    state["skip"] = True
+    if not state["started"]:
+        task.cancel()
+
+# ================= 🎞️ 单帧定位 (Scrub) =================
+async def render_frame(code, scrub, fmt="png", client_id="anonymous"):
+    """低分辨率渲染场景在某一时刻 / 第 k 个动画之后的画面，返回 (url, cached, error)
+
+    之前的动画只计算状态不出画面 (见 frame_scrub.py)，耗时远小于整段渲染。
+    同一用户拖动进度条时新请求会顶替还没出图的旧请求。
+    """
+    fmt = fmt if fmt in FRAME_FORMATS else "png"
+    scene_name = analyze_code_structure(code).get("scene_class") or DEFAULT_SCENE_NAME
+    cache_key = render_cache.make_key(code, "-ql", still=True, variant=f"scrub:{scrub_label(scrub)}:{fmt}")
+    entry = await lookup_render(cache_key)
+    if entry:
+        return f"/static/{render_cache.publish(entry, STATIC_DIR, f'frame_{cache_key[:16]}')}", True, None
+
+    with scratch_pool.lease() as frame_dir:
+        scene_file = os.path.join(frame_dir, "frame_scene.py")
+        with open(scene_file, "w", encoding="utf-8") as f:
+            f.write(code)
+        job = RenderJob(scene_file, scene_name, frame_dir, "frame", quality="-ql", still=True)
+        job.scrub = scrub
+
+        result = await render_manim(
+            job, f"frame_{client_id}", timeout=config.SCRUB_TIMEOUT, lane=LANE_PREVIEW,
+            supersede=client_id != "anonymous"
+        )
+        if not result.ok:
+            return None, False, (result.stderr[-500:] if result.stderr else "未找到输出图片")
+        frame_path = os.path.join(frame_dir, f"frame_out.{fmt}")
+        frame_path = await asyncio.to_thread(encode_frame, result.output_path, frame_path, fmt)
+        frame = await publish_artifact(frame_path)
+
+    await store_render(cache_key, frame.path, kind="image")
+    return frame.url, False, None
+
+async def scrub_frame_ws(data, websocket):
+    """WebSocket: {"type": "scrub", "code", "time" | "animation", "format"}"""
+    try:
+        scrub = parse_scrub(data.get("time"), data.get("animation"))
+        if scrub is None:
+            raise ValueError("需要指定 time 或 animation")
+    except (TypeError, ValueError) as e:
+        await websocket.send_json({"type": "error", "message": f"单帧参数错误: {e}"})
+        return
+    url, cached, error = await render_frame(
+        data["code"], scrub, data.get("format", "png"), client_id=connection_client_id(websocket)
+    )
+    if url:
+        await websocket.send_json({"type": "frame", "url": url, "cached": cached, **scrub})
+    else:
+        await websocket.send_json({"type": "error", "message": "单帧渲染失败", "details": error})
 
 # ================= 🚀 核心工作流逻辑 (完整4步 + WebSocket + 侦探) =================
 async def process_chat_workflow(prompt: str, websocket: WebSocket):
@@ -565,6 +1054,11 @@ async def process_chat_workflow(prompt: str, websocket: WebSocket):
     # 这是为了确保缓存 Key 对应的是“执行指令前”的状态
     current_code_snapshot = get_current_code_content()
     
+    # 取消时需要收尾的资源
+    preview_task = None
+    speculative_task = None
+    request_dir = None
+    
     # 辅助函数：发送进度
     async def send_status(step, message):
         print(f"[{request_id}] {message}")
@@ -584,10 +1078,55 @@ async def process_chat_workflow(prompt: str, websocket: WebSocket):
         current_state = context_manager.analyze_current_code()
         context_summary = context_manager.get_context_summary()
         
+        # 生成器的输入只把意图分析当作附加上下文
+        async def generate_draft(intent_text):
+            generator_input = f"""
+【用户指令】:
+{prompt}
+
+【意图分析】:
+{intent_text}
+
+【当前代码状态】:
+{current_state.get('code_preview', '无现有代码')}
+
+【已存在的对象】:
+{', '.join(current_state.get('objects', [])) if current_state.get('objects') else '无'}
+
+【上下文摘要】:
+{context_summary['text']}
+
+【具体要求】:
+1. 保持代码清晰，**必须在文件开头包含 import math 和 import numpy as np**
+2. **严禁在 MathTex 中使用中文**，中文必须用 Text() 类
+3. 如果是修改或添加，请基于当前代码进行；如果是新建，可以完全重写
+4. 确保所有内容都在屏幕内
+"""
+            return await llm.complete(
+                "generator",
+                model=MODEL_NAME,
+                messages=[
+                    {"role": "system", "content": PROMPT_GENERATOR},
+                    {"role": "user", "content": generator_input}
+                ],
+                temperature=0.7
+            )
+        
         await send_status("intent", "正在分析您的意图...")
+        
+        # 🎲 推测执行：按预判的意图先让生成器开跑，与意图分析并行
+        assumed_intent = None
+        if config.SPECULATIVE_GENERATION:
+            assumed_intent = guess_intent(prompt, current_state)
+            start_time = time.time()
+            speculative_task = asyncio.create_task(generate_draft(
+                json.dumps({"intent": assumed_intent, "note": "根据当前状态预判，尚未经过意图分析"}, ensure_ascii=False)
+            ))
+        
         intent_analysis = None
         try:
-            intent_response = await client.chat.completions.create(
+            intent_content = await llm.complete(
+                "intent",
                 model=MODEL_NAME,
                 messages=[
                     {"role": "system", "content": PROMPT_INTENT_ANALYZER},
@@ -599,10 +1138,9 @@ async def process_chat_workflow(prompt: str, websocket: WebSocket):
 请分析用户的真实意图。
 """}
                 ],
-                stream=False,
                 temperature=0.1
             )
-            intent_analysis = extract_json_from_response(intent_response.choices[0].message.content)
+            intent_analysis = extract_json_from_response(intent_content)
             print(f"[{request_id}] 🎯 意图分析: {intent_analysis}")
         except Exception as e:
             print(f"[{request_id}] ⚠️ 意图分析失败: {e}")
@@ -611,42 +1149,31 @@ async def process_chat_workflow(prompt: str, websocket: WebSocket):
         # 🎨 第一步：生成器 - 上下文感知初稿
         # =======================================================
         await send_status("generator", "正在构思动画代码...")
-        start_time = time.time()
-        
-        generator_input = f"""
-【用户指令】:
-{prompt}
-
-【意图分析】:
-{json.dumps(intent_analysis, ensure_ascii=False) if intent_analysis else "未分析"}
-
-【当前代码状态】:
-{current_state.get('code_preview', '无现有代码')}
-
-【已存在的对象】:
-{', '.join(current_state.get('objects', [])) if current_state.get('objects') else '无'}
-
-【上下文摘要】:
-{context_summary['text']}
-
-【具体要求】:
-1. 保持代码清晰，**必须在文件开头包含 import math 和 import numpy as np**
-2. **严禁在 MathTex 中使用中文**，中文必须用 Text() 类
-3. 如果是修改或添加，请基于当前代码进行；如果是新建，可以完全重写
-4. 确保所有内容都在屏幕内
-"""
         
-        gen_response = await client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[
-                {"role": "system", "content": PROMPT_GENERATOR},
-                {"role": "user", "content": generator_input}
-            ],
-            stream=False,
-            temperature=0.7
-        )
+        gen_content = None
+        if speculative_task is not None:
+            if speculation_holds(assumed_intent, intent_analysis):
+                try:
+                    gen_content = await speculative_task
+                    speculation_stats["hits"] += 1
+                    print(f"[{request_id}] 🎲 推测的初稿可用 (预判 {assumed_intent})")
+                except Exception as e:
+                    # 推测的请求失败不影响正常流程，下面照常生成
+                    speculation_stats["errors"] += 1
+                    print(f"[{request_id}] ⚠️ 推测生成失败: {e}")
+            else:
+                speculative_task.cancel()
+                speculation_stats["misses"] += 1
+                print(f"[{request_id}] 🎲 意图与预判不符 ({assumed_intent} → {intent_analysis.get('intent')})，重新生成初稿")
+            speculative_task = None
+        
+        if gen_content is None:
+            start_time = time.time()
+            gen_content = await generate_draft(
+                json.dumps(intent_analysis, ensure_ascii=False) if intent_analysis else "未分析"
+            )
         
-        draft_code = extract_code_from_markdown(gen_response.choices[0].message.content)
+        draft_code = extract_code_from_markdown(gen_content)
         gen_time = time.time() - start_time
         
         # 🛡️ 安检 1：检查生成器初稿
@@ -658,136 +1185,99 @@ async def process_chat_workflow(prompt: str, websocket: WebSocket):
         
         # =======================================================
         # ⚖️ 第二步：分析器 - 上下文感知质检
+        # 🔧 第三步：改进器 - 智能优化
         # =======================================================
-        await send_status("analyzer", "正在检查代码质量...")
-        ana_start = time.time()
-        
-        analyzer_input = f"""
+        async def review_draft(code, render_error=None):
+            """分析器 + 改进器，返回 (质检报告, 终稿, 分析耗时, 改进耗时)"""
+            await send_status("analyzer", "正在检查代码质量...")
+            ana_start = time.time()
+            
+            analyzer_input = f"""
 【用户指令】: {prompt}
-【生成器初稿】: {draft_code}
+【生成器初稿】: {code}
 请检查布局、遮挡和 MathTex 中文问题。
 """
-        
-        ana_response = await client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[
-                {"role": "system", "content": PROMPT_ANALYZER},
-                {"role": "user", "content": analyzer_input}
-            ],
-            stream=False,
-            temperature=0.1
-        )
-        
-        critique = ana_response.choices[0].message.content
-        ana_time = time.time() - ana_start
-        
-        # =======================================================
-        # 🔧 第三步：改进器 - 智能优化
-        # =======================================================
-        await send_status("improver", "正在优化代码细节...")
-        imp_start = time.time()
-        
-        improver_input = f"""
+            if render_error:
+                analyzer_input += f"【渲染报错】: {render_error}\n"
+            
+            critique = await llm.complete(
+                "analyzer",
+                model=MODEL_NAME,
+                messages=[
+                    {"role": "system", "content": PROMPT_ANALYZER},
+                    {"role": "user", "content": analyzer_input}
+                ],
+                temperature=0.1
+            )
+            ana_time = time.time() - ana_start
+            
+            await send_status("improver", "正在优化代码细节...")
+            imp_start = time.time()
+            
+            improver_input = f"""
 【用户指令】: {prompt}
-【初稿】: {draft_code}
+【初稿】: {code}
 【质检报告】: {critique}
 请修复所有问题，特别是 MathTex 中文和 import math。
 """
+            
+            imp_content = await llm.complete(
+                "improver",
+                model=MODEL_NAME,
+                messages=[
+                    {"role": "system", "content": PROMPT_IMPROVER},
+                    {"role": "user", "content": improver_input}
+                ],
+                temperature=0.3
+            )
+            
+            final_code = extract_code_from_markdown(imp_content)
+            imp_time = time.time() - imp_start
+            
+            # 🛡️ 安检 2：检查改进器终稿
+            is_valid_final, reason_final = validate_code_completeness(final_code)
+            if not is_valid_final:
+                print(f"[{request_id}] ❌ 改进器依然偷懒: {reason_final}")
+                # 这是一个严重错误，触发紧急修复机制
+                # 我们通过抛出异常或覆盖 final_code 来强制进入 Step 4 的修复流程
+                # 这里我们构造一个假的报错，让下面的 Emergency Fixer 去处理
+                final_code = f"# INCOMPLETE CODE GENERATED\n# Error: {reason_final}\n# Please regenerate the FULL code.\n" + final_code
+            return critique, final_code, ana_time, imp_time
+        
+        # ⚡ 初稿通过本地检查、且这类意图的初稿很少被审查改动时，跳过分析器 + 改进器直接渲染
+        pipeline_mode, pipeline_reason = pipeline_policy.decide(intent_analysis, draft_code, is_valid)
+        print(f"[{request_id}] ⚡ 流水线模式: {pipeline_mode} ({pipeline_reason})")
+        if pipeline_mode == "fast":
+            await send_status("analyzer", "初稿已通过检查，直接渲染...")
+            critique, final_code, ana_time, imp_time = None, draft_code, 0.0, 0.0
+        else:
+            critique, final_code, ana_time, imp_time = await review_draft(draft_code)
+            pipeline_policy.record_review(intent_analysis, draft_code, final_code)
+        # 快速模式的初稿第一次渲染失败时，先回到完整流程审查，而不是直接交给修复器
+        fast_pending = pipeline_mode == "fast"
+        pipeline_fallback = False
         
-        imp_response = await client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[
-                {"role": "system", "content": PROMPT_IMPROVER},
-                {"role": "user", "content": improver_input}
-            ],
-            stream=False,
-            temperature=0.3
-        )
-        
-        final_code = extract_code_from_markdown(imp_response.choices[0].message.content)
-        imp_time = time.time() - imp_start
-        
-        # 🛡️ 安检 2：检查改进器终稿
-        is_valid_final, reason_final = validate_code_completeness(final_code)
-        if not is_valid_final:
-            print(f"[{request_id}] ❌ 改进器依然偷懒: {reason_final}")
-            # 这是一个严重错误，触发紧急修复机制
-            # 我们通过抛出异常或覆盖 final_code 来强制进入 Step 4 的修复流程
-            # 这里我们构造一个假的报错，让下面的 Emergency Fixer 去处理
-            final_code = f"# INCOMPLETE CODE GENERATED\n# Error: {reason_final}\n# Please regenerate the FULL code.\n" + final_code
-        
-        # 🔍 提前分析代码结构 (为了获取类名)
+        # 🔍 提前分析代码结构 (为了获取类名)；之后只有修复器改写了代码才重新分析
         code_analysis = analyze_code_structure(final_code)
+        analyzed_code = final_code
         scene_name = code_analysis.get("scene_class") or DEFAULT_SCENE_NAME
 
         # ================= ⚡ STEP 3.5: 极速静态预览 (Flash Preview) =================
-        # 既然你性子急，我们先花 2 秒生成一张静态图给你看，不用干等视频
-        try:
-            await send_status("preview", "🚀 正在生成静态预览...")
-            
-            # 创建预览专用的临时环境
-            preview_dir = os.path.join(TEMP_DIR, f"preview_{request_id}")
-            os.makedirs(preview_dir, exist_ok=True)
-            preview_file = os.path.join(preview_dir, "preview_scene.py")
-            
-            with open(preview_file, "w", encoding="utf-8") as f:
-                f.write(final_code)
-            
-            # 关键参数解释:
-            # -s: save_last_frame (只渲染最后一帧，不做视频)
-            # -ql: quality_low (480p，速度最快)
-            # --format=png: 输出图片格式
-            cmd_preview = [
-                sys.executable, "-m", "manim",
-                "-ql", "-s", "--format=png",
-                "--media_dir", preview_dir,
-                "-o", "preview_image",
-                preview_file,
-                scene_name
-            ]
-            
-            # 设定 20秒 超时，避免预览卡太久喧宾夺主
-            p_code, _, _ = await asyncio.to_thread(run_manim_safe, cmd_preview, f"preview_{request_id}", timeout=20)
-            
-            if p_code == 0:
-                # 寻找生成的 png 文件
-                preview_image_path = None
-                for root, _, files in os.walk(preview_dir):
-                    for f in files:
-                        if f.endswith(".png"):
-                            preview_image_path = os.path.join(root, f)
-                            break
-                
-                if preview_image_path:
-                    # 移动到静态资源目录
-                    target_preview = f"preview_{request_id}.png"
-                    shutil.move(preview_image_path, os.path.join(STATIC_DIR, target_preview))
-                    
-                    # ⚡ 立即推送图片给前端
-                    if websocket:
-                        await websocket.send_json({
-                            "type": "preview",
-                            "url": f"/static/{target_preview}",
-                            "message": "静态预览已就绪 (高清视频渲染中...)"
-                        })
-                        print(f"[{request_id}] 🖼️ 预览图已发送")
-        except Exception as e:
-            # 预览失败不要紧，不要打断主流程
-            print(f"[{request_id}] ⚠️ 预览生成跳过: {e}")
-        finally:
-            # 清理预览临时文件
-            try: shutil.rmtree(preview_dir, ignore_errors=True)
-            except: pass
+        # 预览与视频同时开跑 (预览走最高优先级通道)，不再让视频等预览
+        await send_status("preview", "🚀 正在生成静态预览...")
+        preview_state = {"started": False, "skip": False}
+        preview_task = asyncio.create_task(
+            render_flash_preview(final_code, scene_name, request_id, websocket, preview_state)
+        )
+        _background_tasks.add(preview_task)
+        preview_task.add_done_callback(_background_tasks.discard)
+        adopt_session_task(preview_task)
 
         # =======================================================
         # 🎬 第四步：渲染执行 (并发隔离 + 动态侦探)
         # =======================================================
         await send_status("render", "正在渲染视频 (可能需要几分钟)...")
         
-        # 3.1 动态代码分析 (Scene Name Detection)
-        code_analysis = analyze_code_structure(final_code)
-        scene_name = code_analysis.get("scene_class") or DEFAULT_SCENE_NAME
-        
         video_url = None
         error_details = None
         final_objects = []
@@ -798,7 +1288,7 @@ async def process_chat_workflow(prompt: str, websocket: WebSocket):
         
         # 2. 专属场景文件路径
         local_scene_file = os.path.join(request_dir, "current_scene.py")
-        dump_file = os.path.join(request_dir, "objects_dump.json").replace("\\", "/")
+        dump_file = os.path.join(request_dir, OBJECTS_DUMP_NAME)
         
         # 🔥【关键】注入 Inspector 代码 (侦探升级版) 🔥
         # 这是一个继承自用户 Scene 的子类，专门用于在 tear_down 时窃取对象详细信息
@@ -814,6 +1304,7 @@ async def process_chat_workflow(prompt: str, websocket: WebSocket):
 
         if use_inspector:
             inspector_code = f"""
+import os
 import json
 from manim import Mobject, Text, Tex, MathTex, VMobject
 
@@ -857,8 +1348,9 @@ class {inspector_class_name}({scene_name}):
                             
                 detected_objects.append(info)
             
-            # 将检测到的详细对象列表写入临时文件
-            with open(r"{dump_file}", "w", encoding="utf-8") as f:
+            # 将检测到的详细对象列表写到场景文件旁边 (在远程节点上渲染时由节点带回)
+            dump_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "{OBJECTS_DUMP_NAME}")
+            with open(dump_file, "w", encoding="utf-8") as f:
                 json.dump(detected_objects, f, ensure_ascii=False)
         except Exception as e:
             print(f"Inspector Error: {{e}}")
@@ -868,10 +1360,29 @@ class {inspector_class_name}({scene_name}):
         else:
             inspector_code = ""
 
-        for attempt in range(MAX_RETRIES + 1):
+        # attempt 只统计修复器的重试；快速模式失败后补做的审查不占用次数
+        attempt = 0
+        while attempt <= MAX_RETRIES:
             if attempt > 0:
                 await send_status("render", f"渲染出错，正在第 {attempt} 次自动修复...")
             
+            # 💾 相同代码 (忽略注释/空白/变量命名) 已渲染过：直接复用视频与侦探报告
+            cache_key, cached_url, cached_entry = await get_cached_render(final_code)
+            if cached_url:
+                print(f"[{request_id}] ✨ 命中渲染缓存 {cache_key[:12]}")
+                if fast_pending:
+                    pipeline_policy.record_fast(intent_analysis, failed=False)
+                    fast_pending = False
+                cancel_flash_preview(preview_task, preview_state)
+                video_url = cached_url
+                final_objects = cached_entry.get("objects") or extract_objects_from_code(final_code)
+                try:
+                    with open(SCENE_FILE, "w", encoding="utf-8") as f:
+                        f.write(final_code)
+                except Exception as e:
+                    print(f"[{request_id}] ⚠️ 全局状态更新警告: {e}")
+                break
+            
             # 写入带侦探的代码 (源代码 + 侦探代码)
             with open(local_scene_file, "w", encoding="utf-8") as f:
                 f.write(final_code + "\n" + inspector_code)
@@ -880,27 +1391,31 @@ class {inspector_class_name}({scene_name}):
             # 如果启用了侦探，运行 Inspector 类；否则运行原始 Scene 类
             run_class = inspector_class_name if use_inspector else scene_name
             
-            cmd = [
-                sys.executable, "-m", "manim",
-                DEFAULT_QUALITY,
-                "--media_dir", request_dir,
-                "-o", output_filename,
-                local_scene_file,
-                run_class
-            ]
+            if final_code != analyzed_code:
+                code_analysis = analyze_code_structure(final_code)
+                analyzed_code = final_code
             
-            returncode, stdout, stderr = await asyncio.to_thread(run_manim_safe, cmd)
+            # 分段并行时侦探只需要跑在最后一段 (它记录的是最终画面)
+            job = RenderJob(
+                local_scene_file, run_class, request_dir, output_filename, quality=DEFAULT_QUALITY,
+                expected_animations=code_analysis.get("play_calls", 0),
+                sections=plan_render_sections(final_code, scene_name),
+                section_class=scene_name
+            )
             
-            if returncode == 0:
-                # 5. 查找视频
-                video_path = await find_video_file(request_dir, output_filename)
+            result = await render_manim_progressive(
+                job, connection_client_id(websocket), websocket, request_id,
+                on_queue=make_queue_notifier(websocket, request_id),
+                on_progress=make_progress_notifier(websocket, request_id)
+            )
+            
+            if result.returncode == 0:
+                # 5. 视频位于 manim 约定的输出路径
+                video_path = result.output_path if result.output_kind == "video" else None
                 
                 if video_path:
-                    target_name = f"{output_filename}.mp4"
-                    target_path = os.path.join(STATIC_DIR, target_name)
-                    
-                    shutil.move(video_path, target_path)
-                    video_url = f"/static/{target_name}"
+                    video = await publish_artifact(video_path)
+                    video_url = video.url
                     
                     # 🔥 读取侦探的报告 (100% 准确的运行时数据)
                     try:
@@ -916,6 +1431,11 @@ class {inspector_class_name}({scene_name}):
                         final_objects = extract_objects_from_code(final_code)
 
                     print(f"[{request_id}] 🎉 渲染成功!")
+                    if fast_pending:
+                        pipeline_policy.record_fast(intent_analysis, failed=False)
+                        fast_pending = False
+                    await store_render(cache_key, video.path, objects=final_objects)
+                    cancel_flash_preview(preview_task, preview_state)
                     
                     # 成功后更新全局状态
                     try:
@@ -926,25 +1446,48 @@ class {inspector_class_name}({scene_name}):
                         
                     break
             else:
-                error_details = stderr[-500:] if stderr else "未知错误"
+                error_details = result.stderr[-500:] if result.stderr else "未知错误"
                 print(f"[{request_id}] ❌ 渲染失败: {error_details[:100]}...")
                 
+                if result.timed_out and partial_cache is not None and attempt < MAX_RETRIES:
+                    # 超时不是代码错误：已完成的分段都在缓存里，原样重跑即可从断点继续
+                    await send_status("render", "渲染超时，正在从已完成的片段继续...")
+                    attempt += 1
+                    continue
+                
+                if result.error_kind == ERROR_RESOURCE_LIMIT:
+                    # 代码能跑但太重：单独标注，让修复器减负而不是找语法错误
+                    error_details = f"[资源超限] {error_details}"
+                    await send_status("render", "场景超出资源限制，正在让 AI 精简...")
+                
+                if fast_pending:
+                    # 快速决策记为失败；补做的审查也是一次完整流程样本 (初稿需要改动)
+                    pipeline_policy.record_fast(intent_analysis, failed=True)
+                    fast_pending = False
+                    pipeline_fallback = True
+                    await send_status("render", "初稿渲染失败，回到完整流程检查代码...")
+                    critique, final_code, ana_time, imp_time = await review_draft(final_code, error_details)
+                    pipeline_policy.record_review(intent_analysis, draft_code, final_code)
+                    continue
+                
                 if attempt < MAX_RETRIES:
                     fixer_prompt = PROMPT_EMERGENCY_FIXER.format(
                         error_details=error_details,
                         final_code=final_code
                     )
                     
-                    fix_response = await client.chat.completions.create(
+                    fix_content = await llm.complete(
+                        "fixer",
                         model=MODEL_NAME,
                         messages=[
                             {"role": "system", "content": SYSTEM_PROMPTS["code_fixer"]},
                             {"role": "user", "content": fixer_prompt}
-                        ],
-                        stream=False
+                        ]
                     )
                     
-                    final_code = extract_code_from_markdown(fix_response.choices[0].message.content)
+                    final_code = extract_code_from_markdown(fix_content)
+            
+            attempt += 1
 
         # 任务结束，清理临时目录
         try:
@@ -970,18 +1513,24 @@ class {inspector_class_name}({scene_name}):
                 "analyzer": ana_time,
                 "improver": imp_time,
                 "total": total_time
-            }
+            },
+            "pipeline": {"mode": pipeline_mode, "reason": pipeline_reason, "fallback": pipeline_fallback}
         }
         
         # 这里保存的是侦探抓取到的真实对象列表
-        context_manager.save_conversation(prompt, response_data, {
+        await asyncio.to_thread(context_manager.save_conversation, prompt, response_data, {
             **code_analysis,
             "objects": final_objects # <--- 真实数据
         })
         
         if video_url:
             # 存入缓存
-            save_cache_entry(prompt, video_url, current_code_snapshot)
+            await asyncio.to_thread(save_cache_entry, prompt, video_url, current_code_snapshot)
+            
+            # 🪜 草稿已交付，后台补渲高清版本
+            upgrade_id = schedule_upgrade(
+                final_code, scene_name, connection_client_id(websocket), make_upgrade_notifier(websocket)
+            )
             
             if websocket:
                 await websocket.send_json({
@@ -989,7 +1538,9 @@ class {inspector_class_name}({scene_name}):
                     "status": "success",
                     "video": video_url,
                     "code": final_code,
-                    "timing": response_data["timing"]
+                    "timing": response_data["timing"],
+                    "pipeline": pipeline_mode,
+                    "upgrading": bool(upgrade_id)
                 })
         else:
             if websocket:
@@ -999,8 +1550,20 @@ class {inspector_class_name}({scene_name}):
                     "details": error_details
                 })
             
+    except asyncio.CancelledError:
+        # 客户端断开或被新指令取代：LLM 请求随任务一起中止，渲染进程由调度器负责杀掉
+        print(f"[{request_id}] ⏹️ 请求已取消")
+        if preview_task and not preview_task.done():
+            preview_task.cancel()
+        if speculative_task and not speculative_task.done():
+            speculative_task.cancel()
+        if request_dir:
+            shutil.rmtree(request_dir, ignore_errors=True)
+        raise
     except Exception as e:
         print(f"[{request_id}] 💥 系统异常: {str(e)}")
+        if speculative_task and not speculative_task.done():
+            speculative_task.cancel()
         if websocket:
             await websocket.send_json({
                 "type": "error",
@@ -1024,11 +1587,31 @@ async def render_code_directly(code: str, websocket: WebSocket):
     
     await send_status("render", "正在渲染您的代码...")
     
+    request_dir = None
     try:
         # 1. Analyze code to find scene class
         code_analysis = analyze_code_structure(code)
         scene_name = code_analysis.get("scene_class") or DEFAULT_SCENE_NAME
         
+        # Identical code rendered before: reply immediately
+        cache_key, cached_url, cached_entry = await get_cached_render(code)
+        if cached_url:
+            print(f"[{request_id}] ✨ 命中渲染缓存 {cache_key[:12]}")
+            is_static = bool(cached_entry.get("warning"))
+            upgrade_id = None if is_static else schedule_upgrade(
+                code, scene_name, connection_client_id(websocket), make_upgrade_notifier(websocket)
+            )
+            await websocket.send_json({
+                "type": "result",
+                "status": "success",
+                "video": cached_url,
+                "image": await get_cached_still_image(code) if is_static else None,
+                "code": code,
+                "cached": True,
+                "upgrading": bool(upgrade_id)
+            })
+            return
+        
         # 2. Create isolated temp directory
         request_dir = os.path.join(TEMP_DIR, f"req_{request_id}")
         os.makedirs(request_dir, exist_ok=True)
@@ -1039,46 +1622,61 @@ async def render_code_directly(code: str, websocket: WebSocket):
         with open(local_scene_file, "w", encoding="utf-8") as f:
             f.write(code)
         
-        # 4. Run Manim
-        cmd = [
-            sys.executable, "-m", "manim",
-            DEFAULT_QUALITY,
-            "--media_dir", request_dir,
-            "-o", output_filename,
-            local_scene_file,
-            scene_name
-        ]
+        # 4. Run Manim (static scenes go straight to a single -s frame)
+        is_static = code_analysis.get("is_static", False)
+        job = RenderJob(
+            local_scene_file, scene_name, request_dir, output_filename, quality=DEFAULT_QUALITY,
+            still=is_static,
+            expected_animations=code_analysis.get("play_calls", 0),
+            sections=None if is_static else plan_render_sections(code, scene_name)
+        )
         
         await send_status("render", "Manim 正在渲染视频...")
-        # WebSocket 直接渲染暂无 client_id，使用 request_id 隔离
-        returncode, stdout, stderr = await asyncio.to_thread(run_manim_safe, cmd, f"ws_{request_id}")
+        result = await render_manim_progressive(
+            job, connection_client_id(websocket), websocket, request_id,
+            on_queue=make_queue_notifier(websocket, request_id),
+            on_progress=make_progress_notifier(websocket, request_id)
+        )
         
-        if returncode == 0:
-            # Find video file
-            video_path = await find_video_file(request_dir, output_filename)
+        if result.returncode == 0:
+            # Video lives at manim's known output path
+            video_path = result.output_path if result.output_kind == "video" else None
             
             if video_path:
-                target_name = f"{output_filename}.mp4"
-                target_path = os.path.join(STATIC_DIR, target_name)
-                shutil.move(video_path, target_path)
-                video_url = f"/static/{target_name}"
+                video = await publish_artifact(video_path)
+                video_url = video.url
                 
                 print(f"[{request_id}] 🎉 直接渲染成功!")
+                await store_render(cache_key, video.path)
+                upgrade_id = schedule_upgrade(code, scene_name, connection_client_id(websocket), make_upgrade_notifier(websocket))
                 
                 await websocket.send_json({
                     "type": "result",
                     "status": "success",
                     "video": video_url,
-                    "code": code
+                    "code": code,
+                    "upgrading": bool(upgrade_id)
+                })
+            elif result.output_kind == "image":
+                # Static scene: a single frame, wrapped into a one-frame clip
+                video_url, image_url = await publish_static_render(result.output_path, output_filename, code, cache_key)
+                print(f"[{request_id}] 🖼️ 静态场景渲染成功!")
+                await websocket.send_json({
+                    "type": "result",
+                    "status": "success",
+                    "video": video_url,
+                    "image": image_url,
+                    "code": code,
+                    "warning": STATIC_SCENE_WARNING
                 })
             else:
                 await websocket.send_json({
                     "type": "error",
                     "message": "渲染完成但未找到视频文件",
-                    "details": stderr[-500:] if stderr else ""
+                    "details": result.stderr[-500:] if result.stderr else ""
                 })
         else:
-            error_details = stderr[-500:] if stderr else "未知错误"
+            error_details = result.stderr[-500:] if result.stderr else "未知错误"
             print(f"[{request_id}] ❌ 渲染失败: {error_details[:100]}...")
             await websocket.send_json({
                 "type": "error",
@@ -1092,6 +1690,11 @@ async def render_code_directly(code: str, websocket: WebSocket):
         except:
             pass
             
+    except asyncio.CancelledError:
+        print(f"[{request_id}] ⏹️ 渲染已取消")
+        if request_dir:
+            shutil.rmtree(request_dir, ignore_errors=True)
+        raise
     except Exception as e:
         print(f"[{request_id}] 💥 直接渲染异常: {str(e)}")
         await websocket.send_json({
@@ -1131,17 +1734,17 @@ async def modify_code_with_ai(code: str, instruction: str, websocket: WebSocket)
         
         await send_status("AI 正在修改代码...")
         
-        response = await client.chat.completions.create(
+        modifier_content = await llm.complete(
+            "modifier",
             model=MODEL_NAME,
             messages=[
                 {"role": "system", "content": PROMPT_CODE_MODIFIER},
                 {"role": "user", "content": modifier_input}
             ],
-            stream=False,
             temperature=0.3
         )
         
-        modified_code = extract_code_from_markdown(response.choices[0].message.content)
+        modified_code = extract_code_from_markdown(modifier_content)
         
         # 🛡️ 安检
         is_valid, reason = validate_code_completeness(modified_code)
@@ -1164,20 +1767,122 @@ async def modify_code_with_ai(code: str, instruction: str, websocket: WebSocket)
         })
 
 # ================= 🔌 WebSocket 接口 =================
+# ================= 🔌 WebSocket 会话 =================
+# 当前协程所属的会话 (由 ChatSession.launch 设置，派生的后台任务据此登记到会话名下)
+current_session = contextvars.ContextVar("current_session", default=None)
+
+class ChatSession:
+    """一个 WebSocket 连接上的请求任务树
+
+    每个请求作为独立任务运行，每种请求 (chat / render_code / modify_code / scrub) 各占一个槽位：
+    同类型的新请求会取消旧请求 (旧的已无人等待)，不同类型的请求互不影响；连接断开时全部取消。
+    取消会沿着 await 链传播：进行中的 LLM 请求随之中止，渲染任务由调度器杀掉整个进程组。
+    """
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.slots = {}        # {请求类型: 当前任务}
+        self.detached = set()  # 请求派生的后台任务 (静态预览、高清补渲)
+
+    def launch(self, slot, coro):
+        previous = self.slots.get(slot)
+        if previous and not previous.done():
+            print(f"⏹️ 新指令取代了未完成的请求 ({slot})")
+            previous.cancel()
+        token = current_session.set(self)
+        try:
+            task = asyncio.create_task(coro)
+        finally:
+            current_session.reset(token)
+        task.add_done_callback(_report_session_failure)
+        self.slots[slot] = task
+        return task
+
+    def adopt(self, task):
+        self.detached.add(task)
+        task.add_done_callback(self.detached.discard)
+
+    def cancel(self, slot=None):
+        """取消指定类型的请求；不指定时取消全部进行中的请求"""
+        for name, task in self.slots.items():
+            if (slot is None or name == slot) and not task.done():
+                task.cancel()
+
+    async def close(self):
+        tasks = [t for t in [*self.slots.values(), *self.detached] if not t.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            print(f"🧹 已取消 {len(tasks)} 个无人接收的任务")
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+def adopt_session_task(task):
+    """把后台任务登记到当前会话 (不在会话中时什么也不做)"""
+    session = current_session.get()
+    if session is not None:
+        session.adopt(task)
+
+def _report_session_failure(task):
+    if not task.cancelled() and task.exception():
+        print(f"❌ 会话任务异常: {task.exception()}")
+
+async def handle_chat_prompt(prompt: str, websocket: WebSocket):
+    """处理一条自然语言指令：先查缓存，未命中再走完整工作流"""
+    print(f"\n{'='*60}")
+    print(f"⚡ WS 收到指令: {prompt}")
+    print(f"{'='*60}")
+
+    # 0. 获取当前代码上下文 (用于缓存指纹)
+    current_code_snapshot = get_current_code_content()
+
+    # 1. 检查缓存 (传入当前代码)
+    cached_video = await asyncio.to_thread(get_cached_video, prompt, current_code_snapshot)
+    if cached_video:
+        print(f"✨ 命中缓存: {prompt}")
+        await websocket.send_json({
+            "type": "progress",
+            "step": "cache",
+            "message": "发现相同灵感，正在调取记忆..."
+        })
+        await websocket.send_json({
+            "type": "result",
+            "status": "success",
+            "video": cached_video,
+            "code": "（缓存内容）",
+            "cached": True
+        })
+        return
+
+    # 2. 无缓存，开始完整工作流
+    await process_chat_workflow(prompt, websocket)
+
 @app.websocket("/ws/chat")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     print("🔌 新的 WebSocket 连接建立")
+    session = ChatSession(websocket)
     
     try:
         while True:
+            # 请求在后台任务中执行，这里持续收消息，才能及时发现断开 / 新指令
             data = await websocket.receive_json()
             
+            # === 主动停止请求 (可用 target 指定 chat / render_code / modify_code / scrub) ===
+            if data.get("type") == "cancel":
+                session.cancel(data.get("target"))
+                continue
+            
             # === NEW: Handle direct code rendering ===
             if data.get("type") == "render_code":
                 code = data.get("code")
                 if code:
-                    await render_code_directly(code, websocket)
+                    session.launch("render_code", render_code_directly(code, websocket))
+                continue
+            
+            # === 单帧定位：查看某一时刻 / 某一步的画面 ===
+            if data.get("type") == "scrub":
+                if data.get("code"):
+                    session.launch("scrub", scrub_frame_ws(data, websocket))
                 continue
             
             # === NEW: Handle AI code modification ===
@@ -1185,7 +1890,7 @@ async def websocket_endpoint(websocket: WebSocket):
                 code = data.get("code")
                 instruction = data.get("instruction")
                 if code and instruction:
-                    await modify_code_with_ai(code, instruction, websocket)
+                    session.launch("modify_code", modify_code_with_ai(code, instruction, websocket))
                 continue
             
             prompt = data.get("prompt")
@@ -1193,42 +1898,14 @@ async def websocket_endpoint(websocket: WebSocket):
             if not prompt:
                 continue
 
-            print(f"\n{'='*60}")
-            print(f"⚡ WS 收到指令: {prompt}")
-            print(f"{'='*60}")
-
-            # 1. 检查缓存
-            # 0. 获取当前代码上下文 (用于缓存指纹)
-            current_code_snapshot = get_current_code_content()
-
-            # 1. 检查缓存 (传入当前代码)
-            cached_video = get_cached_video(prompt, current_code_snapshot)
-            if cached_video:
-                print(f"✨ 命中缓存: {prompt}")
-                await websocket.send_json({
-                    "type": "progress",
-                    "step": "cache",
-                    "message": "发现相同灵感，正在调取记忆..."
-                })
-                # 稍微停顿展示一下缓存命中效果
-                await asyncio.sleep(0.5)
-                
-                await websocket.send_json({
-                    "type": "result",
-                    "status": "success",
-                    "video": cached_video,
-                    "code": "（缓存内容）",
-                    "cached": True
-                })
-                continue
-
-            # 2. 无缓存，开始完整工作流
-            await process_chat_workflow(prompt, websocket)
+            session.launch("chat", handle_chat_prompt(prompt, websocket))
             
     except WebSocketDisconnect:
         print("🔌 客户端断开连接")
     except Exception as e:
         print(f"❌ WS异常: {e}")
+    finally:
+        await session.close()
 
 # ================= 🌐 静态页面路由 =================
 @app.get("/")
@@ -1258,13 +1935,29 @@ async def debug_info():
             "temp_dir_exists": os.path.exists(TEMP_DIR),
             "scene_file_exists": os.path.exists(SCENE_FILE)
         },
-        "context": context_manager.get_context_summary()
+        "context": context_manager.get_context_summary(),
+        "llm": llm.summary(),
+        "pipeline": {**pipeline_policy.summary(), "speculation": speculation_stats},
+        "prompt_cache": {
+            **prompt_cache.summary(),
+            "matches": prompt_match_stats,
+            "index": prompt_index.summary()
+        },
+        "render": {
+            "scheduler": render_scheduler.snapshot(),
+            "pool": {"available": render_pool.available, **render_pool.stats},
+            "cache": {"enabled": render_cache.enabled, **render_cache.stats},
+            "artifacts": artifact_store.summary(),
+            "media": media_files.stats,
+            "gc": storage_gc.stats,
+            "farm": render_farm.snapshot() if render_farm is not None else None
+        }
     }
 
 @app.post("/api/reset")
 async def reset_system():
     """重置系统：这是'核按钮'，彻底删除所有数据"""
-    hard_reset_system()
+    await asyncio.to_thread(hard_reset_system)
     return {"message": "系统已彻底重置"}
 
 @app.get("/api/code/current")
@@ -1302,7 +1995,8 @@ async def generate_suggestions(request: SuggestionRequest):
 
 只返回 JSON 数组，不要其他内容。"""
 
-        response = await client.chat.completions.create(
+        result = await llm.complete(
+            "suggestions",
             model=MODEL_NAME,
             messages=[
                 {"role": "system", "content": "你是一个 Manim 动画代码助手，只返回 JSON 格式的建议数组。"},
@@ -1311,8 +2005,7 @@ async def generate_suggestions(request: SuggestionRequest):
             temperature=0.8,
             max_tokens=200
         )
-        
-        result = response.choices[0].message.content.strip()
+        result = (result or "").strip()
         
         # 尝试解析 JSON
         try:
@@ -1343,22 +2036,64 @@ async def generate_suggestions(request: SuggestionRequest):
 
 # ================= 🔌 HTTP REST API for Gateway Integration =================
 
+# /render 的响应模式
+#   json   : 兼容旧调用方，URL + Base64 (Base64 放到线程里算，不占事件循环)
+#   url    : 只返回 URL 与内容哈希，调用方自行经 /static 拉取
+#   stream : 直接回传文件的原始字节，元数据放在响应头里
+RENDER_RESPONSE_MODES = ("json", "url", "stream")
+
+def read_base64(path):
+    import base64
+    with open(path, "rb") as f:
+        return base64.b64encode(f.read()).decode('utf-8')
+
+async def build_render_response(mode, file_path, payload):
+    """按 mode 组装 /render 的成功响应
+
+    file_path 是 static/ 下已发布的视频；静态场景封装不出视频时是那张图片。
+    这里算出的哈希同时作为 /static 的 ETag 缓存下来。
+    """
+    sha256, size = await asyncio.to_thread(media_files.digest, file_path)
+    if mode == "stream":
+        is_video = file_path.endswith(".mp4")
+        return FileResponse(
+            file_path,
+            media_type="video/mp4" if is_video else "image/png",
+            headers={
+                "ETag": f'"{sha256}"',
+                "X-Content-SHA256": sha256,
+                # 响应头只能是 ASCII，警告等中文字段以 \u 转义
+                "X-Render-Meta": json.dumps(payload, ensure_ascii=True),
+            }
+        )
+    payload = {**payload, "sha256": sha256, "size": size}
+    if mode == "json" and payload.get("videoUrl"):
+        payload["videoBase64"] = await asyncio.to_thread(read_base64, file_path)
+    return JSONResponse(payload)
+
 class RenderRequest(BaseModel):
     code: str
     client_id: str = "anonymous" # ✨ 新增：身份标识
+    mode: str = "json"           # json / url / stream，见 RENDER_RESPONSE_MODES
 
 @app.post("/render")
 async def http_render_code(request: RenderRequest):
     """HTTP REST 端点：直接渲染 Manim 代码
     
     用于 Gateway 调用，无需 WebSocket 连接。
-    返回视频的 URL 或 Base64 编码。
+    按 mode 返回视频的 URL (+ Base64)，或者直接返回视频字节流。
     """
+    if request.mode not in RENDER_RESPONSE_MODES:
+        return JSONResponse({
+            "success": False,
+            "error": f"未知的 mode: {request.mode} (可选 {', '.join(RENDER_RESPONSE_MODES)})"
+        }, status_code=400)
     request_id = str(uuid.uuid4())[:8]
     output_filename = f"video_{request_id}"
     
     print(f"[{request_id}] 📡 收到 HTTP 渲染请求")
     
+    request_dir = None
     try:
         code = request.code
         
@@ -1366,6 +2101,23 @@ async def http_render_code(request: RenderRequest):
         code_analysis = analyze_code_structure(code)
         scene_name = code_analysis.get("scene_class") or DEFAULT_SCENE_NAME
         
+        # 网关经常重复提交相同代码 (用户重新打开会话)：命中缓存直接返回
+        cache_key, cached_url, cached_entry = await get_cached_render(code)
+        if cached_url:
+            print(f"[{request_id}] ✨ 命中渲染缓存 {cache_key[:12]}")
+            response = {
+                "success": True,
+                "videoUrl": cached_url,
+                "cached": True
+            }
+            if cached_entry.get("warning"):
+                response["warning"] = cached_entry["warning"]
+                response["static"] = True
+                response["imageUrl"] = await get_cached_still_image(code)
+            else:
+                response["upgradeId"] = schedule_upgrade(code, scene_name, request.client_id)
+            return await build_render_response(request.mode, static_path(cached_url), response)
+        
         # 2. 创建隔离的临时目录
         request_dir = os.path.join(TEMP_DIR, f"req_{request_id}")
         os.makedirs(request_dir, exist_ok=True)
@@ -1376,118 +2128,79 @@ async def http_render_code(request: RenderRequest):
         with open(local_scene_file, "w", encoding="utf-8") as f:
             f.write(code)
         
-        # 4. 运行 Manim
-        cmd = [
-            sys.executable, "-m", "manim",
-            DEFAULT_QUALITY,
-            "--media_dir", request_dir,
-            "-o", output_filename,
-            local_scene_file,
-            scene_name
-        ]
+        # 4. 运行 Manim (静态场景直接 -s 出单帧，不编码视频)
+        is_static = code_analysis.get("is_static", False)
+        job = RenderJob(
+            local_scene_file, scene_name, request_dir, output_filename, quality=DEFAULT_QUALITY,
+            still=is_static,
+            expected_animations=code_analysis.get("play_calls", 0),
+            sections=None if is_static else plan_render_sections(code, scene_name)
+        )
         
-        print(f"[{request_id}] 🎬 正在渲染 (Client: {request.client_id})...")
-        returncode, stdout, stderr = await asyncio.to_thread(run_manim_safe, cmd, request.client_id)
+        print(f"[{request_id}] 🎬 正在渲染{' (静态场景)' if is_static else ''} (Client: {request.client_id})...")
+        # 同一用户的新请求会顶替其旧的 /render 任务 (前端允许连按重试)
+        result = await render_manim(
+            job, request.client_id, lane=LANE_GATEWAY,
+            # 匿名请求无法区分用户，互相顶替就成了跨用户取消
+            supersede=request.client_id != "anonymous"
+        )
         
-        if returncode == 0:
-            # 查找视频文件
-            video_path = await find_video_file(request_dir, output_filename)
+        if result.returncode == 0:
+            # 视频位于 manim 约定的输出路径
+            video_path = result.output_path if result.output_kind == "video" else None
             
             if video_path:
-                target_name = f"{output_filename}.mp4"
-                target_path = os.path.join(STATIC_DIR, target_name)
-                shutil.move(video_path, target_path)
-                video_url = f"/static/{target_name}"
-                
-                # 同时提供 Base64（供前端直接使用）
-                import base64
-                with open(target_path, "rb") as vf:
-                    video_base64 = base64.b64encode(vf.read()).decode('utf-8')
+                video = await publish_artifact(video_path)
+                video_url = video.url
                 
                 print(f"[{request_id}] ✅ 渲染成功!")
+                await store_render(cache_key, video.path)
+                # 🪜 草稿先返回，高清版本可通过 GET /render/{upgradeId}/upgrade 查询
+                upgrade_id = schedule_upgrade(code, scene_name, request.client_id)
                 
-                # 清理临时目录
-                try:
-                    shutil.rmtree(request_dir, ignore_errors=True)
-                except:
-                    pass
-                
-                return JSONResponse({
+                return await build_render_response(request.mode, video.path, {
                     "success": True,
                     "videoUrl": video_url,
-                    "videoBase64": video_base64
+                    "upgradeId": upgrade_id
                 })
             else:
-                # 尝试查找图片 (如果 Manim 因为是静态场景只生成了图片)
-                image_path = await find_image_file(request_dir, output_filename)
+                # 静态场景 (预先识别走 -s，或者漏判后 manim 自己退化) 只有一张图片
+                image_path = result.output_path if result.output_kind == "image" else None
                 
                 if image_path:
-                    print(f"[{request_id}] ⚠️ 未找到视频，但在 {image_path} 找到了图片。正在转换为 1s 视频...")
-                    target_name = f"{output_filename}.mp4"
-                    target_path = os.path.join(STATIC_DIR, target_name)
+                    video_url, image_url = await publish_static_render(image_path, output_filename, code, cache_key)
+                    response = {
+                        "success": True,
+                        "imageUrl": image_url,
+                        "static": True,
+                        "warning": STATIC_SCENE_WARNING
+                    }
+                    if video_url:
+                        response["videoUrl"] = video_url
+                    print(f"[{request_id}] ✅ 静态场景渲染成功!")
                     
-                    # 使用 ffmpeg 将图片转为 1s 视频
-                    ffmpeg_cmd = [
-                        "ffmpeg", "-y",
-                        "-loop", "1", "-i", image_path,
-                        "-c:v", "libx264", "-t", "1", "-pix_fmt", "yuv420p",
-                        target_path
-                    ]
-                    
-                    bg_proc = await asyncio.create_subprocess_exec(
-                        *ffmpeg_cmd,
-                        stdout=asyncio.subprocess.PIPE,
-                        stderr=asyncio.subprocess.PIPE
+                    return await build_render_response(
+                        request.mode, static_path(video_url or image_url), response
                     )
-                    _, _ = await bg_proc.communicate()
-                    
-                    if bg_proc.returncode == 0 and os.path.exists(target_path):
-                        video_url = f"/static/{target_name}"
-                        
-                        import base64
-                        with open(target_path, "rb") as vf:
-                            video_base64 = base64.b64encode(vf.read()).decode('utf-8')
-                            
-                        print(f"[{request_id}] ✅ 图片转视频成功!")
-                        
-                        # 清理临时目录
-                        try:
-                            shutil.rmtree(request_dir, ignore_errors=True)
-                        except:
-                            pass
-                        
-                        return JSONResponse({
-                            "success": True,
-                            "videoUrl": video_url,
-                            "videoBase64": video_base64,
-                            "warning": "这是一个静态场景"
-                        })
                 
                 # Debug logging if still failing
                 print(f"[{request_id}] ❌ 渲染完成但未找到视频或图片文件")
-                print(f"[{request_id}] Stdout: {stdout[-200:]}")
-                print(f"[{request_id}] Stderr: {stderr[-200:]}")
-                print(f"[{request_id}] Files in {request_dir}:")
-                for root, dirs, files in os.walk(request_dir):
-                    print(f"  {root}: {files}")
+                print(f"[{request_id}] Stdout: {result.stdout[-200:]}")
+                print(f"[{request_id}] Stderr: {result.stderr[-200:]}")
+                print(f"[{request_id}] 预期输出: {job.video_path} / {job.image_path}")
                 
                 return JSONResponse({
                     "success": False,
                     "error": "渲染完成但未找到任何输出文件"
                 }, status_code=500)
         else:
-            error_details = stderr[-500:] if stderr else "未知错误"
+            error_details = result.stderr[-500:] if result.stderr else "未知错误"
             print(f"[{request_id}] ❌ 渲染失败: {error_details[:100]}...")
             
-            # 清理
-            try:
-                shutil.rmtree(request_dir, ignore_errors=True)
-            except:
-                pass
-                
             return JSONResponse({
                 "success": False,
-                "error": error_details
+                "error": error_details,
+                "errorKind": result.error_kind
             }, status_code=500)
             
     except Exception as e:
@@ -1496,6 +2209,53 @@ async def http_render_code(request: RenderRequest):
             "success": False,
             "error": str(e)
         }, status_code=500)
+    finally:
+        # 产物在返回前都已发布到 static/ (或产物仓库)，临时目录在任何出口都要清理 (包括找不到输出与异常)
+        if request_dir:
+            shutil.rmtree(request_dir, ignore_errors=True)
+
+class FrameRequest(BaseModel):
+    code: str
+    time: Optional[float] = None       # 场景时间 (秒)
+    animation: Optional[int] = None    # 或者：第 k 个动画结束时 (0 = 第一个动画之前)
+    format: str = "png"                # png / webp
+    client_id: str = "anonymous"
+
+@app.post("/render/frame")
+async def http_render_frame(request: FrameRequest):
+    """HTTP 端点：低分辨率渲染指定时刻 / 指定动画之后的单帧画面"""
+    try:
+        scrub = parse_scrub(request.time, request.animation)
+        if scrub is None:
+            raise ValueError("需要指定 time 或 animation")
+    except ValueError as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=400)
+
+    url, cached, error = await render_frame(request.code, scrub, request.format, request.client_id)
+    if not url:
+        return JSONResponse({"success": False, "error": error}, status_code=500)
+    return {"success": True, "frameUrl": url, "cached": cached, **scrub}
+
+@app.get("/render/{upgrade_id}/upgrade")
+async def http_render_upgrade(upgrade_id: str):
+    """查询 /render 草稿对应的高清补渲状态 (pending / ready / failed / cancelled)"""
+    state = render_upgrades.get(upgrade_id)
+    if state is None:
+        return JSONResponse({"success": False, "error": "未知或已过期的 upgradeId"}, status_code=404)
+    return {"success": True, "upgradeId": upgrade_id, **state}
+
+@app.post("/farm/heartbeat")
+async def farm_heartbeat(request: Request):
+    """渲染节点心跳：上报地址、槽位与当前负载"""
+    if render_farm is None:
+        raise HTTPException(status_code=404, detail="渲染集群未启用")
+    if not token_matches(render_farm.token, request.headers.get("X-Render-Token")):
+        raise HTTPException(status_code=403, detail="无效的集群令牌")
+    try:
+        render_farm.heartbeat(await request.json())
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"ok": True}
 
 @app.get("/health")
 async def health_check():
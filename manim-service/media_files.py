@@ -0,0 +1,227 @@
+# media_files.py
+"""
+渲染产物的媒体分发 (/static)
+static/ 下的文件名都带有请求 ID 或内容指纹，一旦发布就不会再变 (渐进式 HLS 播放列表除外)：
+  - 强 ETag 直接取文件内容的 sha256 (按 大小+mtime 缓存，每个文件只算一次)
+  - Cache-Control: immutable，浏览器重播 / 拖动进度条不再回源
+  - 单区间 Range (206 / 416) 与 If-Range / If-None-Match，浏览器 <video> 拖动只取需要的部分
+  - 传输优先走 ASGI 的零拷贝扩展 (http.response.zerocopy / pathsend)，服务器不支持时分块读取
+  - 可选地通过 X-Accel-Redirect 之类的内部重定向头把传输交给前置代理 (nginx sendfile)
+"""
+
+import os
+import re
+import time
+import asyncio
+import hashlib
+import mimetypes
+from collections import OrderedDict
+from email.utils import formatdate
+
+from starlette.responses import Response, PlainTextResponse
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# 渲染过程中还会追加内容的文件 (渐进式 HLS 播放列表)，每次都要回源校验
+MUTABLE_SUFFIXES = (".m3u8",)
+MUTABLE_CACHE_CONTROL = "no-cache"
+
+# 发布过程中的临时文件 (render_cache._link_or_copy) 不对外提供
+_HIDDEN_SUFFIXES = (".tmp",)
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+_SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+mimetypes.add_type("image/webp", ".webp")
+mimetypes.add_type("application/vnd.apple.mpegurl", ".m3u8")
+mimetypes.add_type("video/mp2t", ".ts")
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """分块计算文件的 sha256，返回 (hex, 字节数)"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def parse_range(header, size):
+    """解析 Range 头
+
+    返回 (start, end) (含 end)；无法处理或无需处理时返回 None (按完整文件响应，RFC 允许忽略 Range)；
+    区间完全落在文件之外时抛出 ValueError (416)。多区间请求直接忽略。
+    """
+    if not header:
+        return None
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # bytes=-N：最后 N 个字节
+        length = int(last)
+        if length == 0:
+            raise ValueError("empty suffix range")
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size:
+        raise ValueError("range start beyond end of file")
+    if end < start:
+        return None
+    return start, end
+
+
+def _etag_matches(header, etag):
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # 比较时忽略弱校验前缀 W/ (If-None-Match 使用弱比较)
+    tags = [t.strip().removeprefix("W/") for t in header.split(",")]
+    return etag in tags
+
+
+class MediaFiles:
+    """static/ 目录的媒体分发"""
+
+    def __init__(self, directory, accel_header="", accel_prefix="", max_digests=4096, content_addressed=None):
+        self.directory = os.path.realpath(directory)
+        # 按 sha256 命名的子目录 (artifact_store)：文件名就是内容哈希，不必再算
+        self.content_addressed = os.path.realpath(content_addressed) if content_addressed else None
+        self.accel_header = accel_header
+        self.accel_prefix = accel_prefix
+        self.max_digests = max_digests
+        self._digests = OrderedDict()  # path -> (size, mtime_ns, sha256)
+        self._served = {}  # 仓库产物 sha256 -> 最近一次分发的时间，由 drain_served 批量交给 GC
+        self.stats = {"full": 0, "partial": 0, "not_modified": 0, "accel": 0}
+
+    def resolve(self, name):
+        """把 URL 中的文件名映射到 static/ 内的真实路径；越界、临时文件或不存在时返回 None"""
+        if not name or name.endswith(_HIDDEN_SUFFIXES):
+            return None
+        path = os.path.realpath(os.path.join(self.directory, name))
+        if os.path.commonpath([path, self.directory]) != self.directory:
+            return None
+        return path if os.path.isfile(path) else None
+
+    def is_content_addressed(self, path):
+        return bool(self.content_addressed) and path.startswith(self.content_addressed + os.sep)
+
+    def drain_served(self):
+        """取走并清空自上次以来的分发记录 {sha256: 时间戳}"""
+        served, self._served = self._served, {}
+        return served
+
+    def digest(self, path, stat_result=None):
+        """带缓存的 file_digest：文件大小与 mtime 不变就复用上次的结果"""
+        stat_result = stat_result or os.stat(path)
+        if self.is_content_addressed(path):
+            stem = os.path.splitext(os.path.basename(path))[0]
+            if _SHA256_RE.match(stem):
+                return stem, stat_result.st_size
+        known = self._digests.get(path)
+        if known and known[:2] == (stat_result.st_size, stat_result.st_mtime_ns):
+            self._digests.move_to_end(path)
+            return known[2], stat_result.st_size
+        sha256, size = file_digest(path)
+        self._digests[path] = (stat_result.st_size, stat_result.st_mtime_ns, sha256)
+        while len(self._digests) > self.max_digests:
+            self._digests.popitem(last=False)
+        return sha256, size
+
+    async def serve(self, name, request_headers):
+        path = self.resolve(name)
+        if path is None:
+            return PlainTextResponse("Not Found", status_code=404)
+        stat_result = await asyncio.to_thread(os.stat, path)
+        sha256, size = await asyncio.to_thread(self.digest, path, stat_result)
+        etag = f'"{sha256}"'
+        if self.is_content_addressed(path):
+            self._served[sha256] = time.time()
+        headers = {
+            "ETag": etag,
+            "Cache-Control": MUTABLE_CACHE_CONTROL if path.endswith(MUTABLE_SUFFIXES) else IMMUTABLE_CACHE_CONTROL,
+            "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+            "Accept-Ranges": "bytes",
+        }
+
+        if _etag_matches(request_headers.get("if-none-match"), etag):
+            self.stats["not_modified"] += 1
+            return Response(status_code=304, headers=headers)
+
+        media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if self.accel_header:
+            # 前置代理自己处理 Range / 条件请求，这里只给出位置与缓存头
+            self.stats["accel"] += 1
+            headers[self.accel_header] = self.accel_prefix + os.path.relpath(path, self.directory)
+            return Response(headers=headers, media_type=media_type)
+
+        byte_range = None
+        if_range = request_headers.get("if-range")
+        if if_range is None or if_range.strip() == etag:
+            try:
+                byte_range = parse_range(request_headers.get("range"), size)
+            except ValueError:
+                return PlainTextResponse(
+                    "Range Not Satisfiable", status_code=416,
+                    headers={"Content-Range": f"bytes */{size}", "ETag": etag}
+                )
+
+        self.stats["partial" if byte_range else "full"] += 1
+        return MediaResponse(path, size, byte_range, headers, media_type)
+
+
+class MediaResponse(Response):
+    """按 (可选的) 字节区间发送文件"""
+
+    chunk_size = 256 * 1024
+
+    def __init__(self, path, size, byte_range, headers, media_type):
+        self.path = path
+        self.background = None
+        self.media_type = media_type
+        self.full = byte_range is None
+        self.start, self.end = (0, size - 1) if self.full else byte_range
+        self.status_code = 200 if self.full else 206
+        headers = dict(headers)
+        headers["Content-Length"] = str(self.end - self.start + 1 if size else 0)
+        if not self.full:
+            headers["Content-Range"] = f"bytes {self.start}-{self.end}/{size}"
+        self.init_headers(headers)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        count = self.end - self.start + 1
+        if scope["method"].upper() == "HEAD" or count <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        extensions = scope.get("extensions") or {}
+        if "http.response.zerocopy" in extensions:
+            with open(self.path, "rb") as f:
+                await send({
+                    "type": "http.response.zerocopy", "file": f.fileno(),
+                    "offset": self.start, "count": count, "more_body": False
+                })
+            return
+        if self.full and "http.response.pathsend" in extensions:
+            await send({"type": "http.response.pathsend", "path": self.path})
+            return
+
+        with open(self.path, "rb") as f:
+            f.seek(self.start)
+            remaining = count
+            while remaining > 0:
+                chunk = await asyncio.to_thread(f.read, min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # 文件在传输途中变短 (不应发生)：结束响应，避免连接挂起
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
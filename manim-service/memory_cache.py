@@ -0,0 +1,107 @@
+# memory_cache.py
+"""
+进程内 LRU 缓存层
+渲染缓存 / Prompt 缓存的每次命中都要读磁盘 (元数据 json、SQLite) 并检查产物文件。
+课堂上几十个人发同一句指令时，这些 I/O 都是重复的。这里在持久层前面放一层内存 LRU：
+  - 条目数、估算字节数双重上限，外加 TTL
+  - 只在从持久层回填时校验一次产物，之后的命中不碰磁盘
+  - 条目按产物的内容哈希打标签，产物被回收 / 系统重置时按标签失效
+"""
+
+import json
+import time
+import threading
+from collections import OrderedDict
+
+
+class MemoryLRU:
+    """条目数 / 字节数 / TTL 有界的 LRU
+
+    tag_of(value) 返回该条目依赖的产物标签 (内容哈希) 列表，用于 invalidate_tags。
+    """
+
+    def __init__(self, max_entries=2048, max_bytes=4 * 1024 * 1024, ttl=600, tag_of=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.tag_of = tag_of
+        self.bytes = 0
+        self._entries = OrderedDict()  # key -> (value, size, expires, tags)
+        self._tags = {}                # tag -> {key}
+        self._lock = threading.Lock()  # 产物回收在线程池里触发失效
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None or item[2] <= time.monotonic():
+                if item is not None:
+                    self._drop(key)
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return item[0]
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        size = len(json.dumps(value, ensure_ascii=False, default=str)) + len(key)
+        if size > self.max_bytes:
+            return
+        tags = tuple(tag for tag in (self.tag_of(value) if self.tag_of else ()) if tag)
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (value, size, time.monotonic() + self.ttl, tags)
+            self.bytes += size
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.stats["evictions"] += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._drop(key):
+                self.stats["invalidations"] += 1
+
+    def invalidate_tags(self, tags):
+        """产物被删除：丢弃依赖它们的条目；tags 为 None 时全部丢弃"""
+        with self._lock:
+            if tags is None:
+                self.stats["invalidations"] += len(self._entries)
+                self._clear()
+                return
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    if self._drop(key):
+                        self.stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        self._entries.clear()
+        self._tags.clear()
+        self.bytes = 0
+
+    def _drop(self, key):
+        item = self._entries.pop(key, None)
+        if item is None:
+            return False
+        self.bytes -= item[1]
+        for tag in item[3]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+        return True
+
+    def summary(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.bytes, **self.stats}
@@ -0,0 +1,140 @@
+# partial_cache.py
+"""
+Manim 分段视频 (partial movie) 共享缓存
+manim 按每个动画的哈希生成分段视频，但每个请求都渲染到独立的临时目录并在结束后删除，
+导致分段缓存从不命中。这里维护一个跨请求、跨重试共享的分段仓库：
+  - 渲染进程内挂钩 SceneFileWriter：查询分段时先到仓库里找，命中则硬链接回本地目录；
+    每个动画写完后立即把完整的分段登记进仓库 (超时被杀时已完成的分段也不会丢)。
+  - 主进程按总大小做 LRU 淘汰。
+所有写入都是 "临时文件 + os.replace"，多个进程并发读写同一仓库是安全的。
+"""
+
+import os
+import time
+import shutil
+
+
+class PartialMovieCache:
+    """分段视频仓库：{root}/{hash 前两位}/{hash}{ext}"""
+
+    def __init__(self, root, max_bytes=0, evict_interval=60):
+        self.root = root
+        self.max_bytes = max_bytes  # 0 表示不限制
+        self.evict_interval = evict_interval
+        self._last_evict = 0.0
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, hash_invocation, ext=".mp4"):
+        return os.path.join(self.root, hash_invocation[:2], f"{hash_invocation}{ext}")
+
+    def fetch(self, hash_invocation, dest, ext=".mp4"):
+        """命中时把分段放到 dest 并返回 True"""
+        src = self.path_for(hash_invocation, ext)
+        try:
+            _link_or_copy(src, dest)
+            os.utime(src)  # 刷新 mtime，供 LRU 淘汰参考
+        except OSError:
+            return False
+        return True
+
+    def publish(self, src, hash_invocation, ext=".mp4"):
+        """把一个已写完的分段登记进仓库 (已存在则跳过)"""
+        dest = self.path_for(hash_invocation, ext)
+        if os.path.exists(dest) or not os.path.isfile(src):
+            return
+        try:
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            _link_or_copy(src, dest)
+        except OSError as e:
+            print(f"⚠️ 分段缓存写入失败: {e}")
+
+    def evict(self):
+        """总大小超过上限时，按最近使用时间从旧到新删除"""
+        if not self.max_bytes:
+            return 0
+        entries = []
+        total = 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+        removed = 0
+        if total > self.max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+        return removed
+
+    def maybe_evict(self):
+        """节流版 evict：两次扫描之间至少间隔 evict_interval 秒"""
+        now = time.monotonic()
+        if now - self._last_evict < self.evict_interval:
+            return 0
+        self._last_evict = now
+        return self.evict()
+
+    def clear(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+        os.makedirs(self.root, exist_ok=True)
+
+
+def _link_or_copy(src, dst):
+    """原子地把 src 放到 dst：同一文件系统上用硬链接，否则复制"""
+    tmp = f"{dst}.{os.getpid()}.tmp"
+    try:
+        os.link(src, tmp)
+    except FileNotFoundError:
+        raise  # 源文件不存在 (未命中)，复制同样会失败
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+def install_manim_hooks(cache):
+    """在当前 (渲染) 进程内给 manim 的 SceneFileWriter 挂上共享分段缓存"""
+    from manim import config
+    from manim.scene.scene_file_writer import SceneFileWriter
+
+    if getattr(SceneFileWriter, "_partial_cache_installed", False):
+        return
+
+    original_is_cached = SceneFileWriter.is_already_cached
+    original_end_animation = SceneFileWriter.end_animation
+
+    def is_already_cached(self, hash_invocation):
+        if original_is_cached(self, hash_invocation):
+            return True
+        # -s 只出图片时没有分段视频可复用
+        if not config["write_to_movie"] or not hasattr(self, "partial_movie_directory"):
+            return False
+        ext = config["movie_file_extension"]
+        dest = os.path.join(self.partial_movie_directory, f"{hash_invocation}{ext}")
+        return cache.fetch(hash_invocation, dest, ext)
+
+    def end_animation(self, *args, **kwargs):
+        result = original_end_animation(self, *args, **kwargs)
+        # end_animation 返回时分段文件已完整关闭，立即登记
+        for path in getattr(self, "partial_movie_files", None) or []:
+            if path and os.path.isfile(path):
+                name, ext = os.path.splitext(os.path.basename(str(path)))
+                cache.publish(str(path), name, ext)
+        return result
+
+    SceneFileWriter.is_already_cached = is_already_cached
+    SceneFileWriter.end_animation = end_animation
+    SceneFileWriter._partial_cache_installed = True
@@ -0,0 +1,169 @@
+# pipeline_policy.py
+"""
+生成流水线的快速模式 (跳过分析器 / 改进器)
+每条对话指令都要依次经过 意图分析 → 生成器 → 分析器 → 改进器，即使初稿已经通过本地检查、
+本来就能直接渲染。这里按意图类型 (CREATE / MODIFY / ...) 从历史中学习：
+  - 完整流程跑完后记录改进器是否实质改动了初稿 (比较规范化后的 AST)
+  - 快速模式记录初稿第一次渲染是否成功
+审查很少改动代码、快速模式也很少失败的意图类型，初稿通过本地检查且意图置信度足够时直接渲染；
+快速模式渲染失败再回到分析器 + 改进器。另外保留一小部分请求走完整流程，持续更新统计。
+
+生成器的推测执行：生成器只把意图分析的 JSON 当作附加上下文，真正影响初稿的是 "重写场景" 还是
+"在当前代码上改"。guess_intent 根据当前状态与指令措辞预判这一点，生成器与意图分析同时开跑；
+意图分析的结果与预判属于同一类时直接采用推测的初稿，否则丢弃重新生成。
+"""
+
+import re
+import ast
+import random
+
+from render_cache import canonical_code
+
+PIPELINE_MODES = ("full", "auto", "fast")
+
+_CJK = re.compile(r"[一-鿿]")
+_TEX_CALL = re.compile(r"\b(?:MathTex|Tex)\s*\(([^)]*)\)", re.DOTALL)
+
+# 意图对生成器的影响只分两类：CREATE 可以完全重写，其余都基于当前代码修改
+EDIT_INTENTS = ("MODIFY", "ADD", "ENHANCE", "COMPOSE")
+_REWRITE_WORDS = re.compile(r"新建|重新|重做|重来|从头|清空|换一个场景|另一个场景|new scene|start over|from scratch", re.IGNORECASE)
+
+
+def local_review(code):
+    """不调用大模型的初稿检查 (分析器关注的硬性问题)，返回 (是否通过, 原因)"""
+    try:
+        ast.parse(code)
+    except SyntaxError as e:
+        return False, f"语法错误 (第 {e.lineno} 行)"
+    for match in _TEX_CALL.finditer(code):
+        if _CJK.search(match.group(1)):
+            return False, "MathTex / Tex 中含有中文"
+    if re.search(r"\bmath\.", code) and not re.search(r"^\s*import math\b", code, re.MULTILINE):
+        return False, "使用了 math 但没有 import math"
+    if re.search(r"\bnp\.", code) and not re.search(r"^\s*(?:import numpy as np|from manim import \*)", code, re.MULTILINE):
+        return False, "使用了 np 但没有导入 numpy"
+    return True, "通过"
+
+
+def guess_intent(prompt, current_state):
+    """不调用大模型预判意图 (推测执行生成器用)：没有现有代码或指令要求重来时为 CREATE，否则为 MODIFY"""
+    if (current_state or {}).get("status") != "has_code":
+        return "CREATE"
+    if _REWRITE_WORDS.search(prompt or ""):
+        return "CREATE"
+    return "MODIFY"
+
+
+def intent_scope(intent):
+    return "edit" if str(intent or "").strip().upper() in EDIT_INTENTS else "rewrite"
+
+
+def speculation_holds(assumed, intent_analysis):
+    """意图分析的结果是否与推测时的假设一致；分析失败时没有可比的依据，沿用推测的初稿"""
+    if not isinstance(intent_analysis, dict) or not intent_analysis.get("intent"):
+        return True
+    return intent_scope(assumed) == intent_scope(intent_analysis["intent"])
+
+
+def review_changed(draft, final):
+    """改进器是否实质改动了初稿 (忽略注释、空白与局部变量命名)"""
+    return canonical_code(draft) != canonical_code(final)
+
+
+class PipelinePolicy:
+    """按意图类型决定是否跳过分析器 / 改进器
+
+    store: cache_store.CacheStore，每个意图类型一条计数
+    mode: full (总是完整流程) / auto (按历史决定) / fast (本地检查通过就跳过)
+    """
+
+    def __init__(self, store, mode="auto", min_samples=5, max_change_rate=0.2, max_fail_rate=0.3,
+                 min_confidence=0.7, explore=0.1, window=100):
+        self.store = store
+        self.mode = mode if mode in PIPELINE_MODES else "auto"
+        self.min_samples = min_samples
+        self.max_change_rate = max_change_rate
+        self.max_fail_rate = max_fail_rate
+        self.min_confidence = min_confidence
+        self.explore = explore
+        self.window = window  # 计数超过该值后减半，让旧的历史逐渐淡出
+        self.stats = {"fast": 0, "full": 0, "fast_fallbacks": 0}
+
+    @staticmethod
+    def intent_type(intent_analysis):
+        intent = (intent_analysis or {}).get("intent") if isinstance(intent_analysis, dict) else None
+        return str(intent or "UNKNOWN").strip().upper()
+
+    def _counts(self, intent):
+        try:
+            counts = self.store.get(intent)
+        except Exception:
+            counts = None
+        return counts or {"reviews": 0, "changed": 0, "fast": 0, "failed": 0}
+
+    def _save(self, intent, counts):
+        for total, part in (("reviews", "changed"), ("fast", "failed")):
+            if counts[total] > self.window:
+                counts[total] /= 2
+                counts[part] /= 2
+        try:
+            self.store.set(intent, counts, ttl=0)
+        except Exception as e:
+            print(f"⚠️ 流水线统计保存失败: {e}")
+
+    def decide(self, intent_analysis, draft_code, draft_valid):
+        """返回 (模式 "fast" / "full", 原因)"""
+        decision = self._decide(intent_analysis, draft_code, draft_valid)
+        self.stats[decision[0]] += 1
+        return decision
+
+    def _decide(self, intent_analysis, draft_code, draft_valid):
+        if self.mode == "full":
+            return "full", "已关闭快速模式"
+        if not draft_valid:
+            return "full", "初稿不完整"
+        ok, reason = local_review(draft_code)
+        if not ok:
+            return "full", reason
+        if self.mode == "fast":
+            return "fast", "初稿通过本地检查"
+
+        confidence = (intent_analysis or {}).get("confidence") if isinstance(intent_analysis, dict) else None
+        if not isinstance(confidence, (int, float)) or confidence < self.min_confidence:
+            return "full", "意图置信度不足"
+        intent = self.intent_type(intent_analysis)
+        counts = self._counts(intent)
+        if counts["reviews"] < self.min_samples:
+            return "full", f"{intent} 的历史样本不足"
+        if counts["changed"] / counts["reviews"] > self.max_change_rate:
+            return "full", f"{intent} 的初稿经常被改进器修改"
+        if counts["fast"] >= self.min_samples and counts["failed"] / counts["fast"] > self.max_fail_rate:
+            return "full", f"{intent} 的快速模式经常渲染失败"
+        if random.random() < self.explore:
+            return "full", "抽样走完整流程"
+        return "fast", f"{intent} 的初稿很少需要审查"
+
+    def record_review(self, intent_analysis, draft_code, final_code):
+        """完整流程：记录改进器是否实质改动了初稿"""
+        intent = self.intent_type(intent_analysis)
+        counts = self._counts(intent)
+        counts["reviews"] += 1
+        counts["changed"] += int(review_changed(draft_code, final_code))
+        self._save(intent, counts)
+
+    def record_fast(self, intent_analysis, failed):
+        """快速模式：记录初稿第一次渲染是否失败"""
+        intent = self.intent_type(intent_analysis)
+        counts = self._counts(intent)
+        counts["fast"] += 1
+        counts["failed"] += int(failed)
+        if failed:
+            self.stats["fast_fallbacks"] += 1
+        self._save(intent, counts)
+
+    def summary(self):
+        try:
+            intents = dict(self.store.items())
+        except Exception:
+            intents = {}
+        return {"mode": self.mode, **self.stats, "intents": intents}
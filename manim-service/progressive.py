@@ -0,0 +1,186 @@
+# progressive.py
+"""
+渐进式 HLS 输出：边渲染边播放
+manim 每完成一个动画就写好一个完整的分段视频 (partial movie)，但以往要等全部动画渲染、
+拼接并移动到 static/ 之后才能播放。这里：
+  - 渲染进程内挂钩 SceneFileWriter.end_animation，按完成顺序把分段路径追加到
+    {media_dir}/segments.txt
+  - 主进程轮询该清单，把新分段无重编码转封装为 MPEG-TS，追加到 static/ 下的 EVENT 播放列表
+  - 第一个分段就绪时回调 on_ready(播放列表 URL)，客户端即可开始播放
+渲染结束后补上 #EXT-X-ENDLIST，随后照常交付完整的 mp4。
+"""
+
+import os
+import re
+import math
+import asyncio
+
+SEGMENT_MANIFEST = "segments.txt"
+
+_DURATION_PATTERN = re.compile(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)")
+
+
+def install_segment_manifest():
+    """在当前 (渲染) 进程内挂钩 SceneFileWriter，记录每个完成的分段"""
+    from manim import config
+    from manim.scene.scene_file_writer import SceneFileWriter
+
+    if getattr(SceneFileWriter, "_segment_manifest_installed", False):
+        return
+
+    original_end_animation = SceneFileWriter.end_animation
+
+    def end_animation(self, *args, **kwargs):
+        result = original_end_animation(self, *args, **kwargs)
+        # 本动画的分段 (新渲染或命中缓存) 是列表的最后一项；-n 跳过的动画记为 None
+        files = getattr(self, "partial_movie_files", None) or []
+        path = files[-1] if files else None
+        if config["write_to_movie"] and path and os.path.isfile(path):
+            try:
+                with open(os.path.join(config["media_dir"], SEGMENT_MANIFEST), "a", encoding="utf-8") as f:
+                    f.write(f"{os.path.abspath(str(path))}\n")
+            except OSError:
+                pass
+        return result
+
+    SceneFileWriter.end_animation = end_animation
+    SceneFileWriter._segment_manifest_installed = True
+
+
+class ProgressiveStream:
+    """跟随一次渲染的分段清单，发布为 {static_dir}/{name}.m3u8"""
+
+    def __init__(self, media_dir, static_dir, name, url_prefix="/static", on_ready=None, poll_interval=0.3):
+        self.manifest = os.path.join(media_dir, SEGMENT_MANIFEST)
+        self.static_dir = static_dir
+        self.name = name
+        self.url_prefix = url_prefix.rstrip("/")
+        self.on_ready = on_ready  # async 回调 (playlist_url)，第一个分段发布后调用一次
+        self.poll_interval = poll_interval
+        self.segments = []  # [(文件名, 时长)]
+        self._offset = 0    # 清单已读取到的位置
+        self._done = asyncio.Event()
+        self._broken = False
+        self.task = None
+        # 同一目录上一次尝试 (修复重试) 留下的清单不能混进来
+        try:
+            os.remove(self.manifest)
+        except OSError:
+            pass
+
+    @property
+    def playlist_url(self):
+        return f"{self.url_prefix}/{self.name}.m3u8"
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+        return self.task
+
+    async def close(self):
+        """渲染已结束：处理剩余分段并封口播放列表 (须在清理 media 目录之前调用)"""
+        self._done.set()
+        if self.task is not None:
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    def abort(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    async def _run(self):
+        while True:
+            finished = self._done.is_set()
+            for path in self._read_new_entries():
+                if self._broken:
+                    break
+                await self._add_segment(path)
+            if finished:
+                break
+            try:
+                await asyncio.wait_for(self._done.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+        if self.segments:
+            self._write_playlist(ended=True)
+
+    def _read_new_entries(self):
+        try:
+            with open(self.manifest, "rb") as f:
+                f.seek(self._offset)
+                data = f.read()
+        except OSError:
+            return []
+        # 只消费完整的行，写到一半的留给下一轮
+        complete = data[:data.rfind(b"\n") + 1]
+        self._offset += len(complete)
+        return [line for line in complete.decode("utf-8", errors="ignore").splitlines() if line]
+
+    async def _add_segment(self, source):
+        index = len(self.segments)
+        segment_name = f"{self.name}_{index:04d}.ts"
+        offset = sum(duration for _, duration in self.segments)
+        ok, duration, error = await remux_segment(source, os.path.join(self.static_dir, segment_name), offset)
+        if not ok:
+            # 编码不支持 TS 封装等情况：放弃渐进输出，不影响完整视频的交付
+            self._broken = True
+            print(f"⚠️ 渐进式输出已停止 ({self.name}): {error[-200:]}")
+            return
+        self.segments.append((segment_name, duration))
+        self._write_playlist(ended=False)
+        if index == 0 and self.on_ready is not None:
+            try:
+                await self.on_ready(self.playlist_url)
+            except Exception as e:
+                print(f"⚠️ 播放列表推送失败: {e}")
+
+    def _write_playlist(self, ended):
+        target = max(math.ceil(duration) for _, duration in self.segments)
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            "#EXT-X-PLAYLIST-TYPE:EVENT",
+            f"#EXT-X-TARGETDURATION:{max(target, 1)}",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+        ]
+        for segment_name, duration in self.segments:
+            lines += [f"#EXTINF:{duration:.3f},", segment_name]
+        if ended:
+            lines.append("#EXT-X-ENDLIST")
+        path = os.path.join(self.static_dir, f"{self.name}.m3u8")
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp, path)
+
+
+async def remux_segment(source, dest, offset):
+    """把一个分段视频无重编码转封装为 MPEG-TS，时间戳平移 offset 秒
+
+    返回 (ok, 时长, 错误信息)；时长取自 ffmpeg 对输入的探测结果。
+    """
+    tmp = f"{dest}.{os.getpid()}.tmp"
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-y", "-hide_banner", "-i", source,
+            "-an", "-c", "copy", "-output_ts_offset", f"{offset:.3f}",
+            "-muxdelay", "0", "-muxpreload", "0", "-f", "mpegts", tmp,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            _, stderr = await proc.communicate()
+        except asyncio.CancelledError:
+            proc.kill()
+            raise
+    except Exception as e:
+        return False, 0.0, str(e)
+    log = stderr.decode("utf-8", errors="ignore")
+    match = _DURATION_PATTERN.search(log)
+    if proc.returncode != 0 or not match or not os.path.isfile(tmp):
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return False, 0.0, log
+    hours, minutes, seconds = match.groups()
+    os.replace(tmp, dest)
+    return True, int(hours) * 3600 + int(minutes) * 60 + float(seconds), ""
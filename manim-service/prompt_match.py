@@ -0,0 +1,197 @@
+# prompt_match.py
+"""
+Prompt 归一化与近似匹配
+缓存键原来是 md5(prompt.strip() + "_" + 当前代码)："画一个红色的圆形" 与 "画一个红色圆形。"、
+全角 / 半角标点的不同写法都互相命中不了，而同一个班的学生发来的指令大多只差这么一点。这里：
+  - normalize_prompt：NFKC、大小写、标点与空白折叠、去掉中英文停用词，得到精确匹配用的规范形式
+  - PromptIndex：规范形式的字符 n-gram MinHash + LSH 分桶，在同一代码上下文内查找相似度
+    超过阈值的已缓存指令
+数学指令里换一个字就可能是另一道题 (平方 / 立方，n-gram 相似度并不低)，所以近似匹配还要求：
+  - 两边的 "锚点" (数字与短的英文记号，例如 x、sin、2.5) 完全一致
+  - 两者的差别只有增删 (多一个 "它"、少一个 "上")，没有替换
+  - 增删的文字里没有否定词 (不 / 没 / 别 / 无 / 非)、运算符号 (-+*/^=<>)、数字与英文
+    ("旋转" 与 "不要旋转"、"y = x^2" 与 "y = -x^2" 只差一处插入，意思却相反)
+"""
+
+import re
+import difflib
+import hashlib
+import threading
+import unicodedata
+
+# NFKC 之后仍需去掉的标点 (全角逗号、问号等已被 NFKC 折叠成半角)
+_PUNCTUATION = set("!?;:'\"`、。“”‘’「」『』《》〈〉【】…—·～~")
+# 千分位直接去掉；小数点只在数字之间保留，其余的点号 / 逗号按标点处理
+_THOUSANDS = re.compile(r"(?<=\d),(?=\d{3}(?!\d))")
+_DOT_OR_COMMA = re.compile(r",|(?<!\d)\.|\.(?!\d)")
+_TOKEN = re.compile(r"[a-z0-9]+(?:[._'][a-z0-9]+)*|\S")
+_ANCHOR = re.compile(r"^(?:\d+(?:\.\d+)?|[a-z][a-z0-9]{0,2})$")
+# 增删这些字符会改变指令的意思 (英文的 no / not / without 由 a-z 覆盖)
+_MEANINGFUL_EDIT = re.compile(r"[不没别无非+\-*/^=<>0-9a-z]")
+
+# 先整体删除的中文短语 (按长度从长到短)，再删除单字语气词
+_ZH_STOP_PHRASES = sorted(
+    ["请你", "帮我", "给我", "麻烦", "一下", "一个", "一些", "可以", "能不能", "能否", "谢谢", "请"],
+    key=len, reverse=True
+)
+_ZH_STOP_CHARS = {"的", "地", "得", "了", "着", "吧", "呢", "啊", "吗", "呀", "哦", "嘛", "个"}
+# 英文只去掉冠词与客套话：and / with / to / of 这类词会改变意思 ("circle with a square" ≠ "circle and a square")
+_EN_STOP_PHRASES = re.compile(r"\b(?:(?:can|could|would|will) you|thank you)\b")
+_EN_STOPWORDS = {"a", "an", "the", "please", "pls", "plz", "thanks", "thx"}
+
+# MinHash 的哈希族：h_i(x) = (a_i * x + b_i) mod p
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def normalize_prompt(prompt):
+    """指令的规范形式 (精确匹配的键)；全部是停用词时退化为只做 NFKC + 空白折叠"""
+    text = unicodedata.normalize("NFKC", prompt or "").lower()
+    folded = " ".join(text.split())
+    text = "".join(" " if ch in _PUNCTUATION else ch for ch in text)
+    text = _DOT_OR_COMMA.sub(" ", _THOUSANDS.sub("", text))
+    for phrase in _ZH_STOP_PHRASES:
+        text = text.replace(phrase, " ")
+    text = _EN_STOP_PHRASES.sub(" ", text)
+
+    tokens = [
+        token for token in _TOKEN.findall(text)
+        if token not in _ZH_STOP_CHARS and token not in _EN_STOPWORDS
+    ]
+    parts = []
+    for token in tokens:
+        # 只有两个英文 / 数字记号相邻时才需要空格分隔
+        if parts and token[0].isascii() and token[0].isalnum() and parts[-1][-1].isascii() and parts[-1][-1].isalnum():
+            parts.append(" ")
+        parts.append(token)
+    return "".join(parts) or folded
+
+
+def prompt_anchors(normalized):
+    """近似匹配必须一致的记号：数字与短的英文标识符"""
+    return tuple(sorted(token for token in _TOKEN.findall(normalized) if _ANCHOR.match(token)))
+
+
+def context_hash(code):
+    return hashlib.md5((code or "").strip().encode("utf-8")).hexdigest()
+
+
+def _only_insertions(a, b):
+    """a 与 b 之间只差若干处无关紧要的增删 (没有替换，增删的文字也不含否定词 / 运算符 / 数字 / 英文)"""
+    opcodes = difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes()
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "replace":
+            return False
+        if tag != "equal" and _MEANINGFUL_EDIT.search(a[i1:i2] + b[j1:j2]):
+            return False
+    return True
+
+
+def _shingles(text, n):
+    text = text.replace(" ", "")
+    if len(text) <= n:
+        return {text}
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class PromptIndex:
+    """规范化指令的 MinHash LSH 索引 (进程内，按代码上下文隔离)
+
+    num_perm 个哈希分成 bands 段，任意一段完全相同即成为候选，
+    再对候选计算 n-gram 集合的精确 Jaccard 相似度与 threshold 比较。
+    """
+
+    def __init__(self, threshold=0.8, num_perm=64, bands=16, ngram=2):
+        if num_perm % bands:
+            raise ValueError("num_perm 必须能被 bands 整除")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.ngram = ngram
+        seed = hashlib.sha256(b"prompt-minhash").digest()
+        coefficients = [
+            int.from_bytes(hashlib.sha256(seed + i.to_bytes(4, "big")).digest()[:16], "big")
+            for i in range(num_perm)
+        ]
+        self._params = [((c >> 64) % (_MERSENNE_PRIME - 1) + 1, (c & ((1 << 64) - 1)) % _MERSENNE_PRIME)
+                        for c in coefficients]
+        self._entries = {}  # key -> (context, normalized, shingles, signature)
+        self._buckets = {}  # (context, band, band_values) -> {key}
+        self._lock = threading.Lock()  # 过期条目的移除来自回收线程
+        self.stats = {"queries": 0, "candidates": 0, "matches": 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def signature(self, shingles):
+        hashes = [
+            int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+            for shingle in shingles
+        ]
+        return tuple(
+            min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+            for a, b in self._params
+        )
+
+    def _band_keys(self, context, signature):
+        return [
+            (context, band, signature[band * self.rows:(band + 1) * self.rows])
+            for band in range(self.bands)
+        ]
+
+    def add(self, key, normalized, context):
+        shingles = frozenset(_shingles(normalized, self.ngram))
+        signature = self.signature(shingles)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (context, normalized, shingles, signature)
+            for bucket in self._band_keys(context, signature):
+                self._buckets.setdefault(bucket, set()).add(key)
+
+    def remove(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        context, _, _, signature = entry
+        for bucket in self._band_keys(context, signature):
+            keys = self._buckets.get(bucket)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._buckets[bucket]
+
+    def query(self, normalized, context):
+        """同一代码上下文内相似度 >= threshold 的条目，返回 [(key, 相似度)]，从高到低"""
+        shingles = _shingles(normalized, self.ngram)
+        signature = self.signature(shingles)
+        anchors = prompt_anchors(normalized)
+        with self._lock:
+            self.stats["queries"] += 1
+            candidates = set()
+            for bucket in self._band_keys(context, signature):
+                candidates.update(self._buckets.get(bucket, ()))
+            self.stats["candidates"] += len(candidates)
+            matches = []
+            for key in candidates:
+                _, entry_normalized, entry_shingles, _ = self._entries[key]
+                similarity = len(shingles & entry_shingles) / len(shingles | entry_shingles)
+                if (similarity >= self.threshold and prompt_anchors(entry_normalized) == anchors
+                        and _only_insertions(normalized, entry_normalized)):
+                    matches.append((key, similarity))
+        matches.sort(key=lambda item: item[1], reverse=True)
+        if matches:
+            self.stats["matches"] += 1
+        return matches
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def summary(self):
+        return {"entries": len(self._entries), "threshold": self.threshold, **self.stats}
@@ -210,7 +210,10 @@ PROMPT_EMERGENCY_FIXER = """
 6. **检查 NameError**：
    - 如果报错 "name 'math' is not defined"，请在文件开头添加 `import math`。
    - 如果报错 "name 'np' is not defined"，请在文件开头添加 `import numpy as np`。
-7. 确保代码可以运行
+7. **资源超限** (错误信息以 "[资源超限]" 开头)：代码本身能运行，但太重了。
+   - 降低 Surface / ParametricSurface 的 resolution，减少 NumberPlane / 点阵等对象数量。
+   - 检查 while 循环与 updater 是否有明确的结束条件，缩短过长的 run_time。
+8. 确保代码可以运行
 
 只输出修复后的完整Python代码。
 """
@@ -0,0 +1,335 @@
+# render_cache.py
+"""
+渲染结果缓存 (内容寻址)
+以场景代码的规范化 AST 指纹 + 质量参数 + Manim 版本作为键，相同代码直接复用已有产物。
+注释、空白、文档字符串与函数内局部变量命名的差异都不影响指纹。
+"""
+
+import os
+import ast
+import json
+import time
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+
+from media_files import file_digest
+
+# 指纹格式变化时递增，旧缓存自然失效
+CACHE_SCHEMA_VERSION = 2
+
+
+def get_manim_version():
+    """已安装的 manim 版本 (不导入 manim 本身)"""
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+    except ImportError:
+        return "unknown"
+    try:
+        return version("manim")
+    except PackageNotFoundError:
+        return "unknown"
+
+
+class _CodeNormalizer(ast.NodeTransformer):
+    """去掉文档字符串，并把函数内的局部变量按出现顺序重命名为 <v0>, <v1> ...
+
+    参数不改名：调用处的关键字参数 (f(x=1)) 引用的是参数名，改名会让行为不同的代码得到同一指纹。
+    规范名不是合法的标识符，不会与代码里原有的任何名字重合。
+    """
+
+    def __init__(self):
+        self._scopes = []  # 每层函数作用域一个 {原名: 规范名}
+
+    @staticmethod
+    def _strip_docstring(node):
+        body = getattr(node, "body", None)
+        if (isinstance(body, list) and body and isinstance(body[0], ast.Expr)
+                and isinstance(body[0].value, ast.Constant)
+                and isinstance(body[0].value.value, str)):
+            node.body = body[1:] or [ast.Pass()]
+
+    @staticmethod
+    def _params(node):
+        args = node.args
+        names = [a.arg for a in args.posonlyargs + args.args + args.kwonlyargs]
+        if args.vararg:
+            names.append(args.vararg.arg)
+        if args.kwarg:
+            names.append(args.kwarg.arg)
+        return names
+
+    @classmethod
+    def _local_names(cls, node):
+        """收集函数自身作用域内的赋值目标 (不含参数，不深入嵌套的函数 / 类)"""
+        params = set(cls._params(node))
+        names = []
+        declared_outer = set()
+        stack = list(node.body) if isinstance(node.body, list) else [node.body]
+        while stack:
+            child = stack.pop(0)
+            if isinstance(child, (ast.Global, ast.Nonlocal)):
+                declared_outer.update(child.names)
+                continue
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)):
+                continue
+            if isinstance(child, ast.Name) and isinstance(child.ctx, ast.Store):
+                names.append(child.id)
+            stack.extend(ast.iter_child_nodes(child))
+
+        ordered = []
+        for name in names:
+            if name not in ordered and name not in declared_outer and name not in params:
+                ordered.append(name)
+        return ordered
+
+    def _visit_scope(self, node):
+        self._strip_docstring(node)
+        offset = sum(len(scope) for scope in self._scopes)
+        # 参数保持原名，但仍要遮蔽外层同名的局部变量
+        scope = {name: name for name in self._params(node)}
+        scope.update({name: f"<v{offset + i}>" for i, name in enumerate(self._local_names(node))})
+        self._scopes.append(scope)
+        self.generic_visit(node)
+        self._scopes.pop()
+        return node
+
+    def _rename(self, name):
+        for scope in reversed(self._scopes):
+            if name in scope:
+                return scope[name]
+        return name
+
+    def visit_FunctionDef(self, node):
+        return self._visit_scope(node)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+    visit_Lambda = _visit_scope
+
+    def visit_Module(self, node):
+        self._strip_docstring(node)
+        self.generic_visit(node)
+        return node
+
+    def visit_ClassDef(self, node):
+        self._strip_docstring(node)
+        self.generic_visit(node)
+        return node
+
+    def visit_Name(self, node):
+        node.id = self._rename(node.id)
+        return node
+
+    def visit_arg(self, node):
+        node.annotation = None
+        return node
+
+
+def canonical_code(code):
+    """场景代码的规范化形式；语法错误时退化为去掉首尾空白的原文"""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return code.strip()
+    tree = _CodeNormalizer().visit(tree)
+    return ast.dump(tree, annotate_fields=False, include_attributes=False)
+
+
+class RenderCache:
+    """内容寻址的渲染产物缓存
+
+    每个条目由产物文件 `{key}{ext}` 与元数据 `{key}.json` 组成，
+    元数据中可以附带调用方需要复用的信息 (例如侦探抓取到的对象列表)。
+    配置了产物仓库 artifacts (artifact_store.ArtifactStore) 时，已入库的产物不再复制一份，
+    元数据只记录仓库中的位置，并以 "cache:{key}" 的名义持有引用。
+    配置了 memory (memory_cache.MemoryLRU) 时，校验过的条目留在内存里，再次命中不读磁盘；
+    这些命中的访问时间先记在内存里，由 drain_touched 批量刷进产物仓库。
+    """
+
+    def __init__(self, cache_dir, enabled=True, artifacts=None, memory=None, max_digests=4096):
+        self.cache_dir = cache_dir
+        self.enabled = enabled
+        self.artifacts = artifacts
+        self.memory = memory
+        self.manim_version = get_manim_version()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "stale": 0}
+        self._real_dirs = {}  # publish 的目标目录 -> realpath
+        self.max_digests = max_digests
+        self._digests = OrderedDict()  # 产物路径 -> (size, mtime_ns, sha256)
+        self._digest_lock = threading.Lock()  # lookup 在线程池里执行
+        self._touched = {}  # 内存层命中的产物 digest -> 时间戳
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def make_key(self, code, quality="-ql", still=False, variant=""):
+        """代码指纹：规范化 AST + 质量参数 + Manim 版本
+
+        variant: 同一份代码的其它产物 (例如某一时刻的单帧)，为空时与旧键一致
+        """
+        parts = [
+            str(CACHE_SCHEMA_VERSION),
+            self.manim_version,
+            quality,
+            "still" if still else "movie",
+        ]
+        if variant:
+            parts.append(variant)
+        material = "|".join(parts + [canonical_code(code)])
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def _meta_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def lookup(self, key):
+        """命中时返回元数据 (含产物路径 "path")，否则返回 None"""
+        if not self.enabled:
+            return None
+        if self.memory is not None:
+            entry = self.memory.get(key)
+            if entry is not None:
+                self.stats["hits"] += 1
+                if self.artifacts is not None and entry.get("sha256"):
+                    self._touched[entry["sha256"]] = time.time()
+                return dict(entry)
+        try:
+            with open(self._meta_path(key), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            self.stats["misses"] += 1
+            return None
+
+        if "artifact" in entry and self.artifacts is not None:
+            entry["path"] = os.path.join(self.artifacts.root, entry["artifact"])
+        else:
+            entry["path"] = os.path.join(self.cache_dir, entry.get("file", ""))
+        if not self._validate(entry):
+            # 产物已被删除 / 被替换：丢掉这个条目，调用方照常重新渲染
+            self.stats["stale"] += 1
+            self.stats["misses"] += 1
+            self.invalidate(key)
+            return None
+        self.stats["hits"] += 1
+        if self.artifacts is not None:
+            self.artifacts.touch(entry["path"])
+        if self.memory is not None:
+            self.memory.put(key, entry)
+        return dict(entry)
+
+    def drain_touched(self):
+        """取出并清空内存层命中的访问记录 {digest: 时间戳} (交给 ArtifactStore.touch_many)"""
+        touched, self._touched = self._touched, {}
+        return touched
+
+    def _validate(self, entry):
+        """产物存在，且大小 / 内容 sha256 与登记时一致 (产物被删除、替换或被原地改写都算失效)"""
+        try:
+            stat_result = os.stat(entry["path"])
+        except OSError:
+            return False
+        if "size" in entry and stat_result.st_size != entry["size"]:
+            return False
+        if "sha256" in entry and self._digest(entry["path"], stat_result) != entry["sha256"]:
+            return False
+        return True
+
+    def _digest(self, path, stat_result):
+        """带缓存的 file_digest：文件大小与 mtime 不变就复用上次的结果 (不信任文件名)"""
+        with self._digest_lock:
+            known = self._digests.get(path)
+            if known and known[:2] == (stat_result.st_size, stat_result.st_mtime_ns):
+                self._digests.move_to_end(path)
+                return known[2]
+        try:
+            sha256, _ = file_digest(path)
+        except OSError:
+            return None
+        with self._digest_lock:
+            self._digests[path] = (stat_result.st_size, stat_result.st_mtime_ns, sha256)
+            while len(self._digests) > self.max_digests:
+                self._digests.popitem(last=False)
+        return sha256
+
+    def invalidate(self, key):
+        """删除一个条目 (元数据与引用；仓库里的产物由回收任务处理)"""
+        if self.memory is not None:
+            self.memory.invalidate(key)
+        try:
+            os.remove(self._meta_path(key))
+        except OSError:
+            pass
+        if self.artifacts is not None:
+            self.artifacts.release(f"cache:{key}")
+
+    def store(self, key, artifact_path, kind="video", **meta):
+        """把产物登记进缓存 (优先硬链接，失败则复制)，返回缓存内的产物路径"""
+        if not self.enabled or not os.path.isfile(artifact_path):
+            return None
+        in_store = self.artifacts is not None and self.artifacts.contains(artifact_path)
+        if in_store:
+            cached_path = os.path.realpath(artifact_path)
+            entry = {
+                "artifact": os.path.relpath(cached_path, self.artifacts.root),
+                "sha256": self.artifacts.parse(cached_path)[0],
+                "size": os.path.getsize(cached_path),
+                "kind": kind, **meta
+            }
+        else:
+            ext = os.path.splitext(artifact_path)[1]
+            cached_path = os.path.join(self.cache_dir, f"{key}{ext}")
+            entry = {"file": os.path.basename(cached_path), "kind": kind, **meta}
+        try:
+            if in_store:
+                # 同一个键重新渲染出不同的产物时，先放下旧引用
+                self.artifacts.release(f"cache:{key}")
+                self.artifacts.add_ref(cached_path, f"cache:{key}")
+            else:
+                _link_or_copy(artifact_path, cached_path)
+            # 元数据最后落盘：只要 json 存在，产物就一定完整
+            tmp_meta = f"{self._meta_path(key)}.{os.getpid()}.tmp"
+            with open(tmp_meta, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_meta, self._meta_path(key))
+        except Exception as e:
+            print(f"⚠️ 渲染缓存写入失败: {e}")
+            return None
+        if self.memory is not None:
+            self.memory.invalidate(key)
+        self.stats["stores"] += 1
+        return cached_path
+
+    def publish(self, entry, target_dir, name):
+        """把缓存产物发布到对外目录 (如 static/)，返回相对 target_dir 的路径
+
+        产物本身已在 target_dir 之内 (仓库位于 static/ 下) 时直接返回其相对路径。
+        """
+        # 仓库根目录已经是 realpath，仓库产物不必再解析链接 (内存命中时不碰文件系统)
+        path = entry["path"] if "artifact" in entry else os.path.realpath(entry["path"])
+        target_root = self._real_dirs.get(target_dir)
+        if target_root is None:
+            target_root = self._real_dirs[target_dir] = os.path.realpath(target_dir)
+        if os.path.commonpath([path, target_root]) == target_root:
+            return os.path.relpath(path, target_root).replace(os.sep, "/")
+        ext = os.path.splitext(entry["path"])[1]
+        target_name = f"{name}{ext}"
+        target_path = os.path.join(target_dir, target_name)
+        if not os.path.isfile(target_path):
+            _link_or_copy(entry["path"], target_path)
+        return target_name
+
+    def clear(self):
+        if self.memory is not None:
+            self.memory.clear()
+        if self.artifacts is not None:
+            self.artifacts.release_prefix("cache:")
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+
+def _link_or_copy(src, dst):
+    """原子地把 src 放到 dst：同一文件系统上用硬链接，否则复制"""
+    tmp = f"{dst}.{os.getpid()}.tmp"
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
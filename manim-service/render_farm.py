@@ -0,0 +1,340 @@
+# render_farm.py
+"""
+渲染集群调度 (协调端)
+把渲染任务分发到多个渲染节点 (render_node.py)，单机并发不够时横向扩展：
+  - 节点通过心跳 (POST /farm/heartbeat) 或被动轮询 (GET /node/status) 上报容量与负载
+  - 按任务成本 (动画数 × 画质) 与节点积压估算完成时间，选择最快的节点
+  - 节点失联 / 出错时换节点重试，全部失败则回退本机渲染
+本机本身也作为一个节点参与路由 (槽位 = 本地工作进程数)。
+"""
+
+import os
+import sys
+import hmac
+import json
+import time
+import asyncio
+
+import httpx
+
+from render_manager import RenderResult, kill_process_tree, process_group_kwargs
+
+NODE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "render_node.py")
+
+# 相对成本：480p15 记为 1，像素数 × 帧率粗略折算
+QUALITY_COST = {
+    "-ql": 1,
+    "-qm": 3,
+    "-qh": 8,
+    "-qp": 14,
+    "-qk": 32,
+}
+LOCAL_NODE_ID = "local"
+
+
+def estimate_cost(job):
+    """估算一次渲染的相对成本"""
+    cost = max(1, job.expected_animations) * QUALITY_COST.get(job.quality, 1)
+    # -s 只渲染最后一帧 (单帧 scrub 同理)
+    return 1 if job.still or job.scrub else cost
+
+
+def token_matches(token, presented):
+    """集群令牌比较 (常数时间)；未配置令牌时一律不通过"""
+    return bool(token) and hmac.compare_digest(token, presented or "")
+
+
+class NodeFailedError(Exception):
+    """节点无响应或返回异常 (与渲染本身失败不同，可以换节点重试)"""
+
+
+class RenderNodeState:
+    """协调端视角下的一个渲染节点"""
+
+    def __init__(self, node_id, url=None, slots=1):
+        self.node_id = node_id
+        self.url = url            # None 表示本机
+        self.slots = max(1, slots)
+        self.active = 0           # 节点上报的运行中任务数
+        self.queued = 0           # 节点上报的排队任务数
+        self.inflight_cost = 0    # 本协调端已派发、尚未完成的成本
+        self.last_seen = None
+        self.failures = 0
+        self.completed = 0
+        self.process = None       # 本机拉起的节点进程
+
+    @property
+    def is_local(self):
+        return self.url is None
+
+    def alive(self, ttl):
+        if self.is_local:
+            return True
+        return self.last_seen is not None and time.monotonic() - self.last_seen < ttl
+
+    def update(self, report):
+        self.slots = max(1, int(report.get("slots", self.slots)))
+        self.active = int(report.get("active", 0))
+        self.queued = int(report.get("queued", 0))
+        self.last_seen = time.monotonic()
+        self.failures = 0
+
+    def mark_failed(self):
+        self.failures += 1
+        self.last_seen = None  # 直到下一次心跳 / 轮询成功前不再派发
+
+    def eta(self, cost):
+        """预计完成时间 (相对值)：已有积压 + 本任务，均摊到节点槽位"""
+        backlog = self.inflight_cost + self.queued
+        return (backlog + cost) / self.slots
+
+    def snapshot(self, ttl):
+        return {
+            "node_id": self.node_id,
+            "url": self.url,
+            "alive": self.alive(ttl),
+            "slots": self.slots,
+            "active": self.active,
+            "queued": self.queued,
+            "inflight_cost": self.inflight_cost,
+            "failures": self.failures,
+            "completed": self.completed,
+        }
+
+
+class RenderFarm:
+    """渲染集群协调器"""
+
+    def __init__(self, local_slots, node_urls=(), token="", node_ttl=15, poll_interval=5,
+                 max_attempts=3, local_nodes=0, local_node_slots=2, local_port_base=8101,
+                 coordinator_url=None, on_capacity=None):
+        # 节点会执行收到的任意 Python 代码，心跳也能注册任意地址：没有共享令牌就不启动集群
+        if not token:
+            raise ValueError("启用渲染集群必须配置 RENDER_FARM_TOKEN")
+        self.token = token
+        self.node_ttl = node_ttl
+        self.poll_interval = poll_interval
+        self.max_attempts = max(1, max_attempts)
+        self.local_nodes = local_nodes
+        self.local_node_slots = local_node_slots
+        self.local_port_base = local_port_base
+        self.coordinator_url = coordinator_url
+        self.on_capacity = on_capacity  # 总槽位变化时回调 (同步函数)
+
+        self.nodes = {LOCAL_NODE_ID: RenderNodeState(LOCAL_NODE_ID, None, local_slots)}
+        for url in node_urls:
+            self._ensure_node(url.rstrip("/"), url.rstrip("/"))
+
+        self._client = None
+        self._poll_task = None
+        self._capacity = None
+        self.stats = {"remote_jobs": 0, "local_jobs": 0, "retries": 0}
+
+    # ---------- 生命周期 ----------
+    async def start(self):
+        self._client = httpx.AsyncClient(headers=self._headers())
+        for i in range(self.local_nodes):
+            await self._spawn_local_node(self.local_port_base + i)
+        self._poll_task = asyncio.create_task(self._poll_loop())
+
+    async def close(self):
+        if self._poll_task:
+            self._poll_task.cancel()
+        for node in self.nodes.values():
+            if node.process and node.process.returncode is None:
+                kill_process_tree(node.process.pid)
+                await node.process.wait()
+        if self._client:
+            await self._client.aclose()
+
+    async def _spawn_local_node(self, port):
+        """在本机拉起一个独立的渲染节点进程 (用于本地测试 / 单机多进程)"""
+        url = f"http://127.0.0.1:{port}"
+        cmd = [sys.executable, NODE_SCRIPT, "--port", str(port), "--slots", str(self.local_node_slots)]
+        if self.coordinator_url:
+            cmd += ["--coordinator", self.coordinator_url, "--advertise-url", url]
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd, cwd=os.path.dirname(NODE_SCRIPT), **process_group_kwargs()
+            )
+        except Exception as e:
+            print(f"⚠️ [集群] 本机节点启动失败 (端口 {port}): {e}")
+            return
+        node = self._ensure_node(url, url)
+        node.slots = self.local_node_slots
+        node.process = proc
+        print(f"🌐 [集群] 已拉起本机节点 {url} PID: {proc.pid}")
+
+    def _headers(self):
+        return {"X-Render-Token": self.token}
+
+    def _ensure_node(self, node_id, url):
+        node = self.nodes.get(node_id)
+        if node is None:
+            node = self.nodes[node_id] = RenderNodeState(node_id, url)
+        return node
+
+    # ---------- 心跳与容量 ----------
+    def heartbeat(self, report):
+        """处理节点主动上报的心跳"""
+        url = (report.get("url") or "").rstrip("/")
+        if not url:
+            raise ValueError("心跳缺少节点地址 url")
+        # 以地址作为节点标识，与静态配置 / 本机拉起的节点对齐
+        node = self._ensure_node(url, url)
+        is_new = node.last_seen is None
+        node.update(report)
+        if is_new:
+            print(f"🌐 [集群] 节点上线: {report.get('node_id', url)} ({url}, {node.slots} 槽位)")
+        self._refresh_capacity()
+
+    async def _poll_loop(self):
+        """轮询许久没有心跳的节点 (静态配置的节点不一定会主动上报)"""
+        while True:
+            now = time.monotonic()
+            stale = [
+                n for n in self.nodes.values()
+                if not n.is_local and (n.last_seen is None or now - n.last_seen >= self.poll_interval)
+            ]
+            await asyncio.gather(*(self._poll(n) for n in stale))
+            self._refresh_capacity()
+            await asyncio.sleep(self.poll_interval)
+
+    async def _poll(self, node):
+        try:
+            response = await self._client.get(f"{node.url}/node/status", timeout=3)
+            response.raise_for_status()
+            node.update(response.json())
+        except (httpx.HTTPError, ValueError):
+            if node.last_seen is not None and not node.alive(self.node_ttl):
+                print(f"⚠️ [集群] 节点失联: {node.node_id}")
+                node.last_seen = None
+
+    def live_nodes(self):
+        return [n for n in self.nodes.values() if n.alive(self.node_ttl)]
+
+    @property
+    def capacity(self):
+        return sum(n.slots for n in self.live_nodes())
+
+    def _refresh_capacity(self):
+        capacity = self.capacity
+        if capacity != self._capacity:
+            self._capacity = capacity
+            if self.on_capacity:
+                self.on_capacity(capacity)
+
+    # ---------- 路由与执行 ----------
+    def pick(self, cost, exclude=()):
+        """选出预计最早完成的存活节点"""
+        candidates = [n for n in self.live_nodes() if n.node_id not in exclude]
+        if not candidates:
+            return None
+        # 同等预计时间时优先本机 (省去传输)
+        return min(candidates, key=lambda n: (n.eta(cost), not n.is_local))
+
+    async def run(self, job, timeout, run_local, on_progress=None):
+        """执行一次渲染任务，返回 RenderResult
+
+        run_local: 无参协程函数，在本机渲染该任务
+        远程节点出错时换节点重试；所有远程节点都不可用时回退本机。
+        """
+        cost = estimate_cost(job)
+        tried = set()
+        for attempt in range(self.max_attempts):
+            node = self.pick(cost, tried)
+            if node is None:
+                break
+            tried.add(node.node_id)
+            node.inflight_cost += cost
+            try:
+                if node.is_local:
+                    self.stats["local_jobs"] += 1
+                    return await run_local()
+                result = await self._run_remote(node, job, timeout, on_progress)
+                node.completed += 1
+                self.stats["remote_jobs"] += 1
+                return result
+            except NodeFailedError as e:
+                node.mark_failed()
+                self.stats["retries"] += 1
+                self._refresh_capacity()
+                print(f"⚠️ [集群] 节点 {node.node_id} 渲染失败，换节点重试 ({attempt + 1}/{self.max_attempts}): {e}")
+            finally:
+                node.inflight_cost -= cost
+
+        self.stats["local_jobs"] += 1
+        return await run_local()
+
+    async def _run_remote(self, node, job, timeout, on_progress):
+        """把任务发给远程节点：NDJSON 流式返回进度与结果，产物另行下载"""
+        with open(job.scene_file, "r", encoding="utf-8") as f:
+            code = f.read()
+        payload = {
+            "code": code,
+            "module": job.module_name,
+            "scene_class": job.scene_class,
+            "output_name": job.output_name,
+            "quality": job.quality,
+            "still": job.still,
+            "expected_animations": job.expected_animations,
+            "animation_range": job.animation_range,
+            "scrub": job.scrub,
+            "timeout": timeout,
+        }
+        # 节点渲染期间会定期发送 ping，超过 node_ttl 没有任何输出视为失联
+        stream_timeout = httpx.Timeout(10, read=self.node_ttl)
+        try:
+            async with self._client.stream(
+                "POST", f"{node.url}/node/jobs", json=payload, timeout=stream_timeout
+            ) as response:
+                if response.status_code != 200:
+                    raise NodeFailedError(f"HTTP {response.status_code}")
+                reply = None
+                async for line in response.aiter_lines():
+                    if not line.strip():
+                        continue
+                    message = json.loads(line)
+                    if message.get("type") == "progress" and on_progress:
+                        try:
+                            await on_progress(message["animation"], message["of"], message["pct"])
+                        except Exception as e:
+                            print(f"⚠️ 进度推送失败: {e}")
+                    elif message.get("type") == "result":
+                        reply = message
+                        break
+            if reply is None:
+                raise NodeFailedError("节点未返回结果即断开")
+
+            result = RenderResult(
+                reply.get("returncode", -1), reply.get("stdout", ""), reply.get("stderr", ""),
+                timed_out=reply.get("timed_out", False), error_kind=reply.get("error_kind")
+            )
+            if reply.get("artifact"):
+                target = job.image_path if reply.get("kind") == "image" else job.video_path
+                await self._download(node, reply["artifact"], target)
+            if reply.get("objects_dump") is not None:
+                # 侦探报告：写回本地场景文件旁边，与本机渲染的位置一致
+                with open(job.dump_path, "w", encoding="utf-8") as f:
+                    f.write(reply["objects_dump"])
+            return result
+        except (httpx.HTTPError, json.JSONDecodeError, OSError) as e:
+            raise NodeFailedError(repr(e))
+
+    async def _download(self, node, name, target):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = f"{target}.part"
+        async with self._client.stream("GET", f"{node.url}/node/artifacts/{name}", timeout=30) as response:
+            if response.status_code != 200:
+                raise NodeFailedError(f"产物下载失败 HTTP {response.status_code}")
+            with open(tmp, "wb") as f:
+                async for chunk in response.aiter_bytes():
+                    f.write(chunk)
+        os.replace(tmp, target)
+
+    def snapshot(self):
+        return {
+            "capacity": self.capacity,
+            "nodes": [n.snapshot(self.node_ttl) for n in self.nodes.values()],
+            **self.stats
+        }
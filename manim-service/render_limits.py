@@ -0,0 +1,190 @@
+# render_limits.py
+"""
+单次渲染的资源限制
+LLM 生成的场景可能带着超大分辨率的 Surface 或死循环，在 MANIM_TIMEOUT 到来之前吃光整机内存 / CPU。
+  - rlimit：地址空间、CPU 时间、单个输出文件大小，作用于渲染进程及其派生的 latex / ffmpeg
+  - cgroup v2 (可选)：每个优先级通道一个子 cgroup，按通道设置 cpu.weight 与 memory.high，
+    批量任务再忙也抢不走交互请求的 CPU
+超限会被识别为 "resource_limit" 错误，交给修复流程按资源问题处理。
+"""
+
+import os
+import sys
+import signal
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# RenderResult.error_kind 的取值
+ERROR_RESOURCE_LIMIT = "resource_limit"
+
+# 内存不足时 Python / numpy / cairo 的典型报错
+_MEMORY_ERROR_MARKERS = ("MemoryError", "Cannot allocate memory", "std::bad_alloc", "Unable to allocate")
+# SIGXFSZ 被 Python 忽略，写文件改为抛出 EFBIG
+_FILE_SIZE_MARKERS = ("File too large",)
+
+MB = 1024 * 1024
+
+
+class ResourceLimits:
+    """一次渲染的 rlimit 配置；0 表示不限制"""
+
+    def __init__(self, address_space_mb=0, cpu_seconds=0, file_size_mb=0):
+        self.address_space_mb = address_space_mb
+        self.cpu_seconds = cpu_seconds
+        self.file_size_mb = file_size_mb
+
+    @property
+    def enabled(self):
+        return resource is not None and any((self.address_space_mb, self.cpu_seconds, self.file_size_mb))
+
+    def apply(self):
+        """在当前进程内设置软限制 (全新的渲染子进程，在 preexec 中调用)"""
+        if resource is None:
+            return
+        if self.address_space_mb:
+            _set_soft(resource.RLIMIT_AS, self.address_space_mb * MB)
+        if self.cpu_seconds:
+            _set_soft(resource.RLIMIT_CPU, self.cpu_seconds)
+        if self.file_size_mb:
+            _set_soft(resource.RLIMIT_FSIZE, self.file_size_mb * MB)
+
+    def apply_for_job(self):
+        """常驻工作进程在每个任务开始前调用，返回用于 restore() 的旧值
+
+        CPU 时间按本任务新增计算；地址空间不能低于预热后已占用的部分，否则跳过。
+        """
+        if resource is None:
+            return []
+        saved = []
+        if self.address_space_mb:
+            limit = self.address_space_mb * MB
+            if _current_vm_bytes() < limit:
+                saved.append(_set_soft(resource.RLIMIT_AS, limit))
+            else:
+                print(f"⚠️ 工作进程已占用的地址空间超过 {self.address_space_mb}MB，本任务不限制地址空间",
+                      file=sys.stderr)
+        if self.cpu_seconds:
+            used = resource.getrusage(resource.RUSAGE_SELF)
+            spent = int(used.ru_utime + used.ru_stime) + 1
+            saved.append(_set_soft(resource.RLIMIT_CPU, spent + self.cpu_seconds))
+        if self.file_size_mb:
+            saved.append(_set_soft(resource.RLIMIT_FSIZE, self.file_size_mb * MB))
+        return saved
+
+    @staticmethod
+    def restore(saved):
+        for kind, soft in saved:
+            try:
+                resource.setrlimit(kind, (soft, resource.getrlimit(kind)[1]))
+            except (ValueError, OSError):
+                pass
+
+    def violation(self, returncode, stderr):
+        """判断一次失败是否由资源限制导致，是则返回说明文字，否则返回 None"""
+        if returncode == -getattr(signal, "SIGXCPU", -1):
+            return f"CPU 时间超过 {self.cpu_seconds} 秒"
+        if returncode == -getattr(signal, "SIGXFSZ", -1) or any(m in stderr for m in _FILE_SIZE_MARKERS):
+            return f"输出文件超过 {self.file_size_mb}MB"
+        if any(m in stderr for m in _MEMORY_ERROR_MARKERS):
+            return f"内存超过 {self.address_space_mb}MB" if self.address_space_mb else "内存不足"
+        if returncode == -getattr(signal, "SIGKILL", -1):
+            # 调用方自己杀进程 (超时 / 取消) 时不会走到这里，剩下的基本是 OOM killer / cgroup
+            return "内存不足，被系统终止"
+        return None
+
+
+def _set_soft(kind, value):
+    """设置软限制 (不超过硬限制)，返回 (kind, 旧的软限制)"""
+    soft, hard = resource.getrlimit(kind)
+    if hard != resource.RLIM_INFINITY:
+        value = min(value, hard)
+    try:
+        resource.setrlimit(kind, (value, hard))
+    except (ValueError, OSError) as e:
+        print(f"⚠️ 设置资源限制失败: {e}", file=sys.stderr)
+    return kind, soft
+
+
+def _current_vm_bytes():
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return 0
+
+
+class CgroupLanes:
+    """按优先级通道划分的 cgroup v2 子组
+
+    root 必须是一个已委派给本服务、且自身没有进程的 cgroup 目录 (cgroup v2 不允许中间节点挂进程)。
+    """
+
+    def __init__(self, root, cpu_weights=None, memory_high_mb=None):
+        self.root = root
+        self.cpu_weights = cpu_weights or {}
+        self.memory_high_mb = memory_high_mb or {}
+        self.enabled = False
+
+    def setup(self, lanes):
+        if not self.root or sys.platform != "linux":
+            return False
+        try:
+            controllers = []
+            if self.cpu_weights:
+                controllers.append("+cpu")
+            if self.memory_high_mb:
+                controllers.append("+memory")
+            if controllers:
+                _write(os.path.join(self.root, "cgroup.subtree_control"), " ".join(controllers))
+            for lane in lanes:
+                path = os.path.join(self.root, lane)
+                os.makedirs(path, exist_ok=True)
+                if lane in self.cpu_weights:
+                    _write(os.path.join(path, "cpu.weight"), str(self.cpu_weights[lane]))
+                if lane in self.memory_high_mb:
+                    _write(os.path.join(path, "memory.high"), str(self.memory_high_mb[lane] * MB))
+        except OSError as e:
+            print(f"⚠️ cgroup 通道未启用 ({self.root}): {e}")
+            return False
+        self.enabled = True
+        print(f"🧱 cgroup 通道已启用: {self.root} (cpu.weight {self.cpu_weights}, memory.high {self.memory_high_mb})")
+        return True
+
+    def procs_file(self, lane):
+        if not self.enabled or not lane:
+            return None
+        return os.path.join(self.root, lane, "cgroup.procs")
+
+    def attach(self, pid, lane):
+        """把进程 (及其之后派生的子进程) 移入通道对应的 cgroup"""
+        procs_file = self.procs_file(lane)
+        if not procs_file:
+            return
+        try:
+            _write(procs_file, str(pid))
+        except OSError as e:
+            print(f"⚠️ 加入 cgroup 失败 ({lane}): {e}")
+
+
+def _write(path, value):
+    with open(path, "w") as f:
+        f.write(value)
+
+
+def make_preexec(limits=None, cgroup_procs_file=None):
+    """独立渲染子进程的 preexec_fn：fork 之后、exec 之前设置 rlimit 并加入 cgroup"""
+    if sys.platform == "win32" or not ((limits and limits.enabled) or cgroup_procs_file):
+        return None
+
+    def preexec():
+        if cgroup_procs_file:
+            try:
+                _write(cgroup_procs_file, "0")  # 0 表示写入者自身
+            except OSError:
+                pass
+        if limits:
+            limits.apply()
+    return preexec
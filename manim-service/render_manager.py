@@ -0,0 +1,444 @@
+# render_manager.py
+"""
+Manim 渲染进程管理器 (asyncio 原生)
+基于 asyncio.create_subprocess_exec + 非阻塞管道读取，单个事件循环即可监管大量并发渲染，
+不再为每个渲染占用一个默认线程池线程。输出文件按 manim 的目录约定直接定位，不做目录遍历。
+"""
+
+import os
+import re
+import sys
+import time
+import codecs
+import signal
+import asyncio
+import subprocess
+
+from section_render import concat_videos, merge_sections
+from render_limits import ERROR_RESOURCE_LIMIT, make_preexec
+
+# manim 质量参数 -> 视频子目录 ({pixel_height}p{frame_rate})
+QUALITY_DIRS = {
+    "-ql": "480p15",
+    "-qm": "720p30",
+    "-qh": "1080p60",
+    "-qp": "1440p60",
+    "-qk": "2160p60",
+}
+
+# 只保留输出末尾，报错信息都在最后
+MAX_CAPTURE_BYTES = 256 * 1024
+READ_CHUNK_SIZE = 64 * 1024
+
+# manim 的 tqdm 进度条，例如 "Animation 3: Create(Circle):  45%|████▌     | 7/15 [...]"
+PROGRESS_PATTERN = re.compile(r"Animation\s+(\d+)\s*:.*?(\d{1,3})%\|")
+
+
+def parse_progress_line(line):
+    """解析一行 manim 进度输出，返回 (animation_index, pct)；不是进度行时返回 None"""
+    match = PROGRESS_PATTERN.search(line)
+    if not match:
+        return None
+    return int(match.group(1)), min(int(match.group(2)), 100)
+
+
+class ProgressTracker:
+    """从渲染输出流中提取逐动画进度，并按时间间隔节流后回调
+
+    callback(animation, total, pct): animation 为从 1 开始的动画序号，
+    pct 为整体进度百分比 (按已完成动画数 + 当前动画进度估算)。
+    """
+
+    def __init__(self, callback, expected_total=0, min_interval=0.5):
+        self.callback = callback
+        self.expected_total = expected_total
+        self.min_interval = min_interval
+        self._pending = ""
+        self._last_emit = 0.0
+        self._last_state = None
+
+    async def feed(self, text):
+        """输入一段原始输出 (tqdm 用 \r 刷新同一行，因此按 \r / \n 切分)"""
+        parts = re.split(r"[\r\n]", self._pending + text)
+        self._pending = parts.pop()
+        latest = None
+        for line in parts:
+            parsed = parse_progress_line(line)
+            if parsed:
+                latest = parsed
+        if latest:
+            await self._maybe_emit(*latest)
+
+    async def _maybe_emit(self, index, animation_pct):
+        now = time.monotonic()
+        if now - self._last_emit < self.min_interval:
+            return
+        # 静态估计的动画数可能偏少 (循环里的 play)，以实际出现的序号为准
+        total = max(self.expected_total, index + 1)
+        overall = int((index + animation_pct / 100) / total * 100)
+        state = (index, overall)
+        if state == self._last_state:
+            return
+        self._last_emit = now
+        self._last_state = state
+        try:
+            await self.callback(index + 1, total, overall)
+        except Exception as e:
+            print(f"⚠️ 进度推送失败: {e}")
+
+
+class WorkerUnavailableError(Exception):
+    """进程池无法提供可用的工作进程 (例如 manim 未安装)"""
+
+
+def kill_process_tree(pid):
+    """终止进程及其整个进程组 (manim 会派生 latex / ffmpeg 子进程)"""
+    try:
+        if sys.platform == "win32":
+            subprocess.run(["taskkill", "/F", "/T", "/PID", str(pid)], capture_output=True)
+        else:
+            os.killpg(os.getpgid(pid), signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+    except Exception as e:
+        print(f"⚠️ 终止进程失败: {e}")
+
+
+def process_group_kwargs():
+    """新建进程组，保证能连同子进程一起终止"""
+    if sys.platform == "win32":
+        # Windows下需要 creationflags 才能被 taskkill /T 杀干净
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {"start_new_session": True}
+
+
+# 侦探子类写出的对象报告，放在场景文件旁边 (远程节点上的路径与协调端不同)
+OBJECTS_DUMP_NAME = "objects_dump.json"
+
+
+class RenderJob:
+    """一次 Manim 渲染任务：场景文件、类名与输出位置"""
+
+    def __init__(self, scene_file, scene_class, media_dir, output_name, quality="-ql", still=False,
+                 expected_animations=0, sections=None, section_class=None):
+        self.scene_file = scene_file
+        self.scene_class = scene_class
+        self.media_dir = media_dir
+        self.output_name = output_name
+        self.quality = quality
+        self.still = still  # True: 只渲染最后一帧 (-s)，输出 png
+        self.expected_animations = expected_animations  # 静态估计的动画数，用于进度展示
+        self.animation_range = None  # (start, end): 只渲染这一段动画 (-n start,end)
+        self.scrub = None  # {"time": t} / {"animation": k}: 只输出这一帧 (见 frame_scrub.py)
+        self.lane = None   # 调度通道 (决定加入哪个 cgroup，见 render_limits.CgroupLanes)
+        # 分段并行渲染：[(start, end), ...]，见 section_render.plan_sections
+        self.sections = sections
+        # 非最后一段使用的类 (例如侦探子类只需要在最后一段运行)
+        self.section_class = section_class
+
+    @property
+    def module_name(self):
+        return os.path.splitext(os.path.basename(self.scene_file))[0]
+
+    def args(self):
+        """manim CLI 参数 (不含 `python -m manim`)"""
+        args = [self.quality]
+        if self.still or self.scrub:
+            # -s: save_last_frame (只渲染最后一帧，不做视频)
+            args += ["-s", "--format=png"]
+        if self.animation_range:
+            args += ["-n", "{},{}".format(*self.animation_range)]
+        return args + [
+            "--media_dir", self.media_dir,
+            "-o", self.output_name,
+            self.scene_file,
+            self.scene_class
+        ]
+
+    @property
+    def dump_path(self):
+        return os.path.join(os.path.dirname(self.scene_file), OBJECTS_DUMP_NAME)
+
+    @property
+    def video_path(self):
+        quality_dir = QUALITY_DIRS.get(self.quality, QUALITY_DIRS["-ql"])
+        return os.path.join(self.media_dir, "videos", self.module_name, quality_dir, f"{self.output_name}.mp4")
+
+    @property
+    def image_path(self):
+        # 静态场景 (没有任何动画) 时 manim 也会退化为输出这张图片
+        return os.path.join(self.media_dir, "images", self.module_name, f"{self.output_name}.png")
+
+    def section_jobs(self, sections=None):
+        """按 sections (默认 self.sections) 拆成子任务，各用独立的 media 目录 (避免 partial_movie_file_list.txt 冲突)"""
+        sections = self.sections if sections is None else sections
+        jobs = []
+        for i, (start, end) in enumerate(sections or []):
+            is_last = i == len(sections) - 1
+            job = RenderJob(
+                self.scene_file,
+                self.scene_class if is_last else (self.section_class or self.scene_class),
+                os.path.join(self.media_dir, f"section_{i}"),
+                f"{self.output_name}_part{i}",
+                quality=self.quality,
+                expected_animations=end + 1
+            )
+            job.animation_range = (start, end)
+            job.lane = self.lane
+            jobs.append(job)
+        return jobs
+
+    def resolve_output(self):
+        """按 manim 的目录约定定位输出文件，返回 (path, kind)；kind 为 "video" / "image"，找不到时为 (None, None)"""
+        if not (self.still or self.scrub) and os.path.isfile(self.video_path):
+            return self.video_path, "video"
+        if os.path.isfile(self.image_path):
+            return self.image_path, "image"
+        return None, None
+
+
+class RenderResult:
+    """渲染结果"""
+
+    def __init__(self, returncode, stdout="", stderr="", timed_out=False, error_kind=None):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.timed_out = timed_out
+        self.error_kind = error_kind  # 失败原因分类，例如 render_limits.ERROR_RESOURCE_LIMIT
+        self.output_path = None
+        self.output_kind = None
+
+    @property
+    def ok(self):
+        return self.returncode == 0 and self.output_path is not None
+
+    @classmethod
+    def failure(cls, message, timed_out=False, error_kind=None):
+        return cls(-1, "", message, timed_out=timed_out, error_kind=error_kind)
+
+
+async def _read_stream(stream, sink, tracker=None):
+    """非阻塞读取管道，只保留末尾 MAX_CAPTURE_BYTES；可选地边读边解析进度"""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    while True:
+        chunk = await stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        if tracker:
+            await tracker.feed(decoder.decode(chunk))
+        sink.extend(chunk)
+        if len(sink) > MAX_CAPTURE_BYTES:
+            del sink[:len(sink) - MAX_CAPTURE_BYTES]
+
+
+class RenderProcessManager:
+    """Manim 渲染进程管理器 (并发与排队由 RenderScheduler 负责)"""
+
+    def __init__(self, pool=None, cwd=None, progress_interval=0.5, partial_cache=None, farm=None,
+                 tex_cache_dir=None, limits=None, cgroups=None, scheduler=None):
+        self.pool = pool  # 可选的常驻工作进程池 (render_pool.RenderWorkerPool)
+        self.farm = farm  # 可选的渲染集群 (render_farm.RenderFarm)，由它决定本机还是远程渲染
+        self.cwd = cwd
+        self.progress_interval = progress_interval
+        self.partial_cache = partial_cache  # 可选的共享分段缓存 (partial_cache.PartialMovieCache)
+        self.tex_cache_dir = tex_cache_dir  # 可选的共享 Tex / Text 缓存目录
+        self.limits = limits    # 可选的单次渲染资源限制 (render_limits.ResourceLimits)
+        self.cgroups = cgroups  # 可选的按通道 cgroup (render_limits.CgroupLanes)
+        # 分段并行渲染的额外进程向调度器借槽位；没有调度器时不做并行分段 (无从得知空闲的并发)
+        self.scheduler = scheduler
+        self._active_processes = {}  # { pid: asyncio.subprocess.Process }
+
+    @property
+    def active_count(self):
+        return len(self._active_processes)
+
+    async def run(self, job, timeout, on_progress=None):
+        """执行一次渲染任务并定位输出文件
+
+        配置了渲染集群时由集群按负载选择节点；本机渲染优先交给常驻工作进程，
+        进程池不可用时回退为独立的 `python -m manim` 子进程。
+        on_progress: 可选的 async 回调 (animation, total, pct)，渲染过程中节流推送
+        """
+        result = None
+        if job.sections and not (job.still or job.scrub):
+            result = await self._run_sections(job, timeout, on_progress)
+        if result is None:
+            result = await self._run_single(job, timeout, on_progress)
+
+        if result.returncode == 0:
+            result.output_path, result.output_kind = job.resolve_output()
+        elif self.limits is not None and not result.timed_out and result.error_kind is None:
+            violation = self.limits.violation(result.returncode, result.stderr)
+            if violation:
+                result.error_kind = ERROR_RESOURCE_LIMIT
+                result.stderr += f"\n⛔ 资源超限: {violation}"
+                print(f"⛔ 渲染超出资源限制: {violation}")
+        if self.partial_cache is not None:
+            # 扫描目录有磁盘 IO，放到线程里做，且有节流
+            await asyncio.to_thread(self.partial_cache.maybe_evict)
+        return result
+
+    async def _run_single(self, job, timeout, on_progress=None):
+        if self.farm is not None:
+            return await self.farm.run(
+                job, timeout, lambda: self._run_local(job, timeout, on_progress), on_progress
+            )
+        return await self._run_local(job, timeout, on_progress)
+
+    async def _run_sections(self, job, timeout, on_progress=None):
+        """分段并行渲染后无重编码拼接到 job.video_path
+
+        本任务占着一个槽位，其余各段向调度器借空闲槽位；借不够时合并相邻分段，一个也借不到就整段渲染。
+        任一段渲染失败时返回该段的结果；拼接环节出问题时返回 None，由调用方整段重渲。
+        """
+        if self.scheduler is None:
+            return None
+        borrowed = self.scheduler.borrow(len(job.sections) - 1)
+        try:
+            plan = merge_sections(job.sections, borrowed + 1)
+            if plan is None:
+                return None
+            return await self._render_sections(job, plan, timeout, on_progress)
+        finally:
+            self.scheduler.give_back(borrowed)
+
+    async def _render_sections(self, job, plan, timeout, on_progress=None):
+        sections = job.section_jobs(plan)
+        lengths = [end - start + 1 for start, end in plan]
+        total_animations = sum(lengths)
+        fractions = [0.0] * len(sections)
+        print(f"🧩 分段并行渲染: {len(sections)} 段 {plan}")
+
+        def section_progress(i):
+            start, end = plan[i]
+
+            async def notify(animation, total, pct):
+                # 子任务的 pct 按 0..end 计算 (前面快进的动画也算在内)，换算回本段的完成比例
+                done = pct / 100 * total - start
+                fractions[i] = min(max(done / lengths[i], 0.0), 1.0)
+                finished = sum(f * n for f, n in zip(fractions, lengths))
+                current = min(int(finished) + 1, total_animations)
+                await on_progress(current, total_animations, int(finished / total_animations * 100))
+            return notify if on_progress else None
+
+        tasks = [
+            asyncio.ensure_future(self._run_single(section, timeout, section_progress(i)))
+            for i, section in enumerate(sections)
+        ]
+        try:
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    # 任一段失败 (代码错误 / 超时) 就不必等其它段了
+                    if task.result().returncode != 0:
+                        return task.result()
+            results = [task.result() for task in tasks]
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        paths = [section.video_path for section in sections]
+        if not all(os.path.isfile(p) for p in paths):
+            print("⚠️ 分段渲染缺少输出，改为整段渲染")
+            return None
+        ok, error = await concat_videos(paths, job.video_path)
+        if not ok:
+            print(f"⚠️ 分段拼接失败，改为整段渲染: {error[-200:]}")
+            return None
+        return RenderResult(
+            0,
+            "\n".join(r.stdout for r in results),
+            "\n".join(r.stderr for r in results)
+        )
+
+    async def _run_local(self, job, timeout, on_progress=None):
+        """本机渲染：常驻工作进程优先，不可用时回退为独立子进程"""
+        tracker = None
+        if on_progress:
+            tracker = ProgressTracker(on_progress, job.expected_animations, self.progress_interval)
+
+        if self.pool is not None and self.pool.available:
+            try:
+                return await self.pool.run(job.args(), timeout, tracker, scrub=job.scrub, lane=job.lane)
+            except WorkerUnavailableError as e:
+                print(f"⚠️ 渲染进程池不可用，回退为独立进程: {e}")
+        preexec = make_preexec(self.limits, self.cgroups.procs_file(job.lane) if self.cgroups else None)
+        return await self.run_command(self._standalone_command(job), timeout, tracker, preexec)
+
+    def _standalone_command(self, job):
+        """独立子进程的命令行：启用共享缓存时经由 render_worker 的单次模式挂上缓存"""
+        from render_pool import WORKER_SCRIPT, worker_cli_args
+        worker_args = worker_cli_args(
+            self.partial_cache.root if self.partial_cache is not None else None,
+            self.tex_cache_dir
+        )
+        if job.scrub:
+            # 单帧渲染需要 render_worker 在进程内挂钩 Scene
+            key = "time" if "time" in job.scrub else "animation"
+            worker_args += [f"--scrub-{key}", str(job.scrub[key])]
+        if not worker_args:
+            return [sys.executable, "-m", "manim", *job.args()]
+        return [sys.executable, WORKER_SCRIPT, *worker_args, "--oneshot", "--", *job.args()]
+
+    async def run_command(self, cmd, timeout, tracker=None, preexec_fn=None):
+        """运行命令：异步读取输出，超时或被取消时终止整个进程组
+
+        preexec_fn: 可选，子进程 exec 之前执行 (设置资源限制 / 加入 cgroup)
+        """
+        extra = {"preexec_fn": preexec_fn} if preexec_fn else {}
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                cwd=self.cwd,
+                **process_group_kwargs(),
+                **extra
+            )
+        except Exception as e:
+            return RenderResult.failure(str(e))
+
+        # 登记造册
+        self._active_processes[proc.pid] = proc
+        stdout_buf, stderr_buf = bytearray(), bytearray()
+        readers = [
+            asyncio.create_task(_read_stream(proc.stdout, stdout_buf)),
+            asyncio.create_task(_read_stream(proc.stderr, stderr_buf, tracker)),
+        ]
+
+        timed_out = False
+        try:
+            await asyncio.wait_for(proc.wait(), timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+            kill_process_tree(proc.pid)  # 超时也得杀
+            await proc.wait()
+        except asyncio.CancelledError:
+            kill_process_tree(proc.pid)
+            for reader in readers:
+                reader.cancel()
+            raise
+        finally:
+            # 运行完后，主动从名单里移除（防止字典无限膨胀）
+            self._active_processes.pop(proc.pid, None)
+
+        # 进程已退出，管道很快就会关闭；留一点余量防止孙进程占着管道
+        await asyncio.wait(readers, timeout=5)
+        for reader in readers:
+            reader.cancel()
+
+        stdout = stdout_buf.decode("utf-8", errors="ignore")
+        stderr = stderr_buf.decode("utf-8", errors="ignore")
+        if timed_out:
+            return RenderResult(-1, stdout, stderr[-2000:] + "\n渲染超时 (Timeout)", timed_out=True)
+        return RenderResult(proc.returncode, stdout, stderr)
+
+    async def shutdown(self):
+        """终止所有仍在运行的渲染进程"""
+        for proc in list(self._active_processes.values()):
+            kill_process_tree(proc.pid)
+        self._active_processes.clear()
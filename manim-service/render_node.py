@@ -0,0 +1,313 @@
+# render_node.py
+"""
+渲染集群节点
+独立运行的 FastAPI 服务，接收协调端 (render_farm.RenderFarm) 派发的渲染任务：
+  GET  /node/status            容量与负载
+  POST /node/jobs              执行渲染，NDJSON 流式返回 ping / progress / result
+  GET  /node/artifacts/{name}  下载产物 (下载后即删除)
+启动时指定 --coordinator 会定期向协调端发送心跳。
+节点会执行收到的任意 Python 代码：默认只监听 127.0.0.1，监听其它地址时必须配置 RENDER_FARM_TOKEN。
+
+用法:
+    python render_node.py --port 8101 --slots 2 --coordinator http://127.0.0.1:8001
+    RENDER_FARM_TOKEN=... python render_node.py --host 0.0.0.0 --advertise-url http://10.0.0.5:8101
+"""
+
+import os
+import json
+import time
+import uuid
+import shutil
+import asyncio
+import argparse
+import ipaddress
+import contextlib
+
+import httpx
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import StreamingResponse, FileResponse
+from typing import Dict, List, Optional
+from pydantic import BaseModel
+from starlette.background import BackgroundTask
+
+import service_config as config
+from render_pool import RenderWorkerPool
+from render_manager import RenderProcessManager, RenderJob
+from partial_cache import PartialMovieCache
+from render_limits import ResourceLimits
+from render_farm import token_matches
+
+# 渲染期间的保活间隔 (须小于协调端的 RENDER_FARM_NODE_TTL)
+PING_INTERVAL = 5
+# 未被取走的产物保留时长 (秒)
+ARTIFACT_TTL = 600
+
+
+class NodeJobRequest(BaseModel):
+    code: str
+    module: str = "current_scene"
+    scene_class: str
+    output_name: str
+    quality: str = config.DEFAULT_QUALITY
+    still: bool = False
+    expected_animations: int = 0
+    animation_range: Optional[List[int]] = None  # 分段渲染时只渲染 [start, end]
+    scrub: Optional[Dict[str, float]] = None  # 单帧渲染 {"time": t} / {"animation": k}
+    timeout: float = config.MANIM_TIMEOUT
+
+
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class RenderNodeService:
+    """节点本地状态：槽位、进程池与临时目录"""
+
+    def __init__(self, node_id, slots, advertise_url, coordinator_url=None, token=""):
+        self.node_id = node_id
+        self.slots = max(1, slots)
+        self.advertise_url = advertise_url
+        self.coordinator_url = coordinator_url
+        self.token = token
+        self.work_dir = os.path.join(config.TEMP_DIR, f"node_{node_id}")
+        self.artifact_dir = os.path.join(self.work_dir, "artifacts")
+
+        partial_cache = PartialMovieCache(
+            config.PARTIAL_CACHE_DIR, max_bytes=config.PARTIAL_CACHE_MAX_MB * 1024 * 1024
+        ) if config.PARTIAL_CACHE_ENABLED else None
+        limits = ResourceLimits(
+            config.RENDER_LIMIT_AS_MB, config.RENDER_LIMIT_CPU_SECONDS, config.RENDER_LIMIT_FSIZE_MB
+        )
+        self.pool = RenderWorkerPool(
+            size=self.slots,
+            max_jobs=config.RENDER_WORKER_MAX_JOBS,
+            max_rss_mb=config.RENDER_WORKER_MAX_RSS_MB,
+            start_timeout=config.RENDER_WORKER_START_TIMEOUT,
+            cwd=config.BASE_DIR,
+            partial_cache_dir=partial_cache.root if partial_cache else None,
+            tex_cache_dir=config.TEX_CACHE_DIR,
+            limits=limits
+        )
+        self.manager = RenderProcessManager(
+            pool=self.pool if config.RENDER_POOL_ENABLED else None,
+            cwd=config.BASE_DIR,
+            progress_interval=config.RENDER_PROGRESS_INTERVAL,
+            partial_cache=partial_cache,
+            tex_cache_dir=config.TEX_CACHE_DIR,
+            limits=limits
+        )
+        self._slots = asyncio.Semaphore(self.slots)
+        self.active = 0
+        self.queued = 0
+        self.completed = 0
+        self._heartbeat_task = None
+
+    def report(self):
+        return {
+            "node_id": self.node_id,
+            "url": self.advertise_url,
+            "slots": self.slots,
+            "active": self.active,
+            "queued": self.queued,
+            "completed": self.completed,
+            "pool": self.pool.available,
+        }
+
+    async def start(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        os.makedirs(self.artifact_dir, exist_ok=True)
+        if config.RENDER_POOL_ENABLED:
+            await self.pool.start()
+        if self.coordinator_url:
+            self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+
+    async def close(self):
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+        await self.manager.shutdown()
+        await self.pool.close()
+
+    async def _heartbeat_loop(self):
+        headers = {"X-Render-Token": self.token} if self.token else {}
+        async with httpx.AsyncClient(headers=headers, timeout=3) as client:
+            reachable = None
+            while True:
+                try:
+                    response = await client.post(f"{self.coordinator_url}/farm/heartbeat", json=self.report())
+                    response.raise_for_status()
+                    ok, error = True, None
+                except httpx.HTTPError as e:
+                    ok, error = False, e
+                # 只在连通状态变化时打印，避免协调端重启期间刷屏
+                if ok != reachable:
+                    reachable = ok
+                    if ok:
+                        print(f"💓 [节点 {self.node_id}] 已连接协调端 {self.coordinator_url}")
+                    else:
+                        print(f"⚠️ [节点 {self.node_id}] 心跳发送失败: {error}")
+                await asyncio.sleep(config.RENDER_FARM_HEARTBEAT_INTERVAL)
+
+    def _sweep_artifacts(self):
+        """清理协调端一直没来取的产物"""
+        now = time.time()
+        for name in os.listdir(self.artifact_dir):
+            path = os.path.join(self.artifact_dir, name)
+            try:
+                if now - os.path.getmtime(path) > ARTIFACT_TTL:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    async def run_job(self, request):
+        """执行一次渲染，逐条产出 NDJSON 消息"""
+        job_id = uuid.uuid4().hex[:12]
+        job_dir = os.path.join(self.work_dir, f"job_{job_id}")
+        os.makedirs(job_dir, exist_ok=True)
+        scene_file = os.path.join(job_dir, f"{request.module}.py")
+        with open(scene_file, "w", encoding="utf-8") as f:
+            f.write(request.code)
+        job = RenderJob(
+            scene_file, request.scene_class, job_dir, request.output_name,
+            quality=request.quality, still=request.still,
+            expected_animations=request.expected_animations
+        )
+        if request.animation_range:
+            job.animation_range = tuple(request.animation_range)
+        if request.scrub:
+            key, value = next(iter(request.scrub.items()))
+            job.scrub = {key: int(value) if key == "animation" else value}
+
+        events = asyncio.Queue()
+
+        async def on_progress(animation, total, pct):
+            await events.put({"type": "progress", "animation": animation, "of": total, "pct": pct})
+
+        async def render():
+            self.queued += 1
+            try:
+                await self._slots.acquire()
+            finally:
+                self.queued -= 1
+            self.active += 1
+            try:
+                return await self.manager.run(job, request.timeout, on_progress)
+            finally:
+                self.active -= 1
+                self._slots.release()
+
+        task = asyncio.create_task(render())
+        try:
+            while not task.done():
+                try:
+                    yield await asyncio.wait_for(events.get(), PING_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield {"type": "ping"}
+                if task.done():
+                    break
+            while not events.empty():
+                yield events.get_nowait()
+
+            result = task.result()
+            artifact = None
+            objects_dump = None
+            # 侦探报告写在场景文件旁边，随结果一起带回协调端
+            if os.path.isfile(job.dump_path):
+                with open(job.dump_path, "r", encoding="utf-8") as f:
+                    objects_dump = f.read()
+            if result.ok:
+                ext = os.path.splitext(result.output_path)[1]
+                artifact = f"{job_id}{ext}"
+                shutil.move(result.output_path, os.path.join(self.artifact_dir, artifact))
+            self.completed += 1
+            yield {
+                "type": "result",
+                "returncode": result.returncode,
+                "stdout": result.stdout[-2000:],
+                "stderr": result.stderr[-2000:],
+                "timed_out": result.timed_out,
+                "error_kind": result.error_kind,
+                "artifact": artifact,
+                "kind": result.output_kind,
+                "objects_dump": objects_dump,
+            }
+        finally:
+            # 协调端断开 (被取代 / 换节点) 时取消渲染
+            if not task.done():
+                task.cancel()
+                with contextlib.suppress(BaseException):
+                    await task
+            shutil.rmtree(job_dir, ignore_errors=True)
+            self._sweep_artifacts()
+
+
+def create_app(service):
+    @contextlib.asynccontextmanager
+    async def lifespan(app: FastAPI):
+        await service.start()
+        print(f"🌐 [节点 {service.node_id}] 已就绪: {service.advertise_url} ({service.slots} 槽位)")
+        yield
+        await service.close()
+
+    app = FastAPI(lifespan=lifespan)
+
+    def check_token(request: Request):
+        # 没有令牌的节点只监听本机回环地址 (见 __main__)
+        if service.token and not token_matches(service.token, request.headers.get("X-Render-Token")):
+            raise HTTPException(status_code=403, detail="无效的集群令牌")
+
+    @app.get("/node/status")
+    async def node_status(request: Request):
+        check_token(request)
+        return service.report()
+
+    @app.post("/node/jobs")
+    async def node_job(job: NodeJobRequest, request: Request):
+        check_token(request)
+        # 积压过多时拒绝，让协调端换节点
+        if service.queued >= service.slots * 2:
+            raise HTTPException(status_code=503, detail="节点繁忙")
+
+        async def stream():
+            async for message in service.run_job(job):
+                yield json.dumps(message, ensure_ascii=False) + "\n"
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    @app.get("/node/artifacts/{name}")
+    async def node_artifact(name: str, request: Request):
+        check_token(request)
+        path = os.path.join(service.artifact_dir, os.path.basename(name))
+        if not os.path.isfile(path):
+            raise HTTPException(status_code=404, detail="产物不存在")
+        return FileResponse(path, background=BackgroundTask(os.remove, path))
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="ICeCream Manim 渲染节点")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址；非本机回环地址需要配置 RENDER_FARM_TOKEN")
+    parser.add_argument("--port", type=int, default=8101)
+    parser.add_argument("--slots", type=int, default=config.RENDER_WORKERS, help="并发渲染数")
+    parser.add_argument("--node-id", default=None)
+    parser.add_argument("--coordinator", default=None, help="协调端地址，用于发送心跳")
+    parser.add_argument("--advertise-url", default=None, help="协调端访问本节点的地址")
+    options = parser.parse_args()
+    if not config.RENDER_FARM_TOKEN and not is_loopback(options.host):
+        parser.error(f"监听 {options.host} 必须先配置 RENDER_FARM_TOKEN (节点会执行收到的任意代码)")
+
+    node_service = RenderNodeService(
+        node_id=options.node_id or f"node-{options.port}",
+        slots=options.slots,
+        advertise_url=options.advertise_url or f"http://127.0.0.1:{options.port}",
+        coordinator_url=options.coordinator,
+        token=config.RENDER_FARM_TOKEN
+    )
+    uvicorn.run(create_app(node_service), host=options.host, port=options.port, reload=False)
@@ -0,0 +1,231 @@
+# render_pool.py
+"""
+Manim 常驻渲染进程池
+预先启动若干个已导入 manim 的工作进程 (render_worker.py)，渲染任务通过管道下发，
+省去每次 `python -m manim` 的解释器启动、numpy/cairo 导入与字体初始化开销。
+工作进程在处理 N 个任务或内存超限后自动回收替换。
+"""
+
+import os
+import sys
+import json
+import asyncio
+import itertools
+
+from render_manager import RenderResult, WorkerUnavailableError, kill_process_tree, process_group_kwargs
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "render_worker.py")
+
+def worker_cli_args(partial_cache_dir=None, tex_cache_dir=None, limits=None):
+    """render_worker.py 的共享缓存与资源限制参数"""
+    args = []
+    if partial_cache_dir:
+        args += ["--partial-cache-dir", partial_cache_dir]
+    if tex_cache_dir:
+        args += ["--tex-cache-dir", tex_cache_dir]
+    if limits is not None and limits.enabled:
+        args += [
+            "--limit-as-mb", str(limits.address_space_mb),
+            "--limit-cpu-seconds", str(limits.cpu_seconds),
+            "--limit-fsize-mb", str(limits.file_size_mb),
+        ]
+    return args
+
+# 单行协议消息的读取上限 (工作进程已截断输出，这里留足余量)
+PROTOCOL_LINE_LIMIT = 16 * 1024 * 1024
+
+
+class _Worker:
+    """一个常驻工作进程"""
+
+    def __init__(self, proc):
+        self.proc = proc
+        self.jobs = 0
+        self.rss_mb = 0.0
+
+    @property
+    def alive(self):
+        return self.proc.returncode is None
+
+
+class RenderWorkerPool:
+    """常驻渲染工作进程池"""
+
+    def __init__(self, size, max_jobs, max_rss_mb, start_timeout=60, cwd=None, partial_cache_dir=None,
+                 tex_cache_dir=None, limits=None, cgroups=None):
+        self.size = max(1, size)
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self.start_timeout = start_timeout
+        self.cwd = cwd or os.path.dirname(WORKER_SCRIPT)
+        # 共享缓存目录 (分段视频见 partial_cache.py；Tex 见 render_worker.tex_cache_overrides)
+        # 资源限制由工作进程在每个任务开始前自行设置 (见 render_limits.py)
+        self.worker_args = worker_cli_args(partial_cache_dir, tex_cache_dir, limits)
+        self.cgroups = cgroups  # 可选：任务开始前把工作进程移入对应通道的 cgroup
+
+        self._idle = []
+        self._slots = asyncio.Semaphore(self.size)
+        self._job_ids = itertools.count(1)
+        self._warmup_tasks = set()
+        self._closed = False
+        self.available = True       # 首次启动失败后置为 False，调用方回退为独立子进程
+        self.stats = {"spawned": 0, "recycled": 0, "jobs": 0}
+
+    # ---------- 生命周期 ----------
+    async def start(self):
+        """预先拉起全部工作进程 (在后台完成预热，不阻塞服务启动)"""
+        for _ in range(self.size):
+            self._warm_one()
+
+    async def close(self):
+        self._closed = True
+        for task in list(self._warmup_tasks):
+            task.cancel()
+        for worker in self._idle:
+            await self._discard(worker)
+        self._idle.clear()
+
+    def _warm_one(self):
+        task = asyncio.create_task(self._warm())
+        self._warmup_tasks.add(task)
+        task.add_done_callback(self._warmup_tasks.discard)
+
+    async def _warm(self):
+        try:
+            worker = await self._spawn()
+        except WorkerUnavailableError as e:
+            print(f"⚠️ [进程池] 工作进程预热失败: {e}")
+            return
+        if self._closed or len(self._idle) >= self.size:
+            await self._discard(worker)
+        else:
+            self._idle.append(worker)
+
+    async def _spawn(self):
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                sys.executable, WORKER_SCRIPT, *self.worker_args,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                cwd=self.cwd,
+                limit=PROTOCOL_LINE_LIMIT,
+                **process_group_kwargs()
+            )
+        except Exception as e:
+            self.available = False
+            raise WorkerUnavailableError(str(e))
+
+        worker = _Worker(proc)
+        try:
+            line = await asyncio.wait_for(proc.stdout.readline(), self.start_timeout)
+            message = json.loads(line) if line else {"type": "fatal", "error": "工作进程启动即退出"}
+        except (asyncio.TimeoutError, json.JSONDecodeError) as e:
+            message = {"type": "fatal", "error": f"工作进程启动失败: {e!r}"}
+        except asyncio.CancelledError:
+            await self._discard(worker)
+            raise
+
+        if message.get("type") != "ready":
+            await self._discard(worker)
+            self.available = False
+            raise WorkerUnavailableError(message.get("error", "未知错误"))
+
+        worker.rss_mb = message.get("rss_mb", 0.0)
+        self.stats["spawned"] += 1
+        print(f"🏭 [进程池] 工作进程就绪 PID: {proc.pid}")
+        return worker
+
+    async def _discard(self, worker):
+        """关闭并回收一个工作进程"""
+        if worker.alive:
+            kill_process_tree(worker.proc.pid)
+        try:
+            await asyncio.wait_for(worker.proc.wait(), 5)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _acquire(self):
+        while self._idle:
+            worker = self._idle.pop()
+            if worker.alive:
+                return worker
+        return await self._spawn()
+
+    def _should_recycle(self, worker):
+        if self.max_jobs and worker.jobs >= self.max_jobs:
+            return True
+        if self.max_rss_mb and worker.rss_mb >= self.max_rss_mb:
+            return True
+        return False
+
+    # ---------- 任务执行 ----------
+    async def run(self, args, timeout, tracker=None, scrub=None, lane=None):
+        """在常驻工作进程中执行 manim CLI 参数，返回 RenderResult
+
+        tracker: 可选的 ProgressTracker，工作进程转发的进度行会实时交给它。
+        scrub: 可选的单帧描述，原样交给工作进程 (见 frame_scrub.py)。
+        lane: 调度通道，启用 cgroup 时决定工作进程本次归属的 cgroup。
+        任务被取消 (例如被同一用户的新请求取代) 时直接杀掉该工作进程并补充新进程。
+        """
+        if not self.available:
+            raise WorkerUnavailableError("进程池不可用")
+
+        async with self._slots:
+            worker = await self._acquire()
+            if self.cgroups is not None:
+                self.cgroups.attach(worker.proc.pid, lane)
+
+            job = {"id": next(self._job_ids), "args": list(args), "scrub": scrub}
+            deadline = asyncio.get_running_loop().time() + timeout
+            try:
+                worker.proc.stdin.write((json.dumps(job, ensure_ascii=False) + "\n").encode("utf-8"))
+                await worker.proc.stdin.drain()
+                while True:
+                    remaining = deadline - asyncio.get_running_loop().time()
+                    line = await asyncio.wait_for(worker.proc.stdout.readline(), max(remaining, 0))
+                    if not line:
+                        break
+                    reply = json.loads(line)
+                    if reply.get("type") == "output":
+                        if tracker:
+                            await tracker.feed(reply.get("line", "") + "\n")
+                        continue
+                    break
+            except asyncio.TimeoutError:
+                await self._retire(worker, recycle=True)
+                return RenderResult.failure("渲染超时 (Timeout)", timed_out=True)
+            except asyncio.CancelledError:
+                await self._retire(worker, recycle=True)
+                raise
+            except Exception as e:
+                await self._retire(worker, recycle=True)
+                return RenderResult.failure(str(e))
+
+            if not line:
+                # 保留退出码：SIGXCPU / SIGKILL 等说明是资源超限，由 RenderProcessManager 归类
+                try:
+                    returncode = await asyncio.wait_for(worker.proc.wait(), 5)
+                except asyncio.TimeoutError:
+                    returncode = None
+                await self._retire(worker, recycle=True)
+                return RenderResult(returncode or -1, "", f"渲染工作进程异常退出 (退出码 {returncode})")
+
+            worker.jobs += 1
+            worker.rss_mb = reply.get("rss_mb", 0.0)
+            self.stats["jobs"] += 1
+            # 任务中途内存分配失败的进程状态不可信，直接换掉
+            recycle = reply.get("recycle", False) or self._should_recycle(worker)
+            await self._retire(worker, recycle=recycle)
+            return RenderResult(reply.get("returncode", -1), reply.get("stdout", ""), reply.get("stderr", ""))
+
+    async def _retire(self, worker, recycle):
+        """任务结束：归还空闲队列，或回收并在后台补充一个新的预热进程"""
+        if not recycle and worker.alive:
+            self._idle.append(worker)
+            return
+
+        self.stats["recycled"] += 1
+        print(f"♻️ [进程池] 回收工作进程 PID: {worker.proc.pid} (任务数 {worker.jobs}, 内存 {worker.rss_mb:.0f}MB)")
+        await self._discard(worker)
+        if not self._closed:
+            self._warm_one()
@@ -0,0 +1,227 @@
+# render_scheduler.py
+"""
+渲染任务调度器
+有界等待队列 + 优先级通道 (预览 > 交互对话 > Gateway /render > 批量)，
+同一通道内按 client_id 轮询，课堂高峰时排队消化而不是直接拒绝。
+"""
+
+import asyncio
+import itertools
+from collections import OrderedDict, deque
+
+# ================= 🚦 优先级通道 (按优先级从高到低) =================
+LANE_PREVIEW = "preview"          # 静态预览，几秒内出结果
+LANE_INTERACTIVE = "interactive"  # WebSocket 对话 / 直接渲染
+LANE_GATEWAY = "gateway"          # Gateway POST /render
+LANE_BATCH = "batch"              # 后台批量任务
+LANES = (LANE_PREVIEW, LANE_INTERACTIVE, LANE_GATEWAY, LANE_BATCH)
+
+# 没有带身份标识的请求共用这个 client_id：无法区分用户，互相之间从不顶替
+ANONYMOUS_CLIENT = "anonymous"
+
+
+class QueueFullError(Exception):
+    """等待队列已满"""
+
+
+class JobSupersededError(Exception):
+    """任务被同一用户的新任务取代"""
+
+
+class _Job:
+    def __init__(self, job_id, lane, client_id, on_position):
+        self.id = job_id
+        self.lane = lane
+        self.client_id = client_id
+        self.on_position = on_position
+        self.ready = asyncio.get_running_loop().create_future()
+        self.task = None          # 运行阶段的执行任务
+        self.position = None      # 最近一次通知的排队位置
+        self.superseded = False
+
+
+class RenderScheduler:
+    """优先级 + 公平轮询的渲染调度器"""
+
+    def __init__(self, workers, max_queue):
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        # 每个通道: { client_id: deque[_Job] }，OrderedDict 的顺序即轮询顺序
+        self._lanes = {lane: OrderedDict() for lane in LANES}
+        self._running = set()
+        self._borrowed = 0  # 运行中的任务额外占用的槽位 (分段并行渲染)
+        self._ids = itertools.count(1)
+        self.stats = {"submitted": 0, "rejected": 0, "superseded": 0, "finished": 0}
+
+    # ---------- 对外接口 ----------
+    async def submit(self, runner, lane=LANE_INTERACTIVE, client_id=ANONYMOUS_CLIENT,
+                     on_position=None, supersede=False, on_start=None):
+        """排队执行 runner (无参协程函数)，返回其结果
+
+        on_position: 可选的 async 回调，排队位置变化时以 position (1 = 下一个) 调用
+        supersede: 为 True 时先取消同一 client_id 在该通道中排队或运行的旧任务 (匿名请求忽略)
+        on_start: 可选的同步回调，拿到槽位、即将开始执行时调用
+        """
+        if lane not in self._lanes:
+            raise ValueError(f"未知的渲染通道: {lane}")
+        if supersede and client_id != ANONYMOUS_CLIENT:
+            self.cancel_client(client_id, lane)
+
+        if self.queued_count() >= self.max_queue and self._busy() >= self.workers:
+            self.stats["rejected"] += 1
+            raise QueueFullError("服务器繁忙(Too Many Requests)，请稍后再试")
+
+        job = _Job(next(self._ids), lane, client_id, on_position)
+        self._lanes[lane].setdefault(client_id, deque()).append(job)
+        self.stats["submitted"] += 1
+        self._dispatch()
+
+        try:
+            await job.ready
+            if job.superseded:
+                raise JobSupersededError("已被同一用户的新请求取代")
+        except BaseException:
+            # 排队中被取消 / 刚拿到槽位就被取代：归还槽位
+            self._remove_queued(job)
+            if job in self._running:
+                self._running.discard(job)
+                self._dispatch()
+            else:
+                self._notify_positions()
+            raise
+
+        if on_start:
+            on_start()
+        job.task = asyncio.ensure_future(runner())
+        try:
+            return await job.task
+        except asyncio.CancelledError:
+            if job.superseded:
+                raise JobSupersededError("已被同一用户的新请求取代") from None
+            raise
+        finally:
+            self._running.discard(job)
+            self.stats["finished"] += 1
+            self._dispatch()
+
+    def cancel_client(self, client_id, lane=None):
+        """取消指定用户的排队/运行中任务，返回取消数量"""
+        cancelled = 0
+        for lane_name in ([lane] if lane else LANES):
+            queue = self._lanes[lane_name].pop(client_id, None)
+            for job in queue or ():
+                job.superseded = True
+                if not job.ready.done():
+                    job.ready.set_exception(JobSupersededError("已被同一用户的新请求取代"))
+                cancelled += 1
+        for job in list(self._running):
+            if job.client_id == client_id and (lane is None or job.lane == lane):
+                job.superseded = True
+                if job.task and not job.task.done():
+                    job.task.cancel()
+                cancelled += 1
+        if cancelled:
+            self.stats["superseded"] += cancelled
+            print(f"⚡ [调度] 用户 {client_id} 发起新请求，取消其 {cancelled} 个旧任务")
+            self._notify_positions()
+        return cancelled
+
+    def borrow(self, count):
+        """运行中的任务再借用最多 count 个空闲槽位，返回实际借到的个数
+
+        有任务在排队时不借 (空闲槽位应先给它们)；借到的槽位要用 give_back 归还。
+        """
+        if count <= 0 or self.queued_count():
+            return 0
+        granted = min(count, max(self.workers - self._busy(), 0))
+        self._borrowed += granted
+        return granted
+
+    def give_back(self, count):
+        if count > 0:
+            self._borrowed = max(self._borrowed - count, 0)
+            self._dispatch()
+
+    def set_workers(self, workers):
+        """调整并发槽位数 (渲染集群节点上下线时调用)"""
+        workers = max(1, workers)
+        if workers != self.workers:
+            print(f"🚦 [调度] 并发槽位 {self.workers} -> {workers}")
+            self.workers = workers
+            self._dispatch()
+
+    def queued_count(self):
+        return sum(len(q) for lane in self._lanes.values() for q in lane.values())
+
+    def snapshot(self):
+        """调度器状态 (用于调试接口)"""
+        return {
+            "workers": self.workers,
+            "running": len(self._running),
+            "borrowed": self._borrowed,
+            "queued": {lane: sum(len(q) for q in self._lanes[lane].values()) for lane in LANES},
+            "max_queue": self.max_queue,
+            **self.stats
+        }
+
+    # ---------- 内部调度 ----------
+    def _busy(self):
+        return len(self._running) + self._borrowed
+
+    def _dispatch(self):
+        """有空闲槽位时，按通道优先级 + 用户轮询取出下一个任务"""
+        while self._busy() < self.workers:
+            job = self._pop_next()
+            if job is None:
+                break
+            self._running.add(job)
+            job.position = 0
+            job.ready.set_result(True)
+        self._notify_positions()
+
+    def _pop_next(self):
+        for lane in LANES:
+            clients = self._lanes[lane]
+            while clients:
+                client_id, queue = next(iter(clients.items()))
+                job = queue.popleft()
+                if queue:
+                    clients.move_to_end(client_id)
+                else:
+                    del clients[client_id]
+                if not job.ready.done():
+                    return job
+        return None
+
+    def _remove_queued(self, job):
+        queue = self._lanes[job.lane].get(job.client_id)
+        if queue and job in queue:
+            queue.remove(job)
+            if not queue:
+                del self._lanes[job.lane][job.client_id]
+
+    def _waiting_order(self):
+        """模拟调度顺序：通道优先级，其次各用户轮流"""
+        order = []
+        for lane in LANES:
+            queues = list(self._lanes[lane].values())
+            depth = 0
+            while True:
+                row = [q[depth] for q in queues if len(q) > depth]
+                if not row:
+                    break
+                order.extend(row)
+                depth += 1
+        return order
+
+    def _notify_positions(self):
+        for position, job in enumerate(self._waiting_order(), start=1):
+            if job.on_position and job.position != position:
+                job.position = position
+                task = asyncio.ensure_future(job.on_position(position))
+                task.add_done_callback(_swallow_callback_error)
+
+
+def _swallow_callback_error(task):
+    if not task.cancelled() and task.exception():
+        print(f"⚠️ [调度] 排队通知失败: {task.exception()}")
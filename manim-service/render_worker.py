@@ -0,0 +1,244 @@
+# render_worker.py
+"""
+常驻 Manim 渲染工作进程
+启动时预先导入 manim (numpy / cairo / 字体)，之后通过 stdin 按行接收 JSON 任务，
+渲染结果经由独立的协议通道按行写回。由 render_pool.RenderWorkerPool 统一管理。
+
+用法:
+    python render_worker.py [选项]                    常驻模式
+    python render_worker.py [选项] --oneshot -- ARGS  单次渲染 (等价于 python -m manim ARGS)
+
+选项:
+    --partial-cache-dir DIR  共享分段视频缓存
+    --tex-cache-dir DIR      共享 Tex / Text 缓存 (默认在每个请求的 media 目录下，无法复用)
+    --limit-as-mb N          (常驻模式) 每个任务的地址空间上限
+    --limit-cpu-seconds N    (常驻模式) 每个任务的 CPU 时间上限
+    --limit-fsize-mb N       (常驻模式) 单个输出文件的大小上限
+    --scrub-time T           (单次模式) 只输出场景第 T 秒的画面，配合 -s 使用
+    --scrub-animation K      (单次模式) 只输出第 K 个动画结束时的画面，配合 -s 使用
+"""
+
+import os
+import re
+import sys
+import io
+import json
+import time
+import argparse
+import contextlib
+import traceback
+
+from render_limits import ResourceLimits
+
+# 回传给主进程的输出只保留末尾部分，避免单行协议消息过大
+MAX_OUTPUT_CHARS = 64 * 1024
+# 进度行转发的最小间隔 (tqdm 刷新远比这频繁，主进程还会再节流一次)
+PROGRESS_FORWARD_INTERVAL = 0.2
+
+
+def current_rss_mb():
+    """读取当前进程常驻内存 (MB)，用于主进程判断是否需要回收"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 单位为 KB，macOS 为字节
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        return 0.0
+
+
+class ProgressForwardingStream(io.StringIO):
+    """捕获 stderr，同时把 tqdm 进度条行实时转发给主进程"""
+
+    def __init__(self, forward):
+        super().__init__()
+        self._forward = forward
+        self._pending = ""
+        self._last_forward = 0.0
+
+    def write(self, text):
+        parts = re.split(r"[\r\n]", self._pending + text)
+        self._pending = parts.pop()
+        progress_lines = [line for line in parts if "%|" in line]
+        now = time.monotonic()
+        if progress_lines and now - self._last_forward >= PROGRESS_FORWARD_INTERVAL:
+            self._last_forward = now
+            self._forward(progress_lines[-1])
+        return super().write(text)
+
+
+def tex_cache_overrides(tex_cache_dir):
+    """把 manim 的 tex_dir / text_dir 指向共享目录 (草稿与高清补渲、不同请求之间都能复用)"""
+    if not tex_cache_dir:
+        return {}
+    return {
+        "tex_dir": os.path.join(tex_cache_dir, "Tex"),
+        "text_dir": os.path.join(tex_cache_dir, "texts"),
+    }
+
+
+def run_manim_job(args, forward_progress=None, config_overrides=None, scrub=None):
+    """在当前进程内执行一次 manim CLI 调用，返回 (returncode, stdout, stderr)
+
+    scrub: 可选的单帧描述 {"time": t} / {"animation": k}，见 frame_scrub.py
+    """
+    from manim import tempconfig
+    from manim.__main__ import main as manim_main
+    from frame_scrub import scrub_context
+
+    # manim 会把场景文件所在目录插入 sys.path 并登记模块，任务结束后要还原
+    saved_path = list(sys.path)
+    saved_modules = set(sys.modules)
+    scene_dirs = [os.path.dirname(os.path.abspath(a)) for a in args if a.endswith(".py")]
+
+    out = io.StringIO()
+    err = ProgressForwardingStream(forward_progress) if forward_progress else io.StringIO()
+    returncode = 0
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+        try:
+            # tempconfig 保证每个任务的 CLI 参数不会残留到下一个任务
+            with tempconfig(config_overrides or {}), scrub_context(scrub):
+                result = manim_main.main(args=args, prog_name="manim", standalone_mode=False)
+            if isinstance(result, int):
+                returncode = result
+        except SystemExit as e:
+            returncode = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except BaseException:
+            traceback.print_exc()
+            returncode = 1
+
+    sys.path[:] = saved_path
+    for name in set(sys.modules) - saved_modules:
+        module_file = getattr(sys.modules.get(name), "__file__", None) or ""
+        if any(module_file.startswith(d) for d in scene_dirs):
+            del sys.modules[name]
+
+    return returncode, out.getvalue()[-MAX_OUTPUT_CHARS:], err.getvalue()[-MAX_OUTPUT_CHARS:]
+
+
+def enable_partial_cache(cache_dir):
+    """挂上跨请求共享的分段视频缓存"""
+    if not cache_dir:
+        return
+    try:
+        from partial_cache import PartialMovieCache, install_manim_hooks
+        install_manim_hooks(PartialMovieCache(cache_dir))
+    except Exception as e:
+        # manim 版本不兼容时只是少了缓存，照常渲染
+        print(f"⚠️ 分段缓存未启用: {e}", file=sys.stderr)
+
+
+def enable_segment_manifest():
+    """记录逐个完成的分段，供主进程做渐进式 HLS 输出 (见 progressive.py)"""
+    try:
+        from progressive import install_segment_manifest
+        install_segment_manifest()
+    except Exception as e:
+        print(f"⚠️ 渐进式输出未启用: {e}", file=sys.stderr)
+
+
+def oneshot(args, partial_cache_dir=None, tex_cache_dir=None, scrub=None):
+    """单次渲染：进程池不可用时由主进程以独立子进程的方式调用，输出直接走 stdout / stderr"""
+    from manim import config
+    from manim.__main__ import main as manim_main
+    from frame_scrub import scrub_context
+
+    enable_partial_cache(partial_cache_dir)
+    enable_segment_manifest()
+    for key, value in tex_cache_overrides(tex_cache_dir).items():
+        config[key] = value
+    try:
+        with scrub_context(scrub):
+            result = manim_main.main(args=args, prog_name="manim", standalone_mode=False)
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    return result if isinstance(result, int) else 0
+
+
+def serve(partial_cache_dir=None, tex_cache_dir=None, limits=None):
+    """工作进程主循环
+
+    limits: 可选的 render_limits.ResourceLimits，每个任务开始前设置、结束后恢复
+    """
+    # 协议通道使用原 stdout 的副本；之后的杂散输出（包括 latex 等子进程）一律改走 stderr
+    channel = os.fdopen(os.dup(sys.stdout.fileno()), "w", encoding="utf-8", buffering=1)
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    def reply(message):
+        channel.write(json.dumps(message, ensure_ascii=False) + "\n")
+        channel.flush()
+
+    try:
+        import manim  # noqa: F401  预热：这正是常驻进程要省掉的启动开销
+    except Exception as e:
+        reply({"type": "fatal", "error": f"manim 导入失败: {e}"})
+        return 1
+    enable_partial_cache(partial_cache_dir)
+    enable_segment_manifest()
+
+    reply({"type": "ready", "pid": os.getpid(), "rss_mb": current_rss_mb()})
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            job = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+
+        job_id = job.get("id")
+        saved_limits = limits.apply_for_job() if limits else []
+        try:
+            returncode, stdout, stderr = run_manim_job(
+                job.get("args", []),
+                forward_progress=lambda line: reply({"type": "output", "id": job_id, "line": line}),
+                config_overrides=tex_cache_overrides(tex_cache_dir),
+                scrub=job.get("scrub")
+            )
+        finally:
+            ResourceLimits.restore(saved_limits)
+        reply({
+            "type": "result",
+            "id": job_id,
+            "returncode": returncode,
+            "stdout": stdout,
+            "stderr": stderr,
+            "rss_mb": current_rss_mb(),
+            "recycle": bool(returncode and limits and limits.violation(returncode, stderr))
+        })
+    return 0
+
+
+def parse_cli(argv):
+    """拆分本脚本参数与 `--` 之后透传给 manim 的参数"""
+    manim_args = []
+    if "--" in argv:
+        split = argv.index("--")
+        argv, manim_args = argv[:split], argv[split + 1:]
+    parser = argparse.ArgumentParser(description="Manim 渲染工作进程")
+    parser.add_argument("--partial-cache-dir", default=None, help="共享分段视频缓存目录")
+    parser.add_argument("--tex-cache-dir", default=None, help="共享 Tex / Text 缓存目录")
+    parser.add_argument("--oneshot", action="store_true", help="只执行一次渲染后退出")
+    parser.add_argument("--limit-as-mb", type=int, default=0, help="每个任务的地址空间上限 (MB)")
+    parser.add_argument("--limit-cpu-seconds", type=int, default=0, help="每个任务的 CPU 时间上限 (秒)")
+    parser.add_argument("--limit-fsize-mb", type=int, default=0, help="单个输出文件的大小上限 (MB)")
+    parser.add_argument("--scrub-time", type=float, default=None, help="只输出第 T 秒的画面")
+    parser.add_argument("--scrub-animation", type=int, default=None, help="只输出第 K 个动画结束时的画面")
+    return parser.parse_args(argv), manim_args
+
+
+if __name__ == "__main__":
+    options, manim_args = parse_cli(sys.argv[1:])
+    if options.oneshot:
+        from frame_scrub import parse_scrub
+        scrub = parse_scrub(options.scrub_time, options.scrub_animation)
+        sys.exit(oneshot(manim_args, options.partial_cache_dir, options.tex_cache_dir, scrub))
+    limits = ResourceLimits(options.limit_as_mb, options.limit_cpu_seconds, options.limit_fsize_mb)
+    sys.exit(serve(options.partial_cache_dir, options.tex_cache_dir, limits if limits.enabled else None))
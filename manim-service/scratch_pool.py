@@ -0,0 +1,59 @@
+# scratch_pool.py
+"""
+可复用的临时工作目录池
+高频的小任务 (例如静态预览) 不再每次 mkdir + rmtree 一个新目录，
+而是从池中借出一个已存在的目录，用完清空文件后归还。
+"""
+
+import os
+import shutil
+import itertools
+import contextlib
+
+
+class ScratchPool:
+    """临时工作目录池：lease() 借出目录，退出时清空文件并归还"""
+
+    def __init__(self, root, max_idle=8):
+        self.root = root
+        self.max_idle = max_idle
+        self._idle = []
+        self._names = itertools.count(1)
+        self.stats = {"created": 0, "reused": 0}
+
+    @contextlib.contextmanager
+    def lease(self):
+        path = self._acquire()
+        try:
+            yield path
+        finally:
+            self._release(path)
+
+    def _acquire(self):
+        while self._idle:
+            path = self._idle.pop()
+            # 目录可能在系统重置时被整体删掉
+            if os.path.isdir(path):
+                self.stats["reused"] += 1
+                return path
+        path = os.path.join(self.root, f"scratch_{os.getpid()}_{next(self._names)}")
+        os.makedirs(path, exist_ok=True)
+        self.stats["created"] += 1
+        return path
+
+    def _release(self, path):
+        if len(self._idle) >= self.max_idle or not _empty_files(path):
+            shutil.rmtree(path, ignore_errors=True)
+            return
+        self._idle.append(path)
+
+
+def _empty_files(path):
+    """删除目录下的所有文件，保留目录结构 (下次 manim 不必再建)；失败时返回 False"""
+    try:
+        for dirpath, _, filenames in os.walk(path):
+            for name in filenames:
+                os.remove(os.path.join(dirpath, name))
+    except OSError:
+        return False
+    return True
@@ -0,0 +1,146 @@
+# section_render.py
+"""
+单个场景的分段并行渲染
+长场景的 self.play 逐个串行渲染，只能吃满一个核。这里静态分析 construct()，
+按动画序号 (或作者写的 next_section 边界) 把场景切成若干段，各段用 manim 的
+`-n start,end` 在独立进程中渲染 (之前的动画以 skip_animations 快进，只计算状态不出画面)，
+最后用 ffmpeg concat demuxer 无重编码拼接。
+"""
+
+import os
+import ast
+import asyncio
+
+# 计入 num_plays 的 Scene 方法
+PLAY_METHODS = ("play", "wait", "pause", "wait_until")
+
+
+def _is_self_call(node, names):
+    return (
+        isinstance(node, ast.Call)
+        and isinstance(node.func, ast.Attribute)
+        and node.func.attr in names
+        and isinstance(node.func.value, ast.Name)
+        and node.func.value.id == "self"
+    )
+
+
+def count_scene_animations(code, scene_class):
+    """静态统计 construct() 中的动画数与 next_section 边界
+
+    只有动画调用全部是 construct() 里的顶层语句时才可靠 (循环 / 条件 / 辅助方法里的
+    play 无法静态计数)，否则返回 None。
+    返回 (动画数, [next_section 出现时已有的动画数, ...])
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+
+    scene = next(
+        (n for n in tree.body if isinstance(n, ast.ClassDef) and n.name == scene_class), None
+    )
+    if scene is None:
+        return None
+
+    construct = None
+    for item in scene.body:
+        if not isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        if item.name == "construct":
+            construct = item
+        elif any(_is_self_call(n, PLAY_METHODS) for n in ast.walk(item)):
+            # 辅助方法里也有动画
+            return None
+    if construct is None:
+        return None
+
+    count = 0
+    boundaries = []
+    for stmt in construct.body:
+        if isinstance(stmt, ast.Expr) and _is_self_call(stmt.value, PLAY_METHODS):
+            count += 1
+            continue
+        if isinstance(stmt, ast.Expr) and _is_self_call(stmt.value, ("next_section",)):
+            boundaries.append(count)
+            continue
+        if any(_is_self_call(n, PLAY_METHODS + ("next_section",)) for n in ast.walk(stmt)):
+            return None
+    return count, boundaries
+
+
+def plan_sections(code, scene_class, max_parts, min_animations=3):
+    """规划分段，返回 [(start, end), ...] (闭区间，对应 `-n start,end`)；不值得分段时返回 None"""
+    if max_parts < 2:
+        return None
+    info = count_scene_animations(code, scene_class)
+    if info is None:
+        return None
+    count, boundaries = info
+    # 每段至少 min_animations 个动画 (也避开 manim 把 `-n 0,0` 的 0 当作未设置的问题)
+    min_animations = max(2, min_animations)
+    parts = min(max_parts, count // min_animations)
+    if parts < 2:
+        return None
+
+    # 作者写了 next_section 就只在这些边界切，否则任意动画之间都可以切
+    candidates = sorted(set(b for b in boundaries if 0 < b < count)) if boundaries else range(1, count)
+    cuts = []
+    previous = 0
+    for k in range(1, parts):
+        ideal = count * k / parts
+        options = [c for c in candidates if c - previous >= min_animations and count - c >= min_animations]
+        if not options:
+            break
+        cut = min(options, key=lambda c: abs(c - ideal))
+        cuts.append(cut)
+        previous = cut
+
+    if not cuts:
+        return None
+    starts = [0] + cuts
+    ends = cuts + [count]
+    return [(start, end - 1) for start, end in zip(starts, ends)]
+
+
+def merge_sections(sections, parts):
+    """并发槽位不够时把相邻的分段合并成 parts 段 (按段数均分)；parts < 2 时返回 None (整段渲染)"""
+    if parts < 2 or not sections:
+        return None
+    if len(sections) <= parts:
+        return list(sections)
+    bounds = [round(len(sections) * k / parts) for k in range(parts + 1)]
+    return [(sections[a][0], sections[b - 1][1]) for a, b in zip(bounds, bounds[1:])]
+
+
+async def concat_videos(paths, output_path):
+    """用 ffmpeg concat demuxer 无重编码拼接视频，返回 (ok, 错误信息)"""
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    list_file = f"{output_path}.concat.txt"
+    with open(list_file, "w", encoding="utf-8") as f:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "concat", "-safe", "0", "-i", list_file,
+            "-c", "copy", "-movflags", "+faststart",
+            output_path,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            _, stderr = await proc.communicate()
+        except asyncio.CancelledError:
+            proc.kill()
+            raise
+    except Exception as e:
+        return False, str(e)
+    finally:
+        try:
+            os.remove(list_file)
+        except OSError:
+            pass
+    return proc.returncode == 0 and os.path.isfile(output_path), stderr.decode("utf-8", errors="ignore")
@@ -69,6 +69,133 @@ MAX_RETRIES = 2
 MAX_HISTORY_ENTRIES = 15
 REQUEST_TIMEOUT = 120.0
 MANIM_TIMEOUT = 300
+SCRUB_TIMEOUT = 20  # 单帧 (scrub) 渲染超时
+
+# ================= 🏭 渲染进程池 =================
+# 常驻工作进程预先导入 manim，省去每次渲染的解释器启动与导入开销
+RENDER_POOL_ENABLED = os.environ.get("RENDER_POOL_ENABLED", "true").lower() == "true"
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", "4"))                    # 工作进程数
+RENDER_WORKER_MAX_JOBS = int(os.environ.get("RENDER_WORKER_MAX_JOBS", "50"))   # 处理多少个任务后回收
+RENDER_WORKER_MAX_RSS_MB = int(os.environ.get("RENDER_WORKER_MAX_RSS_MB", "1500"))  # 内存超过多少 MB 后回收
+RENDER_WORKER_START_TIMEOUT = 60
+RENDER_QUEUE_MAX = int(os.environ.get("RENDER_QUEUE_MAX", "64"))               # 等待队列上限，超出才拒绝
+RENDER_PROGRESS_INTERVAL = float(os.environ.get("RENDER_PROGRESS_INTERVAL", "0.5"))  # 渲染进度推送最小间隔 (秒)
+
+# ================= 💾 渲染缓存 =================
+# 按规范化代码指纹复用已渲染的视频 (放在 temp_gen 之外，启动清理不会误删)
+RENDER_CACHE_ENABLED = os.environ.get("RENDER_CACHE_ENABLED", "true").lower() == "true"
+RENDER_CACHE_DIR = os.environ.get("RENDER_CACHE_DIR", os.path.join(BASE_DIR, "render_cache"))
+
+# 跨请求共享的 manim 分段视频缓存：未改动的动画 / 修复重试 / 超时续渲都不必重画
+PARTIAL_CACHE_ENABLED = os.environ.get("PARTIAL_CACHE_ENABLED", "true").lower() == "true"
+PARTIAL_CACHE_DIR = os.environ.get("PARTIAL_CACHE_DIR", os.path.join(BASE_DIR, "partial_cache"))
+PARTIAL_CACHE_MAX_MB = int(os.environ.get("PARTIAL_CACHE_MAX_MB", "2048"))     # 超出后按 LRU 淘汰
+
+# Tex / Text 渲染结果缓存 (manim 默认放在每个请求的 media 目录下，请求结束即删除)
+TEX_CACHE_DIR = os.environ.get("TEX_CACHE_DIR", os.path.join(BASE_DIR, "tex_cache"))
+
+# ================= 🪜 画质阶梯 =================
+# 先以 DEFAULT_QUALITY 交付草稿，再在批量通道里补渲高清版本并推送 upgrade 事件；留空关闭
+UPGRADE_QUALITY = os.environ.get("UPGRADE_QUALITY", "-qm")
+MAX_TRACKED_UPGRADES = 512  # /render 的补渲状态最多保留多少条
+
+# ================= 🧩 分段并行渲染 =================
+# 长场景按动画边界切成若干段并行渲染，再无重编码拼接；0 / 1 表示关闭
+# 多出来的段向调度器借空闲槽位 (计入 RENDER_WORKERS)，借不够时合并相邻分段
+RENDER_PARALLEL_SECTIONS = int(os.environ.get("RENDER_PARALLEL_SECTIONS", "0"))  # 最多切成几段
+RENDER_SECTION_MIN_ANIMATIONS = int(os.environ.get("RENDER_SECTION_MIN_ANIMATIONS", "4"))  # 每段至少多少个动画
+
+# ================= 🌐 渲染集群 =================
+# 开启后渲染任务按成本与负载分发到多个渲染节点 (render_node.py)，本机也作为一个节点参与
+RENDER_FARM_ENABLED = os.environ.get("RENDER_FARM_ENABLED", "false").lower() == "true"
+RENDER_NODES = [u.strip() for u in os.environ.get("RENDER_NODES", "").split(",") if u.strip()]  # 静态节点地址列表
+RENDER_FARM_LOCAL_NODES = int(os.environ.get("RENDER_FARM_LOCAL_NODES", "0"))      # 在本机额外拉起的节点进程数
+RENDER_FARM_LOCAL_NODE_SLOTS = int(os.environ.get("RENDER_FARM_LOCAL_NODE_SLOTS", "2"))
+RENDER_FARM_NODE_PORT_BASE = int(os.environ.get("RENDER_FARM_NODE_PORT_BASE", "8101"))
+RENDER_FARM_COORDINATOR_URL = os.environ.get("RENDER_FARM_COORDINATOR_URL", "http://127.0.0.1:8001")
+RENDER_FARM_TOKEN = os.environ.get("RENDER_FARM_TOKEN", "")                     # 节点与协调端之间的共享令牌 (启用集群时必填)
+RENDER_FARM_HEARTBEAT_INTERVAL = 5
+RENDER_FARM_NODE_TTL = 15          # 超过该秒数没有心跳视为失联
+RENDER_FARM_MAX_ATTEMPTS = 3       # 单个任务最多尝试的节点数
+
+# ================= 🧱 单次渲染资源限制 =================
+# 防止一个失控的场景 (超大分辨率曲面 / 死循环) 拖垮整机；0 表示不限制
+RENDER_LIMIT_AS_MB = int(os.environ.get("RENDER_LIMIT_AS_MB", "6144"))          # 地址空间上限 (MB)
+RENDER_LIMIT_CPU_SECONDS = int(os.environ.get("RENDER_LIMIT_CPU_SECONDS", "600"))  # CPU 时间上限 (秒)
+RENDER_LIMIT_FSIZE_MB = int(os.environ.get("RENDER_LIMIT_FSIZE_MB", "2048"))     # 单个输出文件上限 (MB)
+
+# 可选的 cgroup v2 通道隔离：填写一个已委派给本服务的空 cgroup 目录，留空关闭
+RENDER_CGROUP_ROOT = os.environ.get("RENDER_CGROUP_ROOT", "")
+# 各通道的 cpu.weight (1-10000) 与 memory.high (MB)，格式 "通道:数值,..."
+RENDER_CGROUP_CPU_WEIGHTS = {
+    lane: int(value) for lane, value in (
+        item.split(":") for item in os.environ.get(
+            "RENDER_CGROUP_CPU_WEIGHTS", "preview:400,interactive:200,gateway:100,batch:25"
+        ).split(",") if ":" in item
+    )
+}
+RENDER_CGROUP_MEMORY_HIGH_MB = {
+    lane: int(value) for lane, value in (
+        item.split(":") for item in os.environ.get("RENDER_CGROUP_MEMORY_HIGH_MB", "").split(",") if ":" in item
+    )
+}
+
+# ================= 🗄️ 产物仓库 =================
+# 渲染产物按内容哈希分片存放在 static/media 下 (必须位于 static/ 之内才能被访问)
+ARTIFACT_STORE_DIR = os.path.join(STATIC_DIR, "media")
+ARTIFACT_DB_PATH = os.environ.get("ARTIFACT_DB_PATH", os.path.join(BASE_DIR, "artifacts.db"))  # 引用计数索引
+ARTIFACT_MAX_IDLE_HOURS = int(os.environ.get("ARTIFACT_MAX_IDLE_HOURS", "24"))  # 无人引用的产物保留多久
+# 渐进式 HLS 的播放列表与分段只在渲染期间有用，单独放一个目录，启动时整体清空
+STREAM_DIR = os.path.join(STATIC_DIR, "streams")
+
+# ================= 📝 Prompt 缓存 =================
+# 留空使用本地 SQLite (PROMPT_CACHE_DB_PATH)；填 redis://host:6379/0 则多节点共用 (需要 pip install redis)
+PROMPT_CACHE_URL = os.environ.get("PROMPT_CACHE_URL", "")
+PROMPT_CACHE_DB_PATH = os.environ.get("PROMPT_CACHE_DB_PATH", os.path.join(BASE_DIR, "prompt_cache.db"))
+PROMPT_CACHE_TTL_HOURS = int(os.environ.get("PROMPT_CACHE_TTL_HOURS", "168"))  # 0 表示永不过期
+# 近似匹配：同一代码上下文内，归一化后 n-gram 相似度不低于该值 (且只差增删) 的指令算命中；1 表示只做精确匹配
+PROMPT_MATCH_THRESHOLD = float(os.environ.get("PROMPT_MATCH_THRESHOLD", "0.8"))
+
+# 大模型回复按阶段缓存 (intent / generator / analyzer / improver / fixer / modifier / suggestions)
+# "阶段:秒数"，未列出的阶段不缓存；默认只缓存低温、输出稳定的意图分析与分析器
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_TTLS = {
+    stage.strip(): int(ttl) for stage, ttl in (
+        item.split(":") for item in os.environ.get("LLM_CACHE_TTLS", "intent:86400,analyzer:86400").split(",") if ":" in item
+    )
+}
+
+# 渲染缓存 / Prompt 缓存前面的进程内 LRU (热门指令不读磁盘)；条目数填 0 关闭
+MEMORY_CACHE_MAX_ENTRIES = int(os.environ.get("MEMORY_CACHE_MAX_ENTRIES", "2048"))
+MEMORY_CACHE_MAX_KB = int(os.environ.get("MEMORY_CACHE_MAX_KB", "4096"))
+MEMORY_CACHE_TTL = int(os.environ.get("MEMORY_CACHE_TTL", "600"))  # 秒
+
+# ================= ⚡ 快速模式 =================
+# 初稿通过本地检查时是否跳过分析器 + 改进器直接渲染：full 总是完整流程 / auto 按历史决定 / fast 总是跳过
+PIPELINE_MODE = os.environ.get("PIPELINE_MODE", "auto").lower()
+PIPELINE_FAST_MIN_SAMPLES = int(os.environ.get("PIPELINE_FAST_MIN_SAMPLES", "5"))           # 该意图类型至少审查过几次
+PIPELINE_FAST_MAX_CHANGE_RATE = float(os.environ.get("PIPELINE_FAST_MAX_CHANGE_RATE", "0.2"))  # 改进器实质改动初稿的比例上限
+PIPELINE_FAST_MAX_FAIL_RATE = float(os.environ.get("PIPELINE_FAST_MAX_FAIL_RATE", "0.3"))     # 快速模式首次渲染失败的比例上限
+PIPELINE_FAST_MIN_CONFIDENCE = float(os.environ.get("PIPELINE_FAST_MIN_CONFIDENCE", "0.7"))   # 意图分析置信度下限
+PIPELINE_FAST_EXPLORE = float(os.environ.get("PIPELINE_FAST_EXPLORE", "0.1"))               # 仍走完整流程的抽样比例
+# 生成器按预判的意图与意图分析同时开跑，意图不符 (新建 / 在当前代码上修改) 时才重新生成
+SPECULATIVE_GENERATION = os.environ.get("SPECULATIVE_GENERATION", "true").lower() == "true"
+
+# ================= 🧹 存储回收 =================
+# 后台定期回收 static/ 与 temp_gen/；预算填 0 表示不限制大小 (被引用的产物永远不删)
+STORAGE_GC_INTERVAL = int(os.environ.get("STORAGE_GC_INTERVAL", "300"))    # 回收间隔 (秒)，0 关闭后台回收
+STATIC_MAX_MB = int(os.environ.get("STATIC_MAX_MB", "10240"))              # static/ 总大小预算
+TEMP_MAX_MB = int(os.environ.get("TEMP_MAX_MB", "4096"))                   # temp_gen/ 总大小预算
+TEMP_ORPHAN_MINUTES = int(os.environ.get("TEMP_ORPHAN_MINUTES", "30"))     # req_* / preview_* 目录多久无写入视为孤儿
+
+# ================= 📺 渐进式输出 =================
+# 渲染中每完成一个动画就转封装为 HLS 分段，WebSocket 提前推送播放列表 (需要 ffmpeg)
+PROGRESSIVE_STREAM_ENABLED = os.environ.get("PROGRESSIVE_STREAM_ENABLED", "true").lower() == "true"
+
+# ================= 📼 媒体分发 =================
+# 可选：把 /static 的文件传输交给前置代理 (nginx 填 X-Accel-Redirect，Apache / lighttpd 填 X-Sendfile)
+MEDIA_ACCEL_HEADER = os.environ.get("MEDIA_ACCEL_HEADER", "")
+MEDIA_ACCEL_PREFIX = os.environ.get("MEDIA_ACCEL_PREFIX", "/_media/")  # 代理中 internal location 的前缀
 
 # ================= 🎯 默认值 =================
 DEFAULT_SCENE_NAME = "MathScene"
@@ -0,0 +1,54 @@
+# static_scene.py
+"""
+静态场景快速通道
+没有任何 play / wait 的场景只有一帧画面：直接用 -s 渲染这一帧，跳过视频编码与
+"先渲染视频、找不到 mp4 再转图片" 的第二遍。
+需要视频的调用方 (Gateway 只认 mp4) 再把这一帧封装成单帧 mp4，只编码一帧。
+"""
+
+import os
+import ast
+import asyncio
+
+from section_render import PLAY_METHODS
+
+# 单帧 mp4 的编码模板：1 fps 只编一帧，时长 1 秒；宽高取偶数以满足 yuv420p
+STILL_CLIP_ARGS = [
+    "-c:v", "libx264", "-preset", "veryfast", "-tune", "stillimage",
+    "-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2",
+    "-pix_fmt", "yuv420p", "-r", "1", "-frames:v", "1",
+    "-movflags", "+faststart",
+]
+
+
+def is_static_scene(tree):
+    """代码里没有任何 play / wait 调用 (包括循环、辅助方法里的) 时只有一帧画面
+
+    tree 为 ast.parse 的结果；是否存在场景类由调用方判断。
+    """
+    return not any(
+        isinstance(node, ast.Call) and getattr(node.func, "attr", None) in PLAY_METHODS
+        for node in ast.walk(tree)
+    )
+
+
+async def encode_still_clip(image_path, output_path):
+    """把一张图片封装为单帧 mp4，返回 (ok, 错误信息)"""
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-framerate", "1", "-i", image_path,
+            *STILL_CLIP_ARGS,
+            output_path,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            _, stderr = await proc.communicate()
+        except asyncio.CancelledError:
+            proc.kill()
+            raise
+    except Exception as e:
+        return False, str(e)
+    return proc.returncode == 0 and os.path.isfile(output_path), stderr.decode("utf-8", errors="ignore")
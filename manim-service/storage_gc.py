@@ -0,0 +1,234 @@
+# storage_gc.py
+"""
+持续运行的存储回收
+以前过期的媒体只在启动时 (cleanup_workspace_startup) 按 24 小时 mtime 清理一次，
+长时间运行的实例会把磁盘写满，唯一的办法是 /api/reset 全部删除。这里按固定间隔：
+  - static/：先把 /static 的分发记录刷进产物仓库，再删除超过保留期的无人引用产物；
+    总大小超出预算时，按最近分发时间从旧到新继续淘汰 (被渲染缓存 / 对话 / Prompt 缓存
+    引用的产物永远不删)。过期的渐进式播放列表与旧版平铺文件也在这里清理。
+  - temp_gen/：崩溃 / 被取消的请求留下的 req_* 与 preview_* 目录，整棵树长时间
+    没有任何写入就视为孤儿回收；总大小超出预算时从最久未写入的孤儿开始删。
+"""
+
+import os
+import time
+import shutil
+import asyncio
+
+# 旧版直接平铺在 static/ 下的媒体 (video_<id>.mp4 等)
+_LEGACY_SUFFIXES = (".mp4", ".png", ".webp")
+# 请求级临时目录的前缀 (scratch/、node_* 等长期目录不在此列)
+_ORPHAN_PREFIXES = ("req_", "preview_")
+# 刚入库、刚写入的文件至少保留这么久，避免与正在进行的请求抢同一份文件
+_MIN_IDLE_SECONDS = 600
+
+
+class StorageGC:
+    """static/ 与 temp_gen/ 的后台回收任务 (预算 0 表示不限制大小)"""
+
+    def __init__(self, artifacts, media, static_dir, temp_dir, stream_dir,
+                 static_max_bytes=0, temp_max_bytes=0, artifact_ttl=24 * 3600, orphan_ttl=1800, interval=300,
+                 hooks=()):
+        self.artifacts = artifacts  # artifact_store.ArtifactStore
+        self.media = media          # media_files.MediaFiles (提供分发记录)
+        self.static_dir = static_dir
+        self.temp_dir = temp_dir
+        self.stream_dir = stream_dir
+        self.static_max_bytes = static_max_bytes
+        self.temp_max_bytes = temp_max_bytes
+        self.artifact_ttl = artifact_ttl
+        self.orphan_ttl = max(orphan_ttl, _MIN_IDLE_SECONDS)
+        self.interval = interval
+        self.hooks = list(hooks)  # 每轮开始前调用，例如让缓存先撤销过期条目的引用
+        self.stats = {
+            "runs": 0, "last_run": None, "last_duration_ms": 0,
+            "artifacts_removed": 0, "legacy_removed": 0, "streams_removed": 0, "orphans_removed": 0,
+            "bytes_freed": 0, "static_bytes": 0, "temp_bytes": 0, "pinned_bytes": 0,
+            "over_budget": False, "errors": 0,
+        }
+        self._task = None
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return self._task
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                result = await asyncio.to_thread(self.collect)
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"⚠️ 存储回收失败: {e}")
+                continue
+            if result["removed"]:
+                print(f"🧹 [GC] 回收 {result['removed']} 项，释放 {result['freed'] / 1024 / 1024:.1f} MB")
+
+    # ---------- 一轮回收 ----------
+    def collect(self):
+        """执行一轮回收 (阻塞，在线程里调用)，返回 {"removed": 项数, "freed": 字节数}"""
+        started = time.time()
+        for hook in self.hooks:
+            try:
+                hook()
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"⚠️ 回收前置任务失败: {e}")
+        removed, freed = 0, 0
+        for count, size in (self._collect_static(started), self._collect_temp(started)):
+            removed += count
+            freed += size
+        self.stats["runs"] += 1
+        self.stats["last_run"] = started
+        self.stats["last_duration_ms"] = int((time.time() - started) * 1000)
+        self.stats["bytes_freed"] += freed
+        return {"removed": removed, "freed": freed}
+
+    def _collect_static(self, now):
+        # 1. 分发记录决定 LRU 顺序：被浏览器反复拉取的产物排在最后
+        self.artifacts.touch_many(self.media.drain_served())
+
+        # 2. 保留期：无人引用且长期未被访问的产物
+        removed, freed = self.artifacts.collect(self.artifact_ttl)
+        self.stats["artifacts_removed"] += removed
+
+        # 3. 渐进式播放列表只在渲染期间与结束后不久有用
+        streams = _list_files(self.stream_dir)
+        stream_removed, stream_freed, streams = _remove_older_than(streams, now - self.orphan_ttl)
+        self.stats["streams_removed"] += stream_removed
+
+        # 4. 旧版平铺文件：按 mtime 套用同样的保留期
+        legacy = [
+            entry for entry in _list_files(self.static_dir, recursive=False)
+            if entry[0].endswith(_LEGACY_SUFFIXES)
+        ]
+        legacy_removed, legacy_freed, legacy = _remove_older_than(legacy, now - self.artifact_ttl)
+
+        # 5. 大小预算：先删旧版文件，再按 LRU 淘汰仓库里无人引用的产物
+        other_bytes = sum(size for _, size, _ in streams)
+        if self.static_max_bytes:
+            store_bytes = self.artifacts.summary()["bytes"]
+            overflow = store_bytes + other_bytes + sum(size for _, size, _ in legacy) - self.static_max_bytes
+            for path, size, mtime in sorted(legacy, key=lambda entry: entry[2]):
+                if overflow <= 0 or mtime > now - _MIN_IDLE_SECONDS:
+                    break
+                if _remove_file(path):
+                    legacy_removed += 1
+                    legacy_freed += size
+                    overflow -= size
+            legacy = [entry for entry in legacy if os.path.exists(entry[0])]
+            other_bytes += sum(size for _, size, _ in legacy)
+            budget_removed, budget_freed, _ = self.artifacts.evict_to_budget(
+                max(self.static_max_bytes - other_bytes, 0), min_idle_seconds=_MIN_IDLE_SECONDS
+            )
+            removed += budget_removed
+            freed += budget_freed
+            self.stats["artifacts_removed"] += budget_removed
+        else:
+            other_bytes += sum(size for _, size, _ in legacy)
+
+        self.stats["legacy_removed"] += legacy_removed
+        summary = self.artifacts.summary()
+        self.stats["static_bytes"] = summary["bytes"] + other_bytes
+        self.stats["pinned_bytes"] = summary["referenced_bytes"]
+        self.stats["over_budget"] = bool(self.static_max_bytes) and self.stats["static_bytes"] > self.static_max_bytes
+        return removed + stream_removed + legacy_removed, freed + stream_freed + legacy_freed
+
+    def _collect_temp(self, now):
+        if not os.path.isdir(self.temp_dir):
+            self.stats["temp_bytes"] = 0
+            return 0, 0
+        total = 0
+        orphans = []  # (最后写入时间, 字节数, 路径)
+        for entry in os.scandir(self.temp_dir):
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    size, newest = _tree_usage(entry.path)
+                    if entry.name.startswith(_ORPHAN_PREFIXES):
+                        orphans.append((newest, size, entry.path))
+                else:
+                    size = entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                continue
+            total += size
+
+        removed, freed = 0, 0
+        for newest, size, path in sorted(orphans):
+            idle = now - newest
+            over_budget = bool(self.temp_max_bytes) and total - freed > self.temp_max_bytes
+            if idle < self.orphan_ttl and not (over_budget and idle >= _MIN_IDLE_SECONDS):
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            if not os.path.exists(path):
+                removed += 1
+                freed += size
+        self.stats["orphans_removed"] += removed
+        self.stats["temp_bytes"] = total - freed
+        return removed, freed
+
+
+def _list_files(root, recursive=True):
+    """[(路径, 字节数, mtime)]，目录不存在时为空"""
+    entries = []
+    if not os.path.isdir(root):
+        return entries
+    if recursive:
+        walker = ((dirpath, filenames) for dirpath, _, filenames in os.walk(root))
+    else:
+        walker = [(root, [e.name for e in os.scandir(root) if e.is_file(follow_symlinks=False)])]
+    for dirpath, filenames in walker:
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.stat(path, follow_symlinks=False)
+            except OSError:
+                continue
+            entries.append((path, st.st_size, st.st_mtime))
+    return entries
+
+
+def _remove_older_than(entries, cutoff):
+    """删除 mtime 早于 cutoff 的文件，返回 (删除个数, 释放字节数, 剩余条目)"""
+    removed, freed, kept = 0, 0, []
+    for path, size, mtime in entries:
+        if mtime < cutoff and _remove_file(path):
+            removed += 1
+            freed += size
+        else:
+            kept.append((path, size, mtime))
+    return removed, freed, kept
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return True
+    except OSError as e:
+        print(f"⚠️ 文件删除失败 {os.path.basename(path)}: {e}")
+        return False
+    return True
+
+
+def _tree_usage(root):
+    """目录树的总字节数与最近一次写入时间 (含目录自身的 mtime)"""
+    total = 0
+    newest = os.stat(root).st_mtime
+    for dirpath, dirnames, filenames in os.walk(root):
+        for names, is_file in ((dirnames, False), (filenames, True)):
+            for name in names:
+                try:
+                    st = os.stat(os.path.join(dirpath, name), follow_symlinks=False)
+                except OSError:
+                    continue
+                newest = max(newest, st.st_mtime)
+                if is_file:
+                    total += st.st_size
+    return total, newest
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 服务模块都在 manim-service/ 根目录下 (平铺布局，没有包)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
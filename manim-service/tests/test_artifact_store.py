@@ -0,0 +1,104 @@
+import os
+
+import pytest
+
+from artifact_store import ArtifactStore, parse_artifact_name
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ArtifactStore(str(tmp_path / "media"), str(tmp_path / "artifacts.db"), url_prefix="/static/media")
+
+
+def _write(tmp_path, name, content):
+    path = tmp_path / name
+    path.write_bytes(content)
+    return str(path)
+
+
+def _age(store, artifact, seconds):
+    """把产物的访问时间往前推 (回收只看访问时间)"""
+    store._db.execute("UPDATE artifacts SET accessed = accessed - ? WHERE digest = ?", (seconds, artifact.digest))
+
+
+def test_ingest_names_by_content_and_shards(store, tmp_path):
+    artifact = store.ingest(_write(tmp_path, "video_1.MP4", b"frames"))
+    assert parse_artifact_name(artifact.path) == (artifact.digest, ".mp4")
+    assert artifact.path == os.path.join(store.root, artifact.digest[:2], artifact.digest[2:4], f"{artifact.digest}.mp4")
+    assert artifact.url == f"/static/media/{artifact.digest[:2]}/{artifact.digest[2:4]}/{artifact.digest}.mp4"
+    assert artifact.size == len(b"frames")
+    assert store.contains(artifact.path)
+
+
+def test_duplicates_are_hard_linked(store, tmp_path):
+    first_src = _write(tmp_path, "video_1.mp4", b"same")
+    second_src = _write(tmp_path, "video_2.mp4", b"same")
+    first = store.ingest(first_src)
+    second = store.ingest(second_src)
+
+    assert first.path == second.path
+    # 源文件保留为同一份数据的硬链接，不占额外空间
+    assert os.path.samefile(first_src, first.path)
+    assert os.path.samefile(second_src, first.path)
+    assert os.stat(first.path).st_nlink == 3
+    assert store.stats["stored"] == 1 and store.stats["deduped"] == 1
+    assert store.summary()["artifacts"] == 1
+
+
+def test_refs_are_counted_once_per_owner(store, tmp_path):
+    artifact = store.ingest(_write(tmp_path, "a.mp4", b"a"), owner="cache:k1")
+    assert store.refcount(artifact.url) == 1
+    assert store.add_ref(artifact.url, "cache:k1")
+    assert store.add_ref(artifact.path, "conversation:c1")
+    assert store.refcount(artifact.path) == 2
+    assert not store.add_ref("/static/video_legacy.mp4", "conversation:c1")
+
+    assert store.release("cache:k1") == 1
+    assert store.release_prefix("conversation:") == 1
+    assert store.refcount(artifact.url) == 0
+
+
+def test_collect_removes_only_idle_unreferenced(store, tmp_path):
+    idle = store.ingest(_write(tmp_path, "idle.mp4", b"idle"))
+    pinned = store.ingest(_write(tmp_path, "pinned.mp4", b"pinned"), owner="cache:k")
+    fresh = store.ingest(_write(tmp_path, "fresh.mp4", b"fresh"))
+    _age(store, idle, 7200)
+    _age(store, pinned, 7200)
+
+    assert store.collect(3600) == (1, len(b"idle"))
+    assert not os.path.exists(idle.path)
+    assert os.path.exists(pinned.path)
+    assert os.path.exists(fresh.path)
+
+
+def test_evict_to_budget_drops_least_recently_used(store, tmp_path):
+    old = store.ingest(_write(tmp_path, "old.mp4", b"o" * 100))
+    recent = store.ingest(_write(tmp_path, "recent.mp4", b"r" * 100))
+    pinned = store.ingest(_write(tmp_path, "pinned.mp4", b"p" * 100), owner="conversation:c")
+    for artifact, seconds in ((old, 300), (recent, 200), (pinned, 400)):
+        _age(store, artifact, seconds)
+
+    assert store.evict_to_budget(250, min_idle_seconds=60) == (1, 100, 200)
+    assert not os.path.exists(old.path)
+    assert os.path.exists(recent.path)
+
+    # 预算再小也不删被引用的产物
+    assert store.evict_to_budget(0, min_idle_seconds=60) == (1, 100, 100)
+    assert os.path.exists(pinned.path)
+
+
+def test_recently_touched_artifacts_survive_eviction(store, tmp_path):
+    artifact = store.ingest(_write(tmp_path, "a.mp4", b"a" * 10))
+    _age(store, artifact, 600)
+    store.touch(artifact.url)
+    assert store.evict_to_budget(0, min_idle_seconds=60) == (0, 0, 10)
+
+
+def test_listeners_hear_about_removed_digests(store, tmp_path):
+    heard = []
+    store.listeners.append(heard.append)
+    artifact = store.ingest(_write(tmp_path, "a.mp4", b"a"))
+    _age(store, artifact, 100)
+    store.collect(10)
+    store.clear()
+    assert heard == [[artifact.digest], None]
@@ -0,0 +1,92 @@
+import pytest
+
+from cache_store import CacheStore, SQLiteBackend, open_backend
+from memory_cache import MemoryLRU
+
+
+@pytest.fixture
+def backend(tmp_path):
+    return SQLiteBackend(str(tmp_path / "cache.db"))
+
+
+def test_values_round_trip_as_json(backend):
+    store = CacheStore(backend, "prompt")
+    store.set("k", {"video_url": "/static/a.mp4", "prompt": "画圆"})
+    assert store.get("k") == {"video_url": "/static/a.mp4", "prompt": "画圆"}
+    assert store.get("missing") is None
+    assert store.stats["hits"] == 1 and store.stats["misses"] == 1
+
+
+def test_expired_entries_are_hidden_and_purged(backend):
+    expired = []
+    store = CacheStore(backend, "prompt", ttl=3600, on_invalidate=expired.append)
+    store.set("old", {"v": 1}, ttl=-1)
+    store.set("fresh", {"v": 2})
+    store.set("forever", {"v": 3}, ttl=0)
+
+    assert store.get("old") is None
+    assert dict(store.items()) == {"fresh": {"v": 2}, "forever": {"v": 3}}
+    assert store.summary()["entries"] == 3  # 过期但还没清理
+
+    assert store.purge_expired() == ["old"]
+    assert expired == ["old"]
+    assert store.summary()["entries"] == 2 and store.stats["expired"] == 1
+
+
+def test_failed_validation_deletes_and_notifies(backend):
+    invalidated = []
+    store = CacheStore(
+        backend, "prompt", validate=lambda value: value["ok"], on_invalidate=invalidated.append
+    )
+    store.set("good", {"ok": True})
+    store.set("bad", {"ok": False})
+
+    assert store.get("good") == {"ok": True}
+    assert store.get("bad") is None
+    assert invalidated == ["bad"]
+    assert backend.get("prompt:bad") is None
+    assert store.stats["stale"] == 1
+
+
+def test_invalidate_callback_errors_are_contained(backend):
+    def broken(key):
+        raise RuntimeError(key)
+
+    store = CacheStore(backend, "prompt", validate=lambda value: False, on_invalidate=broken)
+    store.set("k", {})
+    assert store.get("k") is None
+
+
+def test_namespaces_are_isolated(backend):
+    prompts, pipeline = CacheStore(backend, "prompt"), CacheStore(backend, "pipeline")
+    prompts.set("k", {"from": "prompt"})
+    pipeline.set("k", {"from": "pipeline"})
+    pipeline.set("other", {})
+
+    assert prompts.get("k") == {"from": "prompt"}
+    assert prompts.clear() == ["k"]
+    assert prompts.summary()["entries"] == 0
+    assert pipeline.summary()["entries"] == 2
+    assert pipeline.get("k") == {"from": "pipeline"}
+
+
+def test_memory_tier_is_invalidated_on_set_and_delete(backend):
+    store = CacheStore(backend, "prompt", memory=MemoryLRU())
+    store.set("k", {"v": 1})
+    assert store.get("k") == {"v": 1}
+
+    # 内存层命中不再读持久层
+    backend.set("prompt:k", '{"v": "behind"}')
+    assert store.get("k") == {"v": 1}
+
+    store.set("k", {"v": 2})
+    assert store.get("k") == {"v": 2}
+    store.delete("k")
+    assert store.get("k") is None
+    assert len(store.memory) == 0
+
+
+def test_open_backend_defaults_to_sqlite(tmp_path):
+    assert isinstance(open_backend("", str(tmp_path / "a.db")), SQLiteBackend)
+    backend = open_backend(f"sqlite:///{tmp_path / 'b.db'}", str(tmp_path / "a.db"))
+    assert backend.db_path == str(tmp_path / "b.db")
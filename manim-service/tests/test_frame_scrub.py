@@ -0,0 +1,61 @@
+import contextlib
+
+import pytest
+
+from frame_scrub import encode_frame, parse_scrub, scrub_context, scrub_label
+
+
+@pytest.mark.parametrize("kwargs, scrub", [
+    ({}, None),
+    ({"at_time": 1.5}, {"time": 1.5}),
+    ({"at_time": "2"}, {"time": 2.0}),
+    ({"at_time": 0}, {"time": 0.0}),
+    ({"after_animation": 3}, {"animation": 3}),
+    ({"after_animation": "0"}, {"animation": 0}),
+])
+def test_parse_scrub(kwargs, scrub):
+    assert parse_scrub(**kwargs) == scrub
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"at_time": 1, "after_animation": 2},
+    {"at_time": -0.5},
+    {"after_animation": -1},
+    {"at_time": "soon"},
+    {"after_animation": "1.5"},
+])
+def test_parse_scrub_rejects_bad_arguments(kwargs):
+    with pytest.raises(ValueError):
+        parse_scrub(**kwargs)
+
+
+@pytest.mark.parametrize("scrub, label", [
+    ({"time": 1.5}, "t1.5"),
+    ({"time": 2.0}, "t2"),
+    ({"time": 0.25}, "t0.25"),
+    ({"animation": 3}, "a3"),
+    ({"animation": 0}, "a0"),
+])
+def test_scrub_label(scrub, label):
+    assert scrub_label(scrub) == label
+
+
+def test_labels_of_distinct_targets_do_not_collide():
+    scrubs = [parse_scrub(at_time=t) for t in (0, 1, 1.5, 10)] + [parse_scrub(after_animation=k) for k in (0, 1, 10)]
+    assert len({scrub_label(scrub) for scrub in scrubs}) == len(scrubs)
+
+
+def test_empty_scrub_needs_no_manim():
+    assert isinstance(scrub_context(None), contextlib.nullcontext)
+    assert isinstance(scrub_context({}), contextlib.nullcontext)
+
+
+@pytest.mark.parametrize("fmt", ["png", "webp"])
+def test_encode_frame_falls_back_to_png(tmp_path, fmt):
+    src = tmp_path / "out.png"
+    src.write_bytes(b"not really a png")
+    # 内容不是合法图片时 webp 转换失败，原样改名为 png
+    written = encode_frame(str(src), str(tmp_path / f"frame.{fmt}"), fmt)
+    assert written == str(tmp_path / "frame.png")
+    assert (tmp_path / "frame.png").read_bytes() == b"not really a png"
+    assert not src.exists()
@@ -0,0 +1,91 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from cache_store import SQLiteBackend
+from llm_cache import CachedLLM, request_key
+
+
+class _FakeClient:
+    """chat.completions.create 的替身：按顺序返回 replies，记录每次请求的参数"""
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, **params):
+        self.requests.append(params)
+        content, finish_reason = self.replies.pop(0) if self.replies else ("ok", "stop")
+        return SimpleNamespace(choices=[
+            SimpleNamespace(message=SimpleNamespace(content=content), finish_reason=finish_reason)
+        ])
+
+
+def _messages(text):
+    return [{"role": "system", "content": "你是意图分析器"}, {"role": "user", "content": text}]
+
+
+@pytest.fixture
+def make_llm(tmp_path):
+    def make(client, stage_ttls=None, enabled=True):
+        backend = SQLiteBackend(str(tmp_path / "llm.db"))
+        return CachedLLM(client, backend, {"intent": 3600} if stage_ttls is None else stage_ttls, enabled=enabled)
+    return make
+
+
+def _complete(llm, stage, text, **kwargs):
+    return asyncio.run(llm.complete(stage, model="m", messages=_messages(text), temperature=0.1, **kwargs))
+
+
+def test_cached_stage_hits_on_the_same_request(make_llm):
+    client = _FakeClient(("CREATE", "stop"))
+    llm = make_llm(client)
+    assert _complete(llm, "intent", "画一个圆") == "CREATE"
+    assert _complete(llm, "intent", "画一个圆  \n\n\n") == "CREATE"
+    assert len(client.requests) == 1
+    stats = llm.summary()["stages"]["intent"]
+    assert (stats["calls"], stats["hits"], stats["misses"], stats["hit_rate"]) == (2, 1, 1, 0.5)
+
+
+def test_uncached_stages_always_call_through(make_llm):
+    client = _FakeClient()
+    llm = make_llm(client)
+    for _ in range(2):
+        _complete(llm, "generator", "画一个圆")
+    assert len(client.requests) == 2
+    assert llm.summary()["stages"]["generator"]["cached"] is False
+
+    disabled = make_llm(_FakeClient(), enabled=False)
+    assert not disabled.caches("intent")
+
+
+@pytest.mark.parametrize("reply", [("半截回复", "length"), ("", "stop"), (None, "stop")])
+def test_truncated_or_empty_replies_are_not_cached(make_llm, reply):
+    client = _FakeClient(reply, ("完整回复", "stop"))
+    llm = make_llm(client)
+    _complete(llm, "intent", "画一个圆")
+    assert _complete(llm, "intent", "画一个圆") == "完整回复"
+    assert len(client.requests) == 2
+
+
+def test_other_request_options_are_part_of_the_key(make_llm):
+    client = _FakeClient(("短", "stop"), ("JSON", "stop"))
+    llm = make_llm(client)
+    assert _complete(llm, "intent", "画一个圆", max_tokens=10) == "短"
+    assert _complete(llm, "intent", "画一个圆", response_format={"type": "json_object"}) == "JSON"
+    assert _complete(llm, "intent", "画一个圆", max_tokens=10) == "短"
+    assert len(client.requests) == 2
+    assert client.requests[0]["max_tokens"] == 10
+
+
+def test_normalization_keeps_leading_indentation():
+    def key(text):
+        return request_key("intent", "m", 0.1, _messages(text))
+
+    code = "def construct(self):\n    self.play(Create(Circle()))"
+    assert key(code) == key(code.replace("\n", "   \n") + "\n\n")  # 行尾空白与末尾空行
+    assert key("ｘ＝１") == key("x=1")                                # NFKC
+    assert key(code) != key(code.replace("    ", "  "))              # 缩进不同就是不同的代码
+    assert key("a\n\n\nb") == key("a\n\nb") != key("a\nb")
@@ -0,0 +1,128 @@
+import hashlib
+
+import pytest
+from starlette.applications import Starlette
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from media_files import MediaFiles, parse_range, IMMUTABLE_CACHE_CONTROL, MUTABLE_CACHE_CONTROL
+
+CONTENT = bytes(range(256)) * 4  # 1024 字节
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 1023)),
+    ("bytes=1000-5000", (1000, 1023)),   # 结尾超出文件时截断
+    ("bytes=-24", (1000, 1023)),
+    ("bytes=-5000", (0, 1023)),          # 后缀长度超过文件大小
+    ("bytes=0-1,5-9", None),             # 多区间直接忽略
+    ("items=0-9", None),
+    ("bytes=-", None),
+    ("bytes=9-3", None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, len(CONTENT)) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1024-", "bytes=2000-3000", "bytes=-0"])
+def test_unsatisfiable_ranges_raise(header):
+    with pytest.raises(ValueError):
+        parse_range(header, len(CONTENT))
+
+
+@pytest.fixture
+def media(tmp_path):
+    (tmp_path / "video_abc.mp4").write_bytes(CONTENT)
+    (tmp_path / "live.m3u8").write_text("#EXTM3U\n")
+    (tmp_path / "half.mp4.tmp").write_bytes(b"partial")
+    return MediaFiles(str(tmp_path))
+
+
+@pytest.fixture
+def client(media):
+    async def endpoint(request):
+        return await media.serve(request.path_params["name"], request.headers)
+
+    app = Starlette(routes=[Route("/static/{name:path}", endpoint, methods=["GET", "HEAD"])])
+    return TestClient(app)
+
+
+def test_full_response_has_strong_etag_and_immutable_caching(client):
+    response = client.get("/static/video_abc.mp4")
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert response.headers["etag"] == f'"{hashlib.sha256(CONTENT).hexdigest()}"'
+    assert response.headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["content-type"] == "video/mp4"
+
+
+def test_playlists_are_revalidated(client):
+    assert client.get("/static/live.m3u8").headers["cache-control"] == MUTABLE_CACHE_CONTROL
+
+
+def test_range_request_returns_partial_content(client):
+    response = client.get("/static/video_abc.mp4", headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.content == CONTENT[10:20]
+    assert response.headers["content-range"] == f"bytes 10-19/{len(CONTENT)}"
+    assert response.headers["content-length"] == "10"
+
+
+def test_unsatisfiable_range_returns_416(client):
+    response = client.get("/static/video_abc.mp4", headers={"Range": "bytes=5000-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(CONTENT)}"
+
+
+def test_if_range_with_a_stale_etag_falls_back_to_the_full_file(client):
+    etag = client.get("/static/video_abc.mp4").headers["etag"]
+    fresh = client.get("/static/video_abc.mp4", headers={"Range": "bytes=0-9", "If-Range": etag})
+    stale = client.get("/static/video_abc.mp4", headers={"Range": "bytes=0-9", "If-Range": '"old"'})
+    assert fresh.status_code == 206
+    assert stale.status_code == 200
+    assert stale.content == CONTENT
+
+
+def test_if_none_match_returns_304(client):
+    etag = client.get("/static/video_abc.mp4").headers["etag"]
+    assert client.get("/static/video_abc.mp4", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/static/video_abc.mp4", headers={"If-None-Match": f"W/{etag}"}).status_code == 304
+    assert client.get("/static/video_abc.mp4", headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_head_sends_headers_only(client):
+    response = client.head("/static/video_abc.mp4")
+    assert response.status_code == 200
+    assert response.content == b""
+    assert response.headers["content-length"] == str(len(CONTENT))
+
+
+def test_hidden_missing_and_escaping_paths_are_404(client):
+    assert client.get("/static/half.mp4.tmp").status_code == 404
+    assert client.get("/static/missing.mp4").status_code == 404
+    assert client.get("/static/..%2F..%2Fetc%2Fpasswd").status_code == 404
+
+
+def test_digest_is_cached_until_the_file_changes(media, tmp_path):
+    path = str(tmp_path / "video_abc.mp4")
+    first = media.digest(path)
+    (tmp_path / "video_abc.mp4").write_bytes(CONTENT[::-1] + b"!")
+    second = media.digest(path)
+    assert first[0] == hashlib.sha256(CONTENT).hexdigest()
+    assert second == (hashlib.sha256(CONTENT[::-1] + b"!").hexdigest(), len(CONTENT) + 1)
+
+
+def test_accel_header_hands_the_transfer_to_the_proxy(tmp_path):
+    (tmp_path / "video_abc.mp4").write_bytes(CONTENT)
+    media = MediaFiles(str(tmp_path), accel_header="X-Accel-Redirect", accel_prefix="/protected/")
+
+    async def endpoint(request):
+        return await media.serve(request.path_params["name"], request.headers)
+
+    client = TestClient(Starlette(routes=[Route("/static/{name:path}", endpoint)]))
+    response = client.get("/static/video_abc.mp4")
+    assert response.headers["x-accel-redirect"] == "/protected/video_abc.mp4"
+    assert response.content == b""
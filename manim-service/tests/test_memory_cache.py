@@ -0,0 +1,66 @@
+from memory_cache import MemoryLRU
+
+
+def test_least_recently_used_entry_is_evicted_first():
+    memory = MemoryLRU(max_entries=2)
+    memory.put("a", 1)
+    memory.put("b", 2)
+    assert memory.get("a") == 1
+    memory.put("c", 3)
+    assert memory.get("b") is None
+    assert memory.get("a") == 1 and memory.get("c") == 3
+    assert memory.stats["evictions"] == 1
+
+
+def test_byte_limit_evicts_and_rejects_oversized_values():
+    memory = MemoryLRU(max_bytes=30)  # 每个条目约 13 字节 (json + 键)
+    memory.put("a", "x" * 10)
+    memory.put("b", "y" * 10)
+    assert len(memory) == 2 and memory.bytes <= 30
+    memory.put("c", "z" * 10)
+    assert memory.get("a") is None and len(memory) == 2
+
+    memory.put("huge", "x" * 100)
+    assert memory.get("huge") is None
+    assert memory.bytes <= 30
+
+
+def test_entries_expire_after_the_ttl():
+    memory = MemoryLRU(ttl=0)
+    memory.put("a", 1)
+    assert memory.get("a") is None
+    assert len(memory) == 0 and memory.bytes == 0
+
+
+def _tagged():
+    memory = MemoryLRU(tag_of=lambda value: [value.get("sha256")])
+    memory.put("video", {"sha256": "d1"})
+    memory.put("image", {"sha256": "d2"})
+    memory.put("legacy", {"sha256": None})
+    return memory
+
+
+def test_invalidate_tags_drops_only_entries_of_removed_artifacts():
+    memory = _tagged()
+    memory.invalidate_tags(["d1", "unknown"])
+    assert memory.get("video") is None
+    assert memory.get("image") == {"sha256": "d2"}
+    assert memory.get("legacy") == {"sha256": None}
+    assert memory.stats["invalidations"] == 1
+
+
+def test_invalidate_tags_none_drops_everything():
+    memory = _tagged()
+    memory.invalidate_tags(None)
+    assert len(memory) == 0 and memory.bytes == 0
+    assert memory.stats["invalidations"] == 3
+
+
+def test_replacing_an_entry_keeps_the_byte_count_and_tags_consistent():
+    memory = MemoryLRU(tag_of=lambda value: [value])
+    memory.put("k", "d1")
+    memory.put("k", "d2")
+    memory.invalidate_tags(["d1"])
+    assert memory.get("k") == "d2"
+    memory.invalidate("k")
+    assert memory.bytes == 0
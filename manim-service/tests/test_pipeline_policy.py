@@ -0,0 +1,120 @@
+import textwrap
+
+import pytest
+
+from cache_store import CacheStore, SQLiteBackend
+from pipeline_policy import PipelinePolicy, local_review, guess_intent, speculation_holds
+
+DRAFT = textwrap.dedent('''
+    from manim import *
+
+    class Demo(Scene):
+        def construct(self):
+            self.play(Create(Circle()))
+''')
+CHANGED = DRAFT.replace("Circle()", "Square()")
+MODIFY = {"intent": "MODIFY", "confidence": 0.9}
+
+
+@pytest.fixture
+def make_policy(tmp_path):
+    store = CacheStore(SQLiteBackend(str(tmp_path / "cache.db")), "pipeline")
+
+    def make(**kwargs):
+        kwargs = {"min_samples": 3, "explore": 0, **kwargs}
+        return PipelinePolicy(store, **kwargs)
+    return make
+
+
+def _reviews(policy, total, changed, intent=MODIFY):
+    for i in range(total):
+        policy.record_review(intent, DRAFT, CHANGED if i < changed else DRAFT)
+
+
+def test_local_review_catches_the_analyzer_hard_failures():
+    assert local_review(DRAFT) == (True, "通过")
+    assert not local_review("def broken(:")[0]
+    assert not local_review(DRAFT.replace("Circle()", 'MathTex("圆")'))[0]
+    assert not local_review("x = math.pi")[0]
+
+
+def test_full_mode_always_reviews(make_policy):
+    policy = make_policy(mode="full")
+    _reviews(policy, 10, 0)
+    assert policy.decide(MODIFY, DRAFT, True)[0] == "full"
+
+
+def test_fast_mode_skips_review_once_local_checks_pass(make_policy):
+    policy = make_policy(mode="fast")
+    assert policy.decide({}, DRAFT, True)[0] == "fast"
+    assert policy.decide({}, DRAFT, False)[0] == "full"
+    assert policy.decide({}, "def broken(:", True)[0] == "full"
+
+
+def test_auto_mode_needs_enough_samples(make_policy):
+    policy = make_policy()
+    _reviews(policy, 2, 0)
+    assert policy.decide(MODIFY, DRAFT, True) == ("full", "MODIFY 的历史样本不足")
+    _reviews(policy, 1, 0)
+    assert policy.decide(MODIFY, DRAFT, True)[0] == "fast"
+    assert policy.stats["fast"] == 1 and policy.stats["full"] == 1
+
+
+def test_auto_mode_falls_back_on_low_confidence(make_policy):
+    policy = make_policy()
+    _reviews(policy, 5, 0)
+    assert policy.decide({"intent": "MODIFY", "confidence": 0.5}, DRAFT, True) == ("full", "意图置信度不足")
+    assert policy.decide({"intent": "MODIFY"}, DRAFT, True)[0] == "full"
+    assert policy.decide(None, DRAFT, True)[0] == "full"
+
+
+def test_auto_mode_respects_the_change_rate(make_policy):
+    policy = make_policy(max_change_rate=0.2)
+    _reviews(policy, 5, 1)
+    assert policy.decide(MODIFY, DRAFT, True)[0] == "fast"
+    _reviews(policy, 1, 1)
+    assert policy.decide(MODIFY, DRAFT, True) == ("full", "MODIFY 的初稿经常被改进器修改")
+
+
+def test_auto_mode_respects_the_fast_fail_rate(make_policy):
+    policy = make_policy(max_fail_rate=0.3)
+    _reviews(policy, 5, 0)
+    for failed in (False, False, True):
+        policy.record_fast(MODIFY, failed=failed)
+    assert policy.decide(MODIFY, DRAFT, True) == ("full", "MODIFY 的快速模式经常渲染失败")
+    assert policy.stats["fast_fallbacks"] == 1
+
+
+def test_intent_types_are_counted_separately(make_policy):
+    policy = make_policy()
+    _reviews(policy, 5, 0)
+    assert policy.decide({"intent": "CREATE", "confidence": 0.9}, DRAFT, True)[0] == "full"
+    assert set(policy.summary()["intents"]) == {"MODIFY"}
+
+
+def test_old_history_is_halved_past_the_window(make_policy):
+    policy = make_policy(window=4)
+    _reviews(policy, 5, 2)
+    assert policy.summary()["intents"]["MODIFY"]["reviews"] == 2.5
+
+
+def test_guess_intent_from_state_and_wording():
+    has_code = {"status": "has_code"}
+    assert guess_intent("画一个圆", {}) == "CREATE"
+    assert guess_intent("把圆变成红色", has_code) == "MODIFY"
+    assert guess_intent("重新画一个正方形", has_code) == "CREATE"
+    assert guess_intent("start over with a square", has_code) == "CREATE"
+
+
+@pytest.mark.parametrize("assumed, analysis, holds", [
+    ("CREATE", {"intent": "CREATE"}, True),
+    ("MODIFY", {"intent": "ADD"}, True),          # 同属 "在当前代码上改"
+    ("MODIFY", {"intent": "enhance "}, True),
+    ("CREATE", {"intent": "MODIFY"}, False),
+    ("MODIFY", {"intent": "CREATE"}, False),
+    ("MODIFY", None, True),                       # 意图分析失败：沿用推测的初稿
+    ("CREATE", {"error": "timeout"}, True),
+    ("CREATE", "not json", True),
+])
+def test_speculation_holds_only_within_the_same_scope(assumed, analysis, holds):
+    assert speculation_holds(assumed, analysis) is holds
@@ -0,0 +1,88 @@
+import pytest
+
+from prompt_match import PromptIndex, normalize_prompt, prompt_anchors, context_hash
+
+CONTEXT = context_hash("class Demo(Scene): pass")
+
+
+@pytest.mark.parametrize("prompt", [
+    "画一个红色的圆形",
+    "画一个红色圆形。",
+    "画一个红色圆形！",
+    "  画一个 红色圆形  ",
+])
+def test_wording_differences_normalize_to_the_same_key(prompt):
+    assert normalize_prompt(prompt) == "画红色圆形"
+
+
+def test_english_stopwords_and_case_are_dropped():
+    assert normalize_prompt("Please draw a Circle, thanks!") == "draw circle"
+    assert normalize_prompt("Can you draw the circle please") == "draw circle"
+
+
+def test_english_words_that_carry_meaning_are_kept():
+    assert normalize_prompt("circle with a square") != normalize_prompt("circle and a square")
+    assert normalize_prompt("move it to the left") == "move it to left"
+
+
+def test_numbers_keep_decimals_and_lose_thousands_separators():
+    assert normalize_prompt("把半径设为 1,000") == "把半径设为1000"
+    assert normalize_prompt("把半径设为 2.5。") == "把半径设为2.5"
+    assert prompt_anchors(normalize_prompt("画出 y = x^2 的图像")) == ("2", "x", "y")
+
+
+def test_all_stopwords_fall_back_to_the_folded_prompt():
+    assert normalize_prompt("  请   帮我 ") == "请 帮我"
+
+
+@pytest.fixture
+def index():
+    index = PromptIndex(threshold=0.6)
+    for key, prompt in (("square", "画出函数的平方图像并标注坐标轴"), ("move", "把圆形向右移动两个单位")):
+        index.add(key, normalize_prompt(prompt), CONTEXT)
+    return index
+
+
+def test_insertions_match_within_the_same_context(index):
+    matches = index.query(normalize_prompt("画出函数的平方图像并且标注坐标轴"), CONTEXT)
+    assert [key for key, _ in matches] == ["square"]
+    assert matches[0][1] >= index.threshold
+    assert index.query(normalize_prompt("把圆形向右移动两个单位长度"), CONTEXT)[0][0] == "move"
+
+
+@pytest.mark.parametrize("prompt", [
+    "画出函数的立方图像并标注坐标轴",  # 平方 -> 立方：n-gram 很像，但是替换
+    "把圆形向左移动两个单位",          # 右 -> 左
+    "把圆形向右移动两个单位到 x 轴",    # 多出一个锚点
+])
+def test_substitutions_and_new_anchors_do_not_match(index, prompt):
+    assert index.query(normalize_prompt(prompt), CONTEXT) == []
+
+
+@pytest.mark.parametrize("cached, prompt", [
+    ("画一个正方形，先向右移动，最后旋转并变成蓝色", "画一个正方形，先向右移动，最后不要旋转并变成蓝色"),
+    ("画出函数 y = x^2 的图像并标注顶点和对称轴", "画出函数 y = -x^2 的图像并标注顶点和对称轴"),
+])
+def test_insertions_that_change_the_meaning_do_not_match(cached, prompt):
+    index = PromptIndex(threshold=0.8)
+    index.add("cached", normalize_prompt(cached), CONTEXT)
+    assert index.query(normalize_prompt(prompt), CONTEXT) == []
+    assert index.query(normalize_prompt(cached), CONTEXT)[0][0] == "cached"
+
+
+def test_contexts_are_isolated(index):
+    assert index.query(normalize_prompt("画出函数的平方图像并且标注坐标轴"), context_hash("other")) == []
+
+
+def test_removed_and_replaced_entries_stop_matching(index):
+    index.remove("square")
+    assert index.query(normalize_prompt("画出函数的平方图像并且标注坐标轴"), CONTEXT) == []
+
+    index.add("move", normalize_prompt("把圆形向右移动两个单位"), context_hash("other"))
+    assert index.query(normalize_prompt("把圆形向右移动两个单位长度"), CONTEXT) == []
+    assert len(index) == 1
+
+
+def test_bands_must_divide_the_permutations():
+    with pytest.raises(ValueError):
+        PromptIndex(num_perm=64, bands=10)
@@ -0,0 +1,153 @@
+import os
+import textwrap
+
+import render_cache
+from artifact_store import ArtifactStore
+from memory_cache import MemoryLRU
+from render_cache import RenderCache, canonical_code
+
+SCENE = textwrap.dedent('''
+    from manim import *
+
+    class Demo(Scene):
+        """演示场景"""
+        def construct(self):
+            circle = Circle(radius=1)
+            label = Text("圆")
+            self.play(Create(circle), Write(label))
+''')
+
+
+def test_comments_whitespace_docstrings_and_local_names_do_not_change_the_key():
+    variant = textwrap.dedent('''
+        from manim import *
+        # 换了注释和空行
+
+        class Demo(Scene):
+            def construct(self):
+                c   = Circle(radius=1)   # 圆
+                t = Text("圆")
+
+                self.play(Create(c), Write(t))
+    ''')
+    assert canonical_code(SCENE) == canonical_code(variant)
+
+
+def test_real_changes_change_the_key():
+    assert canonical_code(SCENE) != canonical_code(SCENE.replace("radius=1", "radius=2"))
+    assert canonical_code(SCENE) != canonical_code(SCENE.replace("Circle", "Square"))
+
+
+def test_keyword_arguments_are_not_conflated_with_renamed_parameters():
+    # 两段代码行为不同 (第二段 f(b=1) 会报错)，指纹必须不同
+    first = "def f(a=0, b=0):\n    return a\nf(a=1)\n"
+    second = "def f(b=0, a=0):\n    return b\nf(a=1)\n"
+    assert canonical_code(first) != canonical_code(second)
+
+
+def test_generated_names_do_not_collide_with_existing_identifiers():
+    # 局部变量 x 不能与模块级的 _v0 合并成同一个名字
+    first = "_v0 = 1\ndef f():\n    x = 2\n    return x + _v0\n"
+    second = "_v0 = 1\ndef f():\n    x = 2\n    return _v0 + _v0\n"
+    assert canonical_code(first) != canonical_code(second)
+
+
+def test_parameters_shadow_outer_locals():
+    first = "def f():\n    a = 1\n    g = lambda a: a\n    return g(2)\n"
+    second = "def f():\n    a = 1\n    g = lambda b: a\n    return g(2)\n"
+    assert canonical_code(first) != canonical_code(second)
+
+
+def test_syntax_errors_fall_back_to_the_stripped_source():
+    assert canonical_code("  def broken(:\n") == "def broken(:"
+
+
+def test_store_and_lookup_round_trip(tmp_path):
+    cache = RenderCache(str(tmp_path / "cache"))
+    video = tmp_path / "video.mp4"
+    video.write_bytes(b"frames")
+    key = cache.make_key(SCENE)
+
+    assert cache.lookup(key) is None
+    cache.store(key, str(video), objects=["Circle"])
+    entry = cache.lookup(key)
+
+    assert entry["objects"] == ["Circle"]
+    assert open(entry["path"], "rb").read() == b"frames"
+    assert cache.make_key(SCENE, quality="-qh") != key
+    assert cache.stats["hits"] == 1 and cache.stats["misses"] == 1
+
+
+def test_missing_artifact_invalidates_the_entry(tmp_path):
+    cache = RenderCache(str(tmp_path / "cache"))
+    video = tmp_path / "video.mp4"
+    video.write_bytes(b"frames")
+    key = cache.make_key(SCENE)
+    cached_path = cache.store(key, str(video))
+
+    (tmp_path / "cache" / cached_path.rsplit("/", 1)[-1]).unlink()
+
+    assert cache.lookup(key) is None
+    assert cache.stats["stale"] == 1
+    assert not (tmp_path / "cache" / f"{key}.json").exists()
+
+
+def _stored_artifact(tmp_path, memory=None):
+    """入库一个产物并登记进渲染缓存，返回 (cache, key, 产物路径)"""
+    artifacts = ArtifactStore(str(tmp_path / "media"), str(tmp_path / "artifacts.db"), url_prefix="/static/media")
+    cache = RenderCache(str(tmp_path / "cache"), artifacts=artifacts, memory=memory)
+    video = tmp_path / "video.mp4"
+    video.write_bytes(b"frames")
+    artifact = artifacts.ingest(str(video))
+    key = cache.make_key(SCENE)
+    cache.store(key, artifact.path)
+    return cache, key, artifact.path
+
+
+def test_artifact_rewritten_in_place_invalidates_the_entry(tmp_path):
+    cache, key, path = _stored_artifact(tmp_path)
+    assert cache.lookup(key) is not None
+
+    # 大小与文件名都没变，只有内容变了
+    with open(path, "r+b") as f:
+        f.write(b"FRAMES")
+    stat_result = os.stat(path)
+    os.utime(path, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns + 1_000_000))
+
+    assert cache.lookup(key) is None
+    assert cache.stats["stale"] == 1
+
+
+def test_artifact_digest_is_reused_while_size_and_mtime_hold(tmp_path, monkeypatch):
+    cache, key, _ = _stored_artifact(tmp_path)
+    calls = []
+    real_digest = render_cache.file_digest
+    monkeypatch.setattr(render_cache, "file_digest", lambda path: calls.append(path) or real_digest(path))
+
+    for _ in range(3):
+        assert cache.lookup(key) is not None
+    assert len(calls) == 1
+
+
+def test_memory_hits_are_recorded_for_the_artifact_lru(tmp_path):
+    cache, key, path = _stored_artifact(tmp_path, memory=MemoryLRU())
+    digest = os.path.basename(path).split(".")[0]
+    assert cache.lookup(key) is not None   # 磁盘命中：直接刷新访问时间，回填内存层
+    assert cache.drain_touched() == {}
+    assert cache.lookup(key) is not None   # 内存命中：先记下来
+    touched = cache.drain_touched()
+    assert list(touched) == [digest]
+    assert cache.drain_touched() == {}
+
+    cache.artifacts.touch_many(touched)
+    accessed = cache.artifacts._db.execute("SELECT accessed FROM artifacts WHERE digest = ?", (digest,)).fetchone()[0]
+    assert accessed == touched[digest]
+
+
+def test_disabled_cache_never_hits(tmp_path):
+    cache = RenderCache(str(tmp_path / "cache"), enabled=False)
+    video = tmp_path / "video.mp4"
+    video.write_bytes(b"frames")
+    key = cache.make_key(SCENE)
+    assert cache.store(key, str(video)) is None
+    assert cache.lookup(key) is None
@@ -0,0 +1,99 @@
+import signal
+
+import pytest
+
+import render_limits
+from render_limits import CgroupLanes, ResourceLimits, make_preexec
+
+resource = pytest.importorskip("resource")
+
+LIMITS = ResourceLimits(address_space_mb=2048, cpu_seconds=60, file_size_mb=500)
+
+
+@pytest.mark.parametrize("returncode, stderr, reason", [
+    (-signal.SIGXCPU, "", "CPU 时间超过 60 秒"),
+    (-signal.SIGXFSZ, "", "输出文件超过 500MB"),
+    (1, "OSError: [Errno 27] File too large", "输出文件超过 500MB"),
+    (1, "Traceback ...\nMemoryError", "内存超过 2048MB"),
+    (1, "numpy.core._exceptions._ArrayMemoryError: Unable to allocate 12.0 GiB", "内存超过 2048MB"),
+    (-signal.SIGKILL, "", "内存不足，被系统终止"),
+    (1, "NameError: name 'Circel' is not defined", None),
+    (0, "", None),
+])
+def test_violation(returncode, stderr, reason):
+    assert LIMITS.violation(returncode, stderr) == reason
+
+
+def test_memory_errors_without_an_address_space_limit():
+    assert ResourceLimits().violation(1, "std::bad_alloc") == "内存不足"
+
+
+def test_enabled_needs_at_least_one_limit():
+    assert not ResourceLimits().enabled
+    assert ResourceLimits(cpu_seconds=1).enabled
+    assert make_preexec(ResourceLimits()) is None
+    assert make_preexec(LIMITS) is not None
+
+
+@pytest.fixture
+def restore_limits():
+    """apply_for_job 改的是当前 (测试) 进程的软限制，测完恢复"""
+    kinds = (resource.RLIMIT_AS, resource.RLIMIT_CPU, resource.RLIMIT_FSIZE)
+    original = {kind: resource.getrlimit(kind) for kind in kinds}
+    yield
+    for kind, limits in original.items():
+        resource.setrlimit(kind, limits)
+
+
+def _soft(kind):
+    return resource.getrlimit(kind)[0]
+
+
+def _capped(kind, value):
+    """软限制不能超过硬限制"""
+    hard = resource.getrlimit(kind)[1]
+    return value if hard == resource.RLIM_INFINITY else min(value, hard)
+
+
+def test_apply_for_job_sets_and_restores_the_soft_limits(restore_limits):
+    before = {kind: _soft(kind) for kind in (resource.RLIMIT_AS, resource.RLIMIT_CPU, resource.RLIMIT_FSIZE)}
+    limits = ResourceLimits(address_space_mb=1024 * 1024, cpu_seconds=60, file_size_mb=4096)
+
+    saved = limits.apply_for_job()
+    assert [kind for kind, _ in saved] == [resource.RLIMIT_AS, resource.RLIMIT_CPU, resource.RLIMIT_FSIZE]
+    used = resource.getrusage(resource.RUSAGE_SELF)
+    # CPU 时间按本任务新增计算，不是从进程启动算起
+    assert _soft(resource.RLIMIT_CPU) >= _capped(resource.RLIMIT_CPU, int(used.ru_utime + used.ru_stime) + 60)
+    assert _soft(resource.RLIMIT_FSIZE) == _capped(resource.RLIMIT_FSIZE, 4096 * render_limits.MB)
+
+    ResourceLimits.restore(saved)
+    assert {kind: _soft(kind) for kind in before} == before
+
+
+def test_apply_for_job_skips_an_address_space_below_current_usage(restore_limits, monkeypatch):
+    monkeypatch.setattr(render_limits, "_current_vm_bytes", lambda: 4096 * render_limits.MB)
+    before = _soft(resource.RLIMIT_AS)
+
+    saved = ResourceLimits(address_space_mb=2048).apply_for_job()
+    assert saved == []
+    assert _soft(resource.RLIMIT_AS) == before
+
+
+def test_cgroup_lanes_write_their_settings(tmp_path, monkeypatch):
+    monkeypatch.setattr(render_limits.sys, "platform", "linux")
+    lanes = CgroupLanes(str(tmp_path), cpu_weights={"interactive": 1000}, memory_high_mb={"batch": 512})
+    assert lanes.setup(["interactive", "batch"])
+
+    assert (tmp_path / "cgroup.subtree_control").read_text() == "+cpu +memory"
+    assert (tmp_path / "interactive" / "cpu.weight").read_text() == "1000"
+    assert (tmp_path / "batch" / "memory.high").read_text() == str(512 * render_limits.MB)
+    assert lanes.procs_file(None) is None
+
+    lanes.attach(1234, "batch")
+    assert (tmp_path / "batch" / "cgroup.procs").read_text() == "1234"
+
+
+def test_cgroup_lanes_stay_disabled_without_a_root():
+    lanes = CgroupLanes("")
+    assert not lanes.setup(["interactive"])
+    assert lanes.procs_file("interactive") is None
@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from render_manager import ProgressTracker, parse_progress_line
+
+
+@pytest.mark.parametrize("line, parsed", [
+    ("Animation 3: Create(Circle):  45%|████▌     | 7/15 [00:01<00:01,  6.10it/s]", (3, 45)),
+    ("Animation 0 : FadeIn(Text('你好')): 100%|██████████| 15/15", (0, 100)),
+    ("Animation 1: Write(MathTex): 120%|", (1, 100)),
+    ("INFO     Animation 2 : Partial movie file written in ...", None),
+    ("File ready at media/videos/scene/480p15/out.mp4", None),
+    ("", None),
+])
+def test_parse_progress_line(line, parsed):
+    assert parse_progress_line(line) == parsed
+
+
+def _track(chunks, expected_total=0, min_interval=0):
+    events = []
+
+    async def callback(animation, total, pct):
+        events.append((animation, total, pct))
+
+    async def scenario():
+        tracker = ProgressTracker(callback, expected_total, min_interval)
+        for chunk in chunks:
+            await tracker.feed(chunk)
+    asyncio.run(scenario())
+    return events
+
+
+def test_tqdm_refreshes_are_split_on_carriage_returns():
+    chunks = ["Animation 0: Create:  50%|█████     |\rAnimation 0: Create: 100%|", "██████████|\r",
+              "Animation 1: FadeOut:  50%|"]
+    # 最后一段没有换行，留在缓冲区里等后续输出
+    assert _track(chunks, expected_total=2) == [(1, 2, 25), (1, 2, 50)]
+    assert _track(chunks + ["\n"], expected_total=2)[-1] == (2, 2, 75)
+
+
+def test_only_the_latest_line_of_a_chunk_is_reported():
+    chunk = "".join(f"Animation 0: Create: {pct:3d}%|\r" for pct in (10, 20, 30))
+    assert _track([chunk], expected_total=4) == [(1, 4, 7)]
+
+
+def test_total_grows_past_the_static_estimate():
+    # 静态估计只有 1 个动画，实际出现了第 3 个 (循环里的 play)
+    assert _track(["Animation 2: Create:  0%|\n"], expected_total=1) == [(3, 3, 66)]
+
+
+def test_repeated_states_are_not_reported_twice():
+    chunks = ["Animation 0: Create:  50%|\n", "Animation 0: Create:  50%|\n", "Animation 0: Create:  60%|\n"]
+    assert _track(chunks, expected_total=1) == [(1, 1, 50), (1, 1, 60)]
+
+
+def test_updates_are_throttled_by_min_interval():
+    chunks = [f"Animation 0: Create: {pct}%|\n" for pct in (10, 20, 30)]
+    assert _track(chunks, expected_total=1, min_interval=60) == [(1, 1, 10)]
+
+
+def test_callback_errors_are_contained():
+    async def broken(animation, total, pct):
+        raise RuntimeError("socket closed")
+
+    async def scenario():
+        tracker = ProgressTracker(broken, 1, min_interval=0)
+        await tracker.feed("Animation 0: Create:  50%|\n")
+        await tracker.feed("Animation 0: Create:  90%|\n")
+        return tracker._last_state
+    assert asyncio.run(scenario()) == (0, 90)
@@ -0,0 +1,200 @@
+import asyncio
+
+import pytest
+
+from render_scheduler import (
+    RenderScheduler, QueueFullError, JobSupersededError, ANONYMOUS_CLIENT,
+    LANE_PREVIEW, LANE_INTERACTIVE, LANE_GATEWAY, LANE_BATCH,
+)
+
+
+async def _hold_slot(scheduler):
+    """占住唯一的槽位，返回 (释放用的 Event, 占位任务)"""
+    release = asyncio.Event()
+    task = asyncio.create_task(scheduler.submit(release.wait, lane=LANE_BATCH, client_id="holder"))
+    await asyncio.sleep(0)
+    return release, task
+
+
+async def _run_in_order(scheduler, submissions):
+    """依次提交 (name, lane, client_id)，释放占位后返回实际执行顺序"""
+    release, holder = await _hold_slot(scheduler)
+    order = []
+    tasks = []
+    for name, lane, client_id in submissions:
+        async def runner(name=name):
+            order.append(name)
+        tasks.append(asyncio.create_task(scheduler.submit(runner, lane=lane, client_id=client_id)))
+        await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(holder, *tasks)
+    return order
+
+
+def test_lanes_run_in_priority_order():
+    async def scenario():
+        scheduler = RenderScheduler(workers=1, max_queue=10)
+        return await _run_in_order(scheduler, [
+            ("batch", LANE_BATCH, "a"),
+            ("gateway", LANE_GATEWAY, "b"),
+            ("interactive", LANE_INTERACTIVE, "c"),
+            ("preview", LANE_PREVIEW, "d"),
+        ])
+
+    assert asyncio.run(scenario()) == ["preview", "interactive", "gateway", "batch"]
+
+
+def test_clients_take_turns_within_a_lane():
+    async def scenario():
+        scheduler = RenderScheduler(workers=1, max_queue=10)
+        return await _run_in_order(scheduler, [
+            ("a1", LANE_INTERACTIVE, "a"),
+            ("a2", LANE_INTERACTIVE, "a"),
+            ("a3", LANE_INTERACTIVE, "a"),
+            ("b1", LANE_INTERACTIVE, "b"),
+            ("c1", LANE_INTERACTIVE, "c"),
+        ])
+
+    assert asyncio.run(scenario()) == ["a1", "b1", "c1", "a2", "a3"]
+
+
+def test_queue_positions_are_reported():
+    async def scenario():
+        scheduler = RenderScheduler(workers=1, max_queue=10)
+        release, holder = await _hold_slot(scheduler)
+        positions = {"a": [], "b": []}
+        tasks = []
+        for client_id, lane in (("a", LANE_BATCH), ("b", LANE_PREVIEW)):
+            async def on_position(position, client_id=client_id):
+                positions[client_id].append(position)
+            tasks.append(asyncio.create_task(scheduler.submit(
+                lambda: asyncio.sleep(0), lane=lane, client_id=client_id, on_position=on_position
+            )))
+            await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(holder, *tasks)
+        return positions
+
+    positions = asyncio.run(scenario())
+    # b 走预览通道，后提交也排到 a 前面
+    assert positions["a"] == [1, 2, 1]
+    assert positions["b"] == [1]
+
+
+def test_full_queue_rejects_new_jobs():
+    async def scenario():
+        scheduler = RenderScheduler(workers=1, max_queue=1)
+        release, holder = await _hold_slot(scheduler)
+        queued = asyncio.create_task(scheduler.submit(lambda: asyncio.sleep(0), client_id="a"))
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFullError):
+            await scheduler.submit(lambda: asyncio.sleep(0), client_id="b")
+        release.set()
+        await asyncio.gather(holder, queued)
+        return scheduler.stats
+
+    assert asyncio.run(scenario())["rejected"] == 1
+
+
+def test_supersede_cancels_queued_and_running_jobs_of_the_same_client():
+    async def scenario():
+        scheduler = RenderScheduler(workers=1, max_queue=10)
+        running = asyncio.create_task(scheduler.submit(lambda: asyncio.sleep(10), client_id="a"))
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(scheduler.submit(lambda: asyncio.sleep(10), client_id="a"))
+        await asyncio.sleep(0)
+        latest = await scheduler.submit(lambda: asyncio.sleep(0, result="latest"), client_id="a", supersede=True)
+        results = await asyncio.gather(running, queued, return_exceptions=True)
+        return latest, results
+
+    latest, results = asyncio.run(scenario())
+    assert latest == "latest"
+    assert all(isinstance(r, JobSupersededError) for r in results)
+
+
+def test_cancelled_waiter_gives_back_its_place():
+    async def scenario():
+        scheduler = RenderScheduler(workers=1, max_queue=10)
+        release, holder = await _hold_slot(scheduler)
+        waiter = asyncio.create_task(scheduler.submit(lambda: asyncio.sleep(0), client_id="a"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        queued = scheduler.queued_count()
+        release.set()
+        await holder
+        return queued, scheduler.snapshot()
+
+    queued, snapshot = asyncio.run(scenario())
+    assert queued == 0
+    assert snapshot["running"] == 0
+
+
+def test_anonymous_submissions_never_supersede_each_other():
+    async def scenario():
+        scheduler = RenderScheduler(workers=4, max_queue=10)
+        first = asyncio.create_task(scheduler.submit(
+            lambda: asyncio.sleep(0.01, result="first"), lane=LANE_GATEWAY, client_id=ANONYMOUS_CLIENT, supersede=True
+        ))
+        await asyncio.sleep(0)
+        second = await scheduler.submit(
+            lambda: asyncio.sleep(0, result="second"), lane=LANE_GATEWAY, client_id=ANONYMOUS_CLIENT, supersede=True
+        )
+        return await first, second, scheduler.stats
+
+    first, second, stats = asyncio.run(scenario())
+    assert (first, second) == ("first", "second")
+    assert stats["superseded"] == 0
+
+
+def test_borrowed_slots_count_against_the_workers():
+    async def scenario():
+        scheduler = RenderScheduler(workers=3, max_queue=10)
+        release, holder = await _hold_slot(scheduler)
+        borrowed = scheduler.borrow(5)
+        waiter = asyncio.create_task(scheduler.submit(lambda: asyncio.sleep(0, result="ran"), client_id="a"))
+        await asyncio.sleep(0)
+        queued_while_borrowed = scheduler.queued_count()
+        # 有任务排队时不再外借
+        refused = scheduler.borrow(1)
+        scheduler.give_back(borrowed)
+        result = await waiter
+        release.set()
+        await holder
+        return borrowed, queued_while_borrowed, refused, result, scheduler.snapshot()
+
+    borrowed, queued, refused, result, snapshot = asyncio.run(scenario())
+    assert borrowed == 2
+    assert queued == 1 and refused == 0
+    assert result == "ran"
+    assert snapshot["borrowed"] == 0 and snapshot["running"] == 0
+
+
+def test_section_renders_borrow_free_slots_and_merge_the_rest():
+    from render_manager import RenderProcessManager, RenderJob
+
+    async def scenario(workers, running):
+        scheduler = RenderScheduler(workers=workers, max_queue=10)
+        manager = RenderProcessManager(scheduler=scheduler)
+        plans = []
+
+        async def render_sections(job, plan, timeout, on_progress=None):
+            plans.append((plan, scheduler.snapshot()["borrowed"]))
+            return "sections"
+        manager._render_sections = render_sections
+
+        holders = [await _hold_slot(scheduler) for _ in range(running)]
+        job = RenderJob("scene.py", "Demo", "media", "out", sections=[(0, 2), (3, 5), (6, 8), (9, 11)])
+        result = await manager._run_sections(job, timeout=10)
+        for release, _ in holders:
+            release.set()
+        await asyncio.gather(*(task for _, task in holders))
+        return result, plans, scheduler.snapshot()["borrowed"]
+
+    # 4 个槽位、本任务占 1 个：借 3 个，四段全开
+    assert asyncio.run(scenario(4, 1)) == ("sections", [([(0, 2), (3, 5), (6, 8), (9, 11)], 3)], 0)
+    # 只剩 1 个空闲：合并成两段
+    assert asyncio.run(scenario(3, 2)) == ("sections", [([(0, 5), (6, 11)], 1)], 0)
+    # 没有空闲槽位：整段渲染
+    assert asyncio.run(scenario(2, 2)) == (None, [], 0)
@@ -0,0 +1,71 @@
+import textwrap
+
+import pytest
+
+from section_render import count_scene_animations, plan_sections, merge_sections
+
+
+def _scene(body):
+    lines = textwrap.indent(textwrap.dedent(body).strip(), " " * 8)
+    return f"from manim import *\n\nclass Demo(Scene):\n    def construct(self):\n{lines}\n"
+
+
+def _plays(n):
+    return "\n".join(f"self.play(FadeIn(Dot()))  # {i}" for i in range(n))
+
+
+def test_counts_top_level_animations_and_section_boundaries():
+    code = _scene(_plays(3) + "\nself.next_section()\nself.wait()\n" + _plays(2))
+    assert count_scene_animations(code, "Demo") == (6, [3])
+
+
+@pytest.mark.parametrize("body", [
+    "for i in range(3):\n    self.play(FadeIn(Dot()))",   # 循环里的动画数无法静态确定
+    "if True:\n    self.wait()",
+])
+def test_nested_animations_are_not_countable(body):
+    assert count_scene_animations(_scene(body), "Demo") is None
+
+
+def test_animations_in_helper_methods_are_not_countable():
+    code = _scene(_plays(6)) + "\n    def helper(self):\n        self.play(Create(Circle()))\n"
+    assert count_scene_animations(code, "Demo") is None
+    assert count_scene_animations(_scene(_plays(2)), "Missing") is None
+    assert count_scene_animations("class (", "Demo") is None
+
+
+def test_plan_splits_evenly_into_closed_ranges():
+    assert plan_sections(_scene(_plays(12)), "Demo", max_parts=3, min_animations=4) == [(0, 3), (4, 7), (8, 11)]
+
+
+def test_every_section_keeps_the_minimum_length():
+    plan = plan_sections(_scene(_plays(11)), "Demo", max_parts=4, min_animations=4)
+    assert plan == [(0, 4), (5, 10)]
+    assert all(end - start + 1 >= 4 for start, end in plan)
+    # 不到两段的长度就不分段
+    assert plan_sections(_scene(_plays(7)), "Demo", max_parts=4, min_animations=4) is None
+    # 每段至少 2 个动画 (manim 会把 -n 0,0 的 0 当作未设置)
+    assert plan_sections(_scene(_plays(3)), "Demo", max_parts=3, min_animations=1) is None
+
+
+def test_author_sections_are_the_only_cut_points():
+    code = _scene(_plays(3) + "\nself.next_section()\n" + _plays(9))
+    assert plan_sections(code, "Demo", max_parts=2, min_animations=3) == [(0, 2), (3, 11)]
+    # 边界离两端都太近时放弃分段
+    code = _scene(_plays(1) + "\nself.next_section()\n" + _plays(9))
+    assert plan_sections(code, "Demo", max_parts=2, min_animations=3) is None
+
+
+def test_disabled_when_max_parts_is_below_two():
+    assert plan_sections(_scene(_plays(20)), "Demo", max_parts=1) is None
+
+
+@pytest.mark.parametrize("parts, merged", [
+    (4, [(0, 2), (3, 5), (6, 8), (9, 11)]),
+    (5, [(0, 2), (3, 5), (6, 8), (9, 11)]),
+    (2, [(0, 5), (6, 11)]),
+    (3, [(0, 2), (3, 8), (9, 11)]),
+    (1, None),
+])
+def test_merge_sections_to_the_available_slots(parts, merged):
+    assert merge_sections([(0, 2), (3, 5), (6, 8), (9, 11)], parts) == merged
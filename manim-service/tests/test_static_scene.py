@@ -0,0 +1,58 @@
+import ast
+import asyncio
+import textwrap
+
+import pytest
+
+from static_scene import encode_still_clip, is_static_scene
+
+
+def _static(body):
+    code = "from manim import *\n\nclass Demo(Scene):\n    def construct(self):\n" + textwrap.indent(
+        textwrap.dedent(body), " " * 8)
+    return is_static_scene(ast.parse(code))
+
+
+@pytest.mark.parametrize("body", [
+    "self.add(Circle())",
+    "circle = Circle()\nself.add(circle, MathTex('x^2').next_to(circle))",
+    "self.add(*[Dot().shift(i * RIGHT) for i in range(3)])",
+    "self.next_section('intro')\nself.add(Square())",
+])
+def test_scenes_without_animations_are_static(body):
+    assert _static(body)
+
+
+@pytest.mark.parametrize("body", [
+    "self.play(Create(Circle()))",
+    "self.add(Circle())\nself.wait()",
+    "self.add(Circle())\nself.wait(2)",
+    "self.pause()",
+    "self.wait_until(lambda: True)",
+    "for i in range(3):\n    self.play(FadeIn(Dot()))",
+    "if False:\n    self.wait()",
+])
+def test_any_play_or_wait_makes_the_scene_animated(body):
+    assert not _static(body)
+
+
+def test_animations_in_helper_methods_count():
+    code = textwrap.dedent('''
+        class Demo(Scene):
+            def construct(self):
+                self.add(Circle())
+                self.intro()
+
+            def intro(self):
+                self.play(Write(Text("hi")))
+    ''')
+    assert not is_static_scene(ast.parse(code))
+
+
+def test_missing_ffmpeg_is_reported_not_raised(tmp_path, monkeypatch):
+    monkeypatch.setenv("PATH", str(tmp_path))
+    image = tmp_path / "frame.png"
+    image.write_bytes(b"png")
+    ok, error = asyncio.run(encode_still_clip(str(image), str(tmp_path / "clips" / "frame.mp4")))
+    assert not ok and error
+    assert (tmp_path / "clips").is_dir()
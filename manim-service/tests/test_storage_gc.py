@@ -0,0 +1,133 @@
+import os
+import time
+
+import pytest
+
+from artifact_store import ArtifactStore
+from storage_gc import StorageGC
+
+HOUR = 3600
+
+
+class _Media:
+    """只提供 drain_served 的 MediaFiles 替身 (没有分发记录)"""
+
+    def drain_served(self):
+        return {}
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    static_dir, temp_dir = tmp_path / "static", tmp_path / "temp_gen"
+    for path in (static_dir, temp_dir, static_dir / "streams"):
+        path.mkdir()
+    return static_dir, temp_dir
+
+
+@pytest.fixture
+def store(dirs, tmp_path):
+    static_dir, _ = dirs
+    return ArtifactStore(str(static_dir / "media"), str(tmp_path / "artifacts.db"), url_prefix="/static/media")
+
+
+def _gc(store, dirs, **kwargs):
+    static_dir, temp_dir = dirs
+    return StorageGC(store, _Media(), str(static_dir), str(temp_dir), str(static_dir / "streams"), **kwargs)
+
+
+def _write(path, size=10, age=0):
+    """写一个文件并把 mtime 往前推 age 秒 (内容随文件名不同，入库时不会被去重)"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(path.name.encode().ljust(size, b"x")[:size])
+    _backdate(path, age)
+    return path
+
+
+def _backdate(path, age):
+    when = time.time() - age
+    os.utime(path, (when, when))
+
+
+def _ingest(store, tmp_path, name, size, age, owner=None):
+    artifact = store.ingest(str(_write(tmp_path / name, size)), owner=owner)
+    store._db.execute("UPDATE artifacts SET accessed = accessed - ? WHERE digest = ?", (age, artifact.digest))
+    return artifact
+
+
+def test_orphans_are_judged_by_their_newest_write(store, dirs):
+    _, temp_dir = dirs
+    idle = _write(temp_dir / "req_idle" / "media" / "out.mp4", age=2 * HOUR).parent.parent
+    busy = _write(temp_dir / "req_busy" / "media" / "out.mp4", age=2 * HOUR).parent.parent
+    _write(busy / "media" / "partial.mp4")  # 目录本身很旧，但还有新写入
+    preview = _write(temp_dir / "preview_old" / "preview.png", age=2 * HOUR).parent
+    scratch = _write(temp_dir / "scratch" / "frame.png", age=2 * HOUR).parent
+    for path in (idle, idle / "media", busy, busy / "media", preview, scratch):
+        _backdate(path, 2 * HOUR)
+
+    gc = _gc(store, dirs, orphan_ttl=HOUR)
+    assert gc.collect()["removed"] == 2
+    assert not idle.exists() and not preview.exists()
+    assert busy.exists()
+    assert scratch.exists()  # 长期目录不算孤儿
+    assert gc.stats["orphans_removed"] == 2
+
+
+def test_temp_budget_removes_oldest_orphans_first(store, dirs):
+    _, temp_dir = dirs
+    for name, age in (("req_a", 30 * 60), ("req_b", 20 * 60), ("req_c", 60)):
+        directory = _write(temp_dir / name / "out.mp4", size=100, age=age).parent
+        _backdate(directory, age)
+
+    gc = _gc(store, dirs, orphan_ttl=HOUR, temp_max_bytes=150)
+    gc.collect()
+    # 超出预算时删到预算以内为止；刚写入 (不到 10 分钟) 的目录即使超预算也不动
+    assert sorted(os.listdir(temp_dir)) == ["req_c"]
+    assert gc.stats["temp_bytes"] == 100
+
+
+def test_legacy_files_and_streams_follow_the_retention_period(store, dirs):
+    static_dir, _ = dirs
+    old_video = _write(static_dir / "video_old.mp4", age=2 * HOUR)
+    new_video = _write(static_dir / "video_new.mp4")
+    keep = _write(static_dir / ".gitkeep", size=0, age=2 * HOUR)
+    stale_stream = _write(static_dir / "streams" / "s1" / "index.m3u8", age=2 * HOUR)
+
+    gc = _gc(store, dirs, artifact_ttl=HOUR, orphan_ttl=HOUR)
+    gc.collect()
+    assert not old_video.exists() and not stale_stream.exists()
+    assert new_video.exists() and keep.exists()
+    assert gc.stats["legacy_removed"] == 1 and gc.stats["streams_removed"] == 1
+
+
+def test_static_budget_evicts_legacy_then_unreferenced_artifacts(store, dirs, tmp_path):
+    static_dir, _ = dirs
+    legacy = _write(static_dir / "video_legacy.mp4", size=100, age=HOUR)
+    old = _ingest(store, tmp_path, "old.mp4", 100, age=3 * HOUR)
+    pinned = _ingest(store, tmp_path, "pinned.mp4", 100, age=4 * HOUR, owner="conversation:c")
+    recent = _ingest(store, tmp_path, "recent.mp4", 100, age=2 * HOUR)
+
+    gc = _gc(store, dirs, artifact_ttl=24 * HOUR, static_max_bytes=200)
+    gc.collect()
+    assert not legacy.exists()
+    assert not os.path.exists(old.path)
+    assert os.path.exists(pinned.path) and os.path.exists(recent.path)
+    assert gc.stats["static_bytes"] == 200 and not gc.stats["over_budget"]
+
+    # 只剩被引用的产物时无法再压缩，标记为超预算
+    gc.static_max_bytes = 50
+    gc.collect()
+    assert os.path.exists(pinned.path)
+    assert gc.stats["over_budget"] and gc.stats["pinned_bytes"] == 100
+
+
+def test_hook_failures_do_not_stop_the_run(store, dirs):
+    calls = []
+
+    def broken():
+        calls.append("broken")
+        raise RuntimeError("boom")
+
+    gc = _gc(store, dirs, hooks=[broken, lambda: calls.append("ok")])
+    gc.collect()
+    assert calls == ["broken", "ok"]
+    assert gc.stats["errors"] == 1 and gc.stats["runs"] == 1
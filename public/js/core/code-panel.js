@@ -183,7 +183,8 @@ export class CodePanel {
                 body: JSON.stringify({
                     message: prompt,
                     code: currentCode,
-                    type: 'modification'
+                    type: 'modification',
+                    client_id: localStorage.getItem('icecream_client_id') || undefined
                 }),
                 signal: signal
             });
@@ -7,6 +7,16 @@ import fetch from 'node-fetch';
 
 const MANIM_SERVICE_URL = `http://localhost:${process.env.MANIM_SERVICE_PORT || 8001}`;
 
+// /render 的响应模式：url 只回传地址 (浏览器经 /static 代理拉取视频)，
+// stream 直接转发视频字节，json 为兼容旧调用方的 URL + Base64
+const RENDER_MODES = ['url', 'stream', 'json'];
+const DEFAULT_RENDER_MODE = process.env.MANIM_RENDER_MODE || 'url';
+
+function resolveRenderMode(req) {
+    const mode = req.query?.mode || req.body?.mode || DEFAULT_RENDER_MODE;
+    return RENDER_MODES.includes(mode) ? mode : DEFAULT_RENDER_MODE;
+}
+
 const MANIM_SYSTEM_PROMPT = `你是一个 Manim 动画代码生成专家。用户会告诉你想要可视化什么数学概念，你需要生成对应的 Manim 代码。
 
 规则：
@@ -34,7 +44,7 @@ class MainScene(Scene):
  */
 export async function handleManim(req, res) {
     try {
-        const { message, code } = req.body;
+        const { message, code, clientId, client_id } = req.body;
 
         // 如果直接提供了代码，且没有指令，则视为纯渲染
         if (code && !message) {
@@ -93,7 +103,8 @@ export async function handleManim(req, res) {
         const renderResponse = await fetch(`${MANIM_SERVICE_URL}/render`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ code: extractedCode })
+            // 带上用户标识：调度器按用户轮转，同一用户的新渲染才会顶替旧的
+            body: JSON.stringify({ code: extractedCode, client_id: clientId || client_id || 'anonymous', mode: 'url' })
         });
 
         console.log('[Manim Client] Render response status:', renderResponse.status);
@@ -114,7 +125,7 @@ export async function handleManim(req, res) {
         const renderData = await renderResponse.json();
         console.log('[Manim Client] Render success:', {
             hasVideoUrl: !!renderData.videoUrl,
-            hasBase64: !!renderData.videoBase64
+            size: renderData.size
         });
 
         return res.json({
@@ -123,7 +134,10 @@ export async function handleManim(req, res) {
             code: extractedCode,
             rendered: true,
             videoUrl: renderData.videoUrl, // Flattened
-            videoBase64: renderData.videoBase64
+            sha256: renderData.sha256,
+            imageUrl: renderData.imageUrl, // 静态场景额外提供单帧图片
+            warning: renderData.warning,
+            upgradeId: renderData.upgradeId // 高清版本在后台补渲，可用 GET /api/manim/upgrade/:id 查询
         });
 
     } catch (error) {
@@ -140,7 +154,8 @@ export async function handleManim(req, res) {
  */
 export async function renderCode(req, res) {
     try {
-        const { code } = req.body;
+        const { code, clientId, client_id } = req.body;
+        const mode = resolveRenderMode(req);
 
         if (!code) {
             return res.status(400).json({
@@ -152,7 +167,7 @@ export async function renderCode(req, res) {
         const response = await fetch(`${MANIM_SERVICE_URL}/render`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ code })
+            body: JSON.stringify({ code, client_id: clientId || client_id || 'anonymous', mode })
         });
 
         if (!response.ok) {
@@ -160,13 +175,28 @@ export async function renderCode(req, res) {
             throw new Error(errorData.error || 'Manim 渲染失败');
         }
 
+        if (mode === 'stream') {
+            // 原样转发字节流与元数据头，不在网关缓冲整段视频
+            for (const header of ['content-type', 'content-length', 'etag', 'x-content-sha256', 'x-render-meta']) {
+                const value = response.headers.get(header);
+                if (value) res.setHeader(header, value);
+            }
+            return response.body.pipe(res);
+        }
+
         const data = await response.json();
 
         return res.json({
             success: true,
             rendered: true,
+            cached: data.cached,
             videoUrl: data.videoUrl,
-            videoBase64: data.videoBase64
+            videoBase64: data.videoBase64,
+            sha256: data.sha256,
+            size: data.size,
+            imageUrl: data.imageUrl,
+            warning: data.warning,
+            upgradeId: data.upgradeId
         });
 
     } catch (error) {
@@ -178,6 +208,54 @@ export async function renderCode(req, res) {
     }
 }
 
+/**
+ * 渲染指定时刻 / 指定动画之后的单帧画面 (低分辨率，用于快速检查排版)
+ */
+export async function renderFrame(req, res) {
+    try {
+        const { code, time, animation, format, clientId } = req.body;
+
+        if (!code) {
+            return res.status(400).json({
+                success: false,
+                error: '代码不能为空'
+            });
+        }
+
+        const response = await fetch(`${MANIM_SERVICE_URL}/render/frame`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ code, time, animation, format, client_id: clientId || 'anonymous' })
+        });
+        const data = await response.json().catch(() => ({}));
+        return res.status(response.status).json(data);
+
+    } catch (error) {
+        console.error('[Manim Client] Frame Error:', error);
+        return res.status(500).json({
+            success: false,
+            error: error.message
+        });
+    }
+}
+
+/**
+ * 查询高清补渲状态 (草稿先返回，高清版本在后台渲染)
+ */
+export async function getUpgrade(req, res) {
+    try {
+        const response = await fetch(`${MANIM_SERVICE_URL}/render/${encodeURIComponent(req.params.id)}/upgrade`);
+        const data = await response.json().catch(() => ({}));
+        return res.status(response.status).json(data);
+    } catch (error) {
+        console.error('[Manim Client] Upgrade Error:', error);
+        return res.status(500).json({
+            success: false,
+            error: error.message
+        });
+    }
+}
+
 /**
  * 获取 Manim 服务状态
  */
@@ -209,4 +287,4 @@ export async function getStatus(req, res) {
     }
 }
 
-export default { handleManim, renderCode, getStatus };
+export default { handleManim, renderCode, renderFrame, getUpgrade, getStatus };